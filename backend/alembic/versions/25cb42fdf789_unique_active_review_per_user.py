@@ -0,0 +1,48 @@
+"""unique active review per user and agent
+
+Revision ID: 25cb42fdf789
+Revises: e55da730fb85, ext_agent_fields
+Create Date: 2026-10-19 09:12:40.118245
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '25cb42fdf789'
+down_revision: Union[str, None] = ('e55da730fb85', 'ext_agent_fields')
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 同一用户对同一Agent仅保留最新的一条有效评论，其余软删除
+    op.execute(
+        """
+        UPDATE agent_reviews SET deleted_at = now()
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY agent_id, user_id ORDER BY created_at DESC, id DESC
+                ) AS rn
+                FROM agent_reviews
+                WHERE deleted_at IS NULL
+            ) ranked
+            WHERE ranked.rn > 1
+        )
+        """
+    )
+    op.create_index(
+        'uq_agent_reviews_agent_id_user_id_active',
+        'agent_reviews',
+        ['agent_id', 'user_id'],
+        unique=True,
+        postgresql_where=sa.text('deleted_at IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_agent_reviews_agent_id_user_id_active', table_name='agent_reviews')
@@ -0,0 +1,33 @@
+"""add usage flush marks
+
+Revision ID: 5e0c7b2d9a41
+Revises: b6d1debe9918
+Create Date: 2026-10-19 16:21:08.402317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e0c7b2d9a41'
+down_revision: Union[str, None] = 'b6d1debe9918'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 使用统计写回：每个缓冲最后一次写库的快照ID，重放同一快照时跳过
+    op.create_table('usage_flush_marks',
+        sa.Column('name', sa.String(length=100), nullable=False, comment='缓冲名称'),
+        sa.Column('snapshot_id', sa.String(length=64), nullable=False, comment='最后写库的快照ID'),
+        sa.Column('applied_at', sa.DateTime(), nullable=False, comment='写库时间'),
+        sa.PrimaryKeyConstraint('name'),
+        comment='使用统计写回记录'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('usage_flush_marks')
@@ -0,0 +1,46 @@
+"""add message_archives cold storage table
+
+Revision ID: 883f1040ccbc
+Revises: b1262bb330da
+Create Date: 2026-10-19 13:02:41.208113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '883f1040ccbc'
+down_revision: Union[str, None] = 'b1262bb330da'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('message_archives',
+        sa.Column('conversation_id', sa.Integer(), nullable=False, comment='对话ID'),
+        sa.Column('payload', postgresql.BYTEA(), nullable=True, comment='压缩的消息JSON，恢复后置空'),
+        sa.Column('codec', sa.String(length=10), nullable=False, comment='压缩编码 (zstd/zlib)'),
+        sa.Column('message_count', sa.Integer(), nullable=False, server_default='0', comment='归档消息数'),
+        sa.Column('raw_size', sa.Integer(), nullable=False, server_default='0', comment='压缩前字节数'),
+        sa.Column('archived_at', sa.DateTime(), nullable=False, comment='归档时间'),
+        sa.Column('restored_at', sa.DateTime(), nullable=True, comment='最近一次恢复时间'),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('conversation_id'),
+        comment='消息冷存储'
+    )
+    op.create_index(
+        'ix_message_archives_restored_at',
+        'message_archives',
+        ['restored_at'],
+        postgresql_where=sa.text('restored_at IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    # 注意：payload 非空的归档需先由应用恢复回 messages，否则其中的消息会随冷表一起删除
+    op.drop_index('ix_message_archives_restored_at', table_name='message_archives')
+    op.drop_table('message_archives')
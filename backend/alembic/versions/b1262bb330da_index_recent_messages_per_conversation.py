@@ -0,0 +1,32 @@
+"""index recent messages per conversation
+
+Revision ID: b1262bb330da
+Revises: c84aa35ec966
+Create Date: 2026-10-19 12:16:05.402317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b1262bb330da'
+down_revision: Union[str, None] = 'c84aa35ec966'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 支持按对话倒序取最新消息的键集查询
+    op.create_index(
+        'ix_messages_conversation_id_id_active',
+        'messages',
+        ['conversation_id', sa.text('id DESC')],
+        postgresql_where=sa.text('is_deleted = false')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_conversation_id_id_active', table_name='messages')
@@ -0,0 +1,36 @@
+"""add message content trigram index
+
+Revision ID: b6d1debe9918
+Revises: 883f1040ccbc
+Create Date: 2026-10-19 13:02:41.118503
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6d1debe9918'
+down_revision: Union[str, None] = '883f1040ccbc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # 消息全文搜索：三元组索引支持任意子串的 ILIKE，对不分词的中文同样有效
+    op.create_index(
+        'ix_messages_content_trgm',
+        'messages',
+        ['content'],
+        postgresql_using='gin',
+        postgresql_ops={'content': 'gin_trgm_ops'},
+        postgresql_where=sa.text('is_deleted = false')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_content_trgm', table_name='messages')
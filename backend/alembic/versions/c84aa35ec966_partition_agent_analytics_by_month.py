@@ -0,0 +1,166 @@
+"""partition agent_analytics by month and add rollup watermarks
+
+Revision ID: c84aa35ec966
+Revises: 25cb42fdf789
+Create Date: 2026-10-19 10:03:27.551920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c84aa35ec966'
+down_revision: Union[str, None] = '25cb42fdf789'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+ANALYTICS_COLUMNS = (
+    "id, created_at, updated_at, agent_id, date, period_type, "
+    "new_users, active_users, returning_users, total_conversations, total_messages, "
+    "total_tokens_used, revenue, cost, average_response_time, success_rate, "
+    "satisfaction_score, page_views, unique_visitors, bounce_rate"
+)
+
+
+def _analytics_columns() -> list:
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('agent_analytics_id_seq')"), nullable=False, comment='分析ID'),
+        sa.Column('created_at', sa.DateTime(), nullable=False, comment='创建时间'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, comment='更新时间'),
+        sa.Column('agent_id', sa.Integer(), nullable=False, comment='Agent ID'),
+        sa.Column('date', sa.DateTime(), nullable=False, comment='日期'),
+        sa.Column('period_type', sa.String(length=20), nullable=False, comment='周期类型 (daily/weekly/monthly)'),
+        sa.Column('new_users', sa.Integer(), nullable=False, server_default='0', comment='新用户数'),
+        sa.Column('active_users', sa.Integer(), nullable=False, server_default='0', comment='活跃用户数'),
+        sa.Column('returning_users', sa.Integer(), nullable=False, server_default='0', comment='回访用户数'),
+        sa.Column('total_conversations', sa.Integer(), nullable=False, server_default='0', comment='总对话数'),
+        sa.Column('total_messages', sa.Integer(), nullable=False, server_default='0', comment='总消息数'),
+        sa.Column('total_tokens_used', sa.Integer(), nullable=False, server_default='0', comment='总token使用量'),
+        sa.Column('revenue', sa.Float(), nullable=False, server_default='0.0', comment='收入'),
+        sa.Column('cost', sa.Float(), nullable=False, server_default='0.0', comment='成本'),
+        sa.Column('average_response_time', sa.Float(), nullable=False, server_default='0.0', comment='平均响应时间'),
+        sa.Column('success_rate', sa.Float(), nullable=False, server_default='0.0', comment='成功率'),
+        sa.Column('satisfaction_score', sa.Float(), nullable=False, server_default='0.0', comment='满意度评分'),
+        sa.Column('page_views', sa.Integer(), nullable=False, server_default='0', comment='页面浏览量'),
+        sa.Column('unique_visitors', sa.Integer(), nullable=False, server_default='0', comment='独立访客数'),
+        sa.Column('bounce_rate', sa.Float(), nullable=False, server_default='0.0', comment='跳出率'),
+    ]
+
+
+def upgrade() -> None:
+    # 汇总水位线
+    op.create_table('analytics_watermarks',
+        sa.Column('name', sa.String(length=100), nullable=False, comment='汇总任务名称'),
+        sa.Column('watermark', sa.DateTime(), nullable=False, comment='已处理到的时间点'),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, comment='更新时间'),
+        sa.PrimaryKeyConstraint('name'),
+        comment='分析汇总水位线'
+    )
+
+    # 旧表改名，保留序列供新表继续使用
+    op.drop_index('ix_agent_analytics_id', table_name='agent_analytics')
+    op.drop_index('ix_agent_analytics_date', table_name='agent_analytics')
+    op.drop_index('ix_agent_analytics_agent_id', table_name='agent_analytics')
+    op.rename_table('agent_analytics', 'agent_analytics_unpartitioned')
+    op.execute("ALTER TABLE agent_analytics_unpartitioned ALTER COLUMN id DROP DEFAULT")
+    op.execute("ALTER SEQUENCE agent_analytics_id_seq OWNED BY NONE")
+
+    # 按月范围分区的新表，分区键必须包含在主键和唯一约束中
+    op.create_table('agent_analytics',
+        *_analytics_columns(),
+        sa.ForeignKeyConstraint(['agent_id'], ['agents.id'], ),
+        sa.PrimaryKeyConstraint('id', 'date'),
+        comment='Agent分析数据模型',
+        postgresql_partition_by='RANGE (date)'
+    )
+    op.execute("ALTER SEQUENCE agent_analytics_id_seq OWNED BY agent_analytics.id")
+
+    # 为已有数据及未来三个月创建分区
+    op.execute(
+        """
+        DO $$
+        DECLARE
+            month_start date;
+            last_month date := date_trunc('month', now() + interval '3 months')::date;
+        BEGIN
+            SELECT COALESCE(
+                date_trunc('month', min(date) - interval '6 days')::date,
+                date_trunc('month', now())::date
+            )
+            INTO month_start
+            FROM agent_analytics_unpartitioned;
+
+            WHILE month_start <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF agent_analytics FOR VALUES FROM (%L) TO (%L)',
+                    'agent_analytics_p' || to_char(month_start, 'YYYYMM'),
+                    month_start,
+                    (month_start + interval '1 month')::date
+                );
+                month_start := (month_start + interval '1 month')::date;
+            END LOOP;
+        END $$;
+        """
+    )
+
+    # 迁移数据，同一桶只保留最新的一行
+    op.execute(
+        f"""
+        INSERT INTO agent_analytics ({ANALYTICS_COLUMNS})
+        SELECT DISTINCT ON (agent_id, period_type, date) {ANALYTICS_COLUMNS}
+        FROM agent_analytics_unpartitioned
+        ORDER BY agent_id, period_type, date, updated_at DESC
+        """
+    )
+    op.drop_table('agent_analytics_unpartitioned')
+
+    op.create_index(
+        'uq_agent_analytics_agent_id_period_type_date',
+        'agent_analytics',
+        ['agent_id', 'period_type', 'date'],
+        unique=True
+    )
+    op.create_index(op.f('ix_agent_analytics_agent_id'), 'agent_analytics', ['agent_id'], unique=False)
+    op.create_index(op.f('ix_agent_analytics_date'), 'agent_analytics', ['date'], unique=False)
+    # 汇总任务按 updated_at 扫描有变化的 daily 行
+    op.create_index(
+        'ix_agent_analytics_daily_updated_at',
+        'agent_analytics',
+        ['updated_at'],
+        postgresql_where=sa.text("period_type = 'daily'")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_agent_analytics_daily_updated_at', table_name='agent_analytics')
+    op.drop_index(op.f('ix_agent_analytics_date'), table_name='agent_analytics')
+    op.drop_index(op.f('ix_agent_analytics_agent_id'), table_name='agent_analytics')
+    op.drop_index('uq_agent_analytics_agent_id_period_type_date', table_name='agent_analytics')
+    op.rename_table('agent_analytics', 'agent_analytics_partitioned')
+    op.execute("ALTER TABLE agent_analytics_partitioned ALTER COLUMN id DROP DEFAULT")
+    op.execute("ALTER SEQUENCE agent_analytics_id_seq OWNED BY NONE")
+
+    op.create_table('agent_analytics',
+        *_analytics_columns(),
+        sa.ForeignKeyConstraint(['agent_id'], ['agents.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        comment='Agent分析数据模型'
+    )
+    op.execute("ALTER SEQUENCE agent_analytics_id_seq OWNED BY agent_analytics.id")
+    op.execute(
+        f"""
+        INSERT INTO agent_analytics ({ANALYTICS_COLUMNS})
+        SELECT {ANALYTICS_COLUMNS} FROM agent_analytics_partitioned
+        """
+    )
+    op.drop_table('agent_analytics_partitioned')
+
+    op.create_index(op.f('ix_agent_analytics_agent_id'), 'agent_analytics', ['agent_id'], unique=False)
+    op.create_index(op.f('ix_agent_analytics_date'), 'agent_analytics', ['date'], unique=False)
+    op.create_index(op.f('ix_agent_analytics_id'), 'agent_analytics', ['id'], unique=False)
+
+    op.drop_table('analytics_watermarks')
@@ -1,9 +1,9 @@
 """
 API依赖项
 """
-from typing import AsyncGenerator, Optional
+from typing import Any, AsyncGenerator, Awaitable, Callable, Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -48,6 +48,35 @@ async def get_current_user(
     return mock
 
 
+async def get_current_principal(
+    authorization: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    按 Bearer 访问令牌解析当前用户身份快照（UserPrincipal）
+
+    令牌验证结果与用户身份均有缓存，只需要用户ID、角色、状态的接口应使用本依赖，
+    而不是加载完整的用户对象。
+    get_current_user 目前返回 Mock 用户，接入真实认证时由本依赖替换。
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="未提供访问令牌",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    principal = await UserService(db).resolve_access_token(token)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="访问令牌无效或已过期",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    return principal
+
+
 async def get_current_active_user(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -116,4 +145,109 @@ async def get_conversation_service(db: AsyncSession = Depends(get_db)):
 async def get_api_key_service(db: AsyncSession = Depends(get_db)):
     """获取API密钥服务"""
     from agentpedia.services.api_key_service import APIKeyService
-    return APIKeyService(db)
\ No newline at end of file
+    return APIKeyService(db)
+
+
+async def get_optional_api_key(
+    request: Request,
+    x_api_key: Optional[str] = Header(None, alias="X-API-Key"),
+    db: AsyncSession = Depends(get_db)
+):
+    """解析请求携带的API密钥（未携带时返回None，携带了无效密钥时返回401）"""
+    if not x_api_key:
+        return None
+
+    from agentpedia.services.api_key_service import APIKeyService
+    service = APIKeyService(db)
+    api_key = await service.validate_api_key(x_api_key)
+    if api_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API密钥无效或已过期"
+        )
+
+    await service.update_usage(api_key.id, request.client.host if request.client else None)
+    return api_key
+
+
+class Authorization:
+    """请求内的权限判定（每个请求只解析一次用户权限集，之后每次检查只是一次位运算）"""
+
+    __slots__ = ("user", "permissions")
+
+    def __init__(self, user: User, permissions):
+        self.user = user
+        self.permissions = permissions
+
+    def can(self, code: str) -> bool:
+        """是否拥有指定权限代码"""
+        from agentpedia.services.permission_cache import permission_cache
+        return self.permissions.has_bit(permission_cache.bit(code))
+
+
+async def get_authorization(
+    request: Request,
+    current_user: User = Depends(get_current_active_user)
+) -> Authorization:
+    """解析当前用户的权限集（按请求缓存在 request.state）"""
+    authorization = getattr(request.state, "authorization", None)
+    if authorization is not None and authorization.user is current_user:
+        return authorization
+
+    from agentpedia.services.rbac_service import WILDCARD_PERMISSION, rbac_service
+    permissions = await rbac_service.get_permission_set(current_user.id)
+    # 加载权限代码表，之后的检查都是同步的
+    await rbac_service.get_permission_bit(WILDCARD_PERMISSION)
+
+    authorization = Authorization(current_user, permissions)
+    request.state.authorization = authorization
+    return authorization
+
+
+def require(
+    resource,
+    action,
+    load: Optional[Callable[..., Awaitable[Any]]] = None,
+    owned: Optional[Callable[[Any, User], bool]] = None
+):
+    """
+    权限检查依赖工厂
+
+    Args:
+        resource: 权限资源（PermissionResource）
+        action: 权限动作（PermissionAction）
+        load: 加载目标对象的依赖（同一请求内与端点共享结果，不会重复查询）
+        owned: 所有权谓词 owned(obj, user)：所有者只需拥有 resource.action 权限，
+            其他人需要 resource.manage 权限
+
+    Returns:
+        FastAPI 依赖：提供 load 时返回加载的对象，否则返回当前用户
+    """
+    from agentpedia.models.permission import Permission, PermissionAction
+
+    code = Permission.generate_code(resource, action)
+    manage_code = Permission.generate_code(resource, PermissionAction.MANAGE)
+
+    def deny():
+        return HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权限执行此操作"
+        )
+
+    if load is None:
+        async def dependency(authorization: Authorization = Depends(get_authorization)) -> User:
+            if not (authorization.can(code) or authorization.can(manage_code)):
+                raise deny()
+            return authorization.user
+        return dependency
+
+    async def dependency_with_object(
+        obj: Any = Depends(load),
+        authorization: Authorization = Depends(get_authorization)
+    ) -> Any:
+        if authorization.can(manage_code):
+            return obj
+        if authorization.can(code) and (owned is None or owned(obj, authorization.user)):
+            return obj
+        raise deny()
+    return dependency_with_object
@@ -0,0 +1,87 @@
+"""
+流式响应工具（Server-Sent Events 与 NDJSON）
+"""
+import json
+from typing import AsyncIterator, Optional
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from agentpedia.core.exceptions import AgentPediaException
+from agentpedia.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# 禁止代理缓冲与缓存，保证每个事件立即送达客户端
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(data, event: Optional[str] = None) -> str:
+    """编码一条SSE事件"""
+    if isinstance(data, BaseModel):
+        payload = data.model_dump_json()
+    else:
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in payload.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+
+def format_ndjson(data) -> str:
+    """编码一行NDJSON"""
+    if isinstance(data, BaseModel):
+        return data.model_dump_json() + "\n"
+    return json.dumps(data, ensure_ascii=False, default=str) + "\n"
+
+
+def wants_event_stream(accept: Optional[str]) -> bool:
+    """客户端是否请求了SSE"""
+    return bool(accept) and "text/event-stream" in accept
+
+
+def sse_response(events: AsyncIterator, event: Optional[str] = None) -> StreamingResponse:
+    """
+    将异步迭代器包装为SSE响应
+
+    迭代过程中的异常以 error 事件发送，随后结束流。
+    """
+    async def body():
+        try:
+            async for item in events:
+                yield format_sse(item, event)
+        except AgentPediaException as e:
+            yield format_sse({"detail": e.message, "code": e.code}, "error")
+        except Exception as e:
+            logger.error("SSE stream failed", error=str(e))
+            yield format_sse({"detail": "流式响应失败"}, "error")
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def ndjson_response(items: AsyncIterator, filename: Optional[str] = None) -> StreamingResponse:
+    """
+    将异步迭代器包装为NDJSON响应（每行一个JSON对象）
+
+    迭代过程中的异常以一行 {"error": ...} 结束输出。
+    """
+    async def body():
+        try:
+            async for item in items:
+                yield format_ndjson(item)
+        except AgentPediaException as e:
+            yield format_ndjson({"error": e.message, "code": e.code})
+        except Exception as e:
+            logger.error("NDJSON stream failed", error=str(e))
+            yield format_ndjson({"error": "流式响应失败"})
+
+    headers = {"X-Accel-Buffering": "no"}
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(body(), media_type="application/x-ndjson", headers=headers)
@@ -1,16 +1,21 @@
 """
 Agent API路由
 """
+import hashlib
 from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from agentpedia.api.deps import (
     get_current_active_user,
     get_optional_current_user,
+    get_optional_api_key,
     get_agent_service
 )
+from agentpedia.api.sse import sse_response, wants_event_stream
+# 本模块仍直接捕获服务层抛出的内置 PermissionError，自定义权限异常使用别名
+from agentpedia.core.exceptions import NotFoundError, ValidationError, PermissionError as AccessDeniedError
 from agentpedia.core.logging import get_logger
 from agentpedia.models.user import User
 from agentpedia.schemas.base import APIResponse, PaginatedResponse, PaginationParams
@@ -32,7 +37,11 @@ from agentpedia.schemas.agent import (
     TrafficData,
     RevenueData
 )
+from agentpedia.schemas.analytics import PageViewEvent
 from agentpedia.services.agent_service import AgentService
+from agentpedia.services.analytics_service import analytics_event_buffer
+from agentpedia.services.chat_service import chat_service
+from agentpedia.services.quota_service import QuotaExceededError
 
 router = APIRouter()
 logger = get_logger(__name__)
@@ -616,52 +625,76 @@ async def import_agent(
 async def chat_with_agent(
     agent_id: int,
     chat_data: AgentChat,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_active_user),
-    agent_service: AgentService = Depends(get_agent_service)
+    api_key=Depends(get_optional_api_key)
 ):
-    """与Agent对话"""
+    """与Agent对话（stream=true 或 Accept: text/event-stream 时以SSE流式返回）"""
     try:
-        # 检查Agent是否存在和可访问
-        agent = await agent_service.get(agent_id)
-        if not agent:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Agent不存在"
-            )
-        
-        # 检查访问权限
-        if agent.visibility.value == "private" and agent.owner_id != current_user.id:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="无权限访问此Agent"
-            )
-        
-        # TODO: 实现实际的对话逻辑
-        # 这里应该调用对话服务来处理消息
-        
-        # 暂时返回模拟响应
-        response = AgentChatResponse(
-            message="这是一个模拟响应，实际的对话功能尚未实现。",
-            tokens_used=50,
-            cost=0.001,
-            processing_time=1.5
-        )
-        
-        logger.info(
-            "Chat with agent",
-            agent_id=agent_id,
+        chat = await chat_service.prepare(
             user_id=current_user.id,
-            message_length=len(chat_data.message)
+            message=chat_data.message,
+            agent_id=agent_id,
+            conversation_id=chat_data.conversation_id,
+            api_key=api_key
         )
-        
+    except QuotaExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.message,
+            headers=e.decision.headers()
+        )
+    except NotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except AccessDeniedError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=str(e)
+        )
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    logger.info(
+        "Chat with agent",
+        agent_id=agent_id,
+        user_id=current_user.id,
+        conversation_id=chat.conversation_id,
+        message_length=len(chat_data.message)
+    )
+
+    quota_headers = chat.quota.headers() if chat.quota else {}
+    if chat_data.stream or wants_event_stream(request.headers.get("accept")):
+        stream_response = sse_response(chat_service.stream(chat))
+        stream_response.headers.update(quota_headers)
+        return stream_response
+
+    response.headers.update(quota_headers)
+
+    try:
+        result = await chat_service.complete(chat)
+
+        response = AgentChatResponse(
+            message=result.content,
+            conversation_id=result.conversation_id,
+            message_id=result.message_id,
+            tokens_used=result.tokens_used,
+            response_time=result.processing_time,
+            cost=result.cost
+        )
+
         return APIResponse(
             success=True,
             data=response,
             message="对话成功"
         )
-    
-    except HTTPException:
-        raise
+
     except Exception as e:
         logger.error(
             "Chat with agent failed",
@@ -826,6 +859,11 @@ async def create_review(
                 detail="评论创建后获取失败"
             )
 
+    except NotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -1022,6 +1060,38 @@ async def get_agent_analytics(
         )
 
 
+@router.post("/{agent_id}/views", response_model=APIResponse[dict], status_code=status.HTTP_202_ACCEPTED)
+async def record_agent_view(
+    agent_id: int,
+    request: Request,
+    event: Optional[PageViewEvent] = None,
+    current_user: Optional[User] = Depends(get_optional_current_user)
+):
+    """上报Agent页面浏览（写入缓冲，由后台任务批量入库）"""
+    event = event or PageViewEvent()
+
+    if event.visitor_id:
+        visitor_id = event.visitor_id
+    elif current_user:
+        visitor_id = f"user:{current_user.id}"
+    else:
+        client_host = request.client.host if request.client else ""
+        user_agent = request.headers.get("user-agent", "")
+        visitor_id = hashlib.sha1(f"{client_host}|{user_agent}".encode()).hexdigest()
+
+    try:
+        accepted = await analytics_event_buffer.record_view(agent_id, visitor_id, event.bounced)
+    except Exception as e:
+        logger.warning("Record page view failed", error=str(e), agent_id=agent_id)
+        accepted = False
+
+    return APIResponse(
+        success=True,
+        data={"accepted": accepted},
+        message="浏览记录已接收"
+    )
+
+
 @router.get("/{agent_id}/traffic", response_model=APIResponse[list])
 async def get_agent_traffic(
     agent_id: int,
@@ -5,8 +5,10 @@ from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 import logging
 
-from agentpedia.api.deps import get_current_active_user, get_optional_current_user
+from agentpedia.api.deps import get_optional_current_user, require
 from agentpedia.core.logging import get_logger
+from agentpedia.models.mongodb_models import AgentModel
+from agentpedia.models.permission import PermissionAction, PermissionResource
 from agentpedia.models.user import User
 from agentpedia.schemas.agent_prd import (
     AgentCreate,
@@ -22,6 +24,22 @@ router = APIRouter()
 logger = get_logger(__name__)
 
 
+async def get_agent_or_404(agent_id: str) -> AgentModel:
+    """按路径参数加载Agent（同一请求内权限检查与端点共用）"""
+    agent = await mongodb_agent_service.get_agent_by_id(agent_id)
+    if not agent:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Agent不存在"
+        )
+    return agent
+
+
+def is_agent_owner(agent: AgentModel, user: User) -> bool:
+    """Agent的创建者"""
+    return agent.created_by == str(user.id)
+
+
 @router.get("/", response_model=AgentListResponse)
 async def list_agents(
     page: int = Query(1, ge=1, description="页码"),
@@ -77,12 +95,11 @@ async def list_agents(
 @router.post("/", response_model=AgentResponse, status_code=status.HTTP_201_CREATED)
 async def create_agent(
     agent_data: AgentCreate,
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(require(PermissionResource.AGENT, PermissionAction.CREATE))
 ):
     """创建Agent"""
     try:
         # 创建Agent模型实例
-        from agentpedia.models.mongodb_models import AgentModel
         agent_model = AgentModel(**agent_data.model_dump())
         agent_model.created_by = str(current_user.id)
         
@@ -161,27 +178,13 @@ async def get_agent(
 async def update_agent(
     agent_id: str,
     agent_data: AgentUpdate,
-    current_user: User = Depends(get_current_active_user)
+    existing_agent: AgentModel = Depends(
+        require(PermissionResource.AGENT, PermissionAction.UPDATE, load=get_agent_or_404, owned=is_agent_owner)
+    )
 ):
-    """更新Agent"""
+    """更新Agent（创建者需要 agent.update 权限，其他人需要 agent.manage 权限）"""
     try:
-        # 检查Agent是否存在
-        existing_agent = await mongodb_agent_service.get_agent_by_id(agent_id)
-        if not existing_agent:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Agent不存在"
-            )
-        
-        # 检查权限
-        if existing_agent.created_by != str(current_user.id) and current_user.role != "admin":
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="无权限修改此Agent"
-            )
-        
         # 更新Agent
-        from agentpedia.models.mongodb_models import AgentModel
         update_data = agent_data.model_dump(exclude_unset=True)
         for key, value in update_data.items():
             setattr(existing_agent, key, value)
@@ -210,25 +213,12 @@ async def update_agent(
 @router.delete("/{agent_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_agent(
     agent_id: str,
-    current_user: User = Depends(get_current_active_user)
+    existing_agent: AgentModel = Depends(
+        require(PermissionResource.AGENT, PermissionAction.DELETE, load=get_agent_or_404, owned=is_agent_owner)
+    )
 ):
-    """删除Agent"""
+    """删除Agent（创建者需要 agent.delete 权限，其他人需要 agent.manage 权限）"""
     try:
-        # 检查Agent是否存在
-        existing_agent = await mongodb_agent_service.get_agent_by_id(agent_id)
-        if not existing_agent:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Agent不存在"
-            )
-        
-        # 检查权限
-        if existing_agent.created_by != str(current_user.id) and current_user.role != "admin":
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="无权限删除此Agent"
-            )
-        
         # 删除Agent
         success = await mongodb_agent_service.delete_agent(agent_id)
         if not success:
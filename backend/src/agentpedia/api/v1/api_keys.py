@@ -14,6 +14,7 @@ from agentpedia.schemas.api_key import (
     APIKeyStats, APIKeyUsage, RateLimitInfo
 )
 from agentpedia.services.api_key_service import APIKeyService
+from agentpedia.core.config import settings
 from agentpedia.core.exceptions import NotFoundError, PermissionError, ValidationError
 
 router = APIRouter()
@@ -300,24 +301,14 @@ async def extend_api_key_expiry(
 @router.get("/{key_id}/usage", response_model=APIResponse[APIKeyUsage])
 async def get_api_key_usage(
     key_id: int,
+    hours: int = Query(24, ge=1, le=settings.API_KEY_USAGE_RETENTION_DAYS * 24, description="使用序列的小时数"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取API密钥使用情况"""
+    """获取API密钥使用情况（含每小时使用序列）"""
     try:
         service = APIKeyService(db)
-        api_key = await service.get_api_key_by_id(key_id, current_user.id)
-        
-        # 检查速率限制
-        rate_limit_info = await service.check_rate_limit(key_id)
-        
-        usage_data = APIKeyUsage(
-            key_id=api_key.id,
-            key_name=api_key.name,
-            usage_count=api_key.usage_count,
-            last_used_at=api_key.last_used_at,
-            rate_limit_remaining=rate_limit_info
-        )
+        usage_data = APIKeyUsage(**await service.get_usage(key_id, current_user.id, hours))
         
         return APIResponse(
             success=True,
@@ -2,19 +2,23 @@
 对话相关的API路由
 """
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from agentpedia.api.deps import get_current_user, get_db
+from agentpedia.api.deps import get_current_user, get_db, get_optional_api_key
+from agentpedia.api.sse import ndjson_response, sse_response, wants_event_stream
 from agentpedia.models.conversation import ConversationStatus
 from agentpedia.models.user import User
-from agentpedia.schemas.base import APIResponse, PaginatedResponse
+from agentpedia.schemas.base import APIResponse, CursorPage, PaginatedResponse
 from agentpedia.schemas.conversation import (
     ConversationCreate, ConversationUpdate, ConversationResponse, ConversationDetail,
     MessageCreate, MessageUpdate, MessageResponse, ConversationStats,
-    ChatRequest, ChatResponse
+    MessageSearchResult, ChatRequest, ChatResponse
 )
+from agentpedia.services.chat_service import chat_service
+from agentpedia.services.quota_service import QuotaExceededError
 from agentpedia.services.conversation_service import ConversationService, MessageService
+from agentpedia.core.database import AsyncSessionLocal
 from agentpedia.core.exceptions import NotFoundError, PermissionError
 
 router = APIRouter()
@@ -96,23 +100,57 @@ async def get_conversation_stats(
         )
 
 
+@router.get("/search", response_model=APIResponse[CursorPage[MessageSearchResult]])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description="搜索关键词"),
+    cursor: Optional[str] = Query(None, description="分页游标"),
+    limit: int = Query(20, ge=1, le=50, description="每页数量"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """按消息内容搜索用户的对话"""
+    try:
+        service = MessageService(db)
+        rows, next_cursor = await service.search_messages(current_user.id, q, cursor=cursor, limit=limit)
+        return APIResponse(
+            success=True,
+            data=CursorPage[MessageSearchResult](
+                items=[MessageSearchResult(**row) for row in rows],
+                next_cursor=next_cursor,
+                has_more=next_cursor is not None
+            ),
+            message="搜索成功"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+
 @router.get("/{conversation_id}", response_model=APIResponse[ConversationDetail])
 async def get_conversation(
     conversation_id: int,
+    cursor: Optional[str] = Query(None, description="更早消息的分页游标"),
+    limit: int = Query(50, ge=1, le=100, description="每页消息数量"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取对话详情"""
+    """获取对话详情（附带最新一页消息，更早的消息通过 cursor 翻页）"""
     try:
         service = ConversationService(db)
         conversation = await service.get_conversation_by_id(conversation_id, current_user.id)
+        summary = ConversationResponse.model_validate(conversation)
         
-        # 转换为详情响应
-        conversation_detail = ConversationDetail.model_validate(conversation)
-        conversation_detail.messages = [
-            MessageResponse.model_validate(msg) for msg in conversation.messages
-            if not msg.is_deleted
-        ]
+        messages, next_cursor = await MessageService(db).get_message_page(
+            conversation_id, limit, cursor
+        )
+        conversation_detail = ConversationDetail(
+            **summary.model_dump(),
+            messages=[MessageResponse.model_validate(msg) for msg in messages],
+            next_cursor=next_cursor,
+            has_more=next_cursor is not None
+        )
         
         return APIResponse(
             success=True,
@@ -131,6 +169,34 @@ async def get_conversation(
         )
 
 
+@router.get("/{conversation_id}/export")
+async def export_conversation(
+    conversation_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """以NDJSON流导出对话：首行为对话信息，其后每行一条消息"""
+    try:
+        service = ConversationService(db)
+        conversation = await service.get_conversation_by_id(conversation_id, current_user.id)
+        summary = ConversationResponse.model_validate(conversation)
+    except NotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+
+    async def lines():
+        yield {"type": "conversation", **summary.model_dump(mode="json")}
+        # 响应开始后请求级会话可能已关闭，导出使用独立会话
+        async with AsyncSessionLocal() as session:
+            async for batch in MessageService(session).iter_conversation_messages(conversation_id):
+                for msg in batch:
+                    yield {"type": "message", **MessageResponse.model_validate(msg).model_dump(mode="json")}
+
+    return ndjson_response(lines(), filename=f"conversation-{conversation_id}.ndjson")
+
+
 @router.put("/{conversation_id}", response_model=APIResponse[ConversationResponse])
 async def update_conversation(
     conversation_id: int,
@@ -312,13 +378,62 @@ async def delete_message(
 async def chat_with_agent(
     conversation_id: int,
     chat_request: ChatRequest,
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    api_key=Depends(get_optional_api_key)
 ):
-    """与Agent聊天"""
-    # TODO: 实现实际的聊天逻辑
-    # 这里需要集成AI模型服务
-    raise HTTPException(
-        status_code=status.HTTP_501_NOT_IMPLEMENTED,
-        detail="聊天功能尚未实现"
-    )
\ No newline at end of file
+    """在对话中与Agent聊天（stream=true 或 Accept: text/event-stream 时以SSE流式返回）"""
+    try:
+        chat = await chat_service.prepare(
+            user_id=current_user.id,
+            message=chat_request.message,
+            conversation_id=conversation_id,
+            temperature=chat_request.temperature,
+            max_tokens=chat_request.max_tokens,
+            api_key=api_key
+        )
+    except QuotaExceededError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.message,
+            headers=e.decision.headers()
+        )
+    except NotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    except PermissionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=str(e)
+        )
+
+    quota_headers = chat.quota.headers() if chat.quota else {}
+    if chat_request.stream or wants_event_stream(request.headers.get("accept")):
+        stream_response = sse_response(chat_service.stream(chat))
+        stream_response.headers.update(quota_headers)
+        return stream_response
+
+    response.headers.update(quota_headers)
+
+    try:
+        result = await chat_service.complete(chat)
+        return APIResponse(
+            success=True,
+            data=ChatResponse(
+                conversation_id=result.conversation_id,
+                message_id=result.message_id,
+                content=result.content,
+                tokens_used=result.tokens_used,
+                cost=result.cost,
+                processing_time=result.processing_time
+            ),
+            message="聊天成功"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(e)
+        )
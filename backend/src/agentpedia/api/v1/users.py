@@ -13,6 +13,7 @@ from agentpedia.api.deps import (
 )
 from agentpedia.core.database import get_db
 from agentpedia.core.logging import get_logger
+from agentpedia.core.security import PasswordHasherBusyError
 from agentpedia.models.user import User, UserRole
 from agentpedia.schemas.base import APIResponse, PaginatedResponse, PaginationParams, FilterParams
 from agentpedia.schemas.user import (
@@ -65,6 +66,12 @@ async def register_user(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=str(e)
         )
+    except PasswordHasherBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(
             "User registration failed",
@@ -122,6 +129,12 @@ async def login_user(
     
     except HTTPException:
         raise
+    except PasswordHasherBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(
             "Login failed",
@@ -233,6 +246,12 @@ async def change_password(
     
     except HTTPException:
         raise
+    except PasswordHasherBusyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=e.message,
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(
             "Password change failed",
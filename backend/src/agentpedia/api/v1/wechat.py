@@ -4,6 +4,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import Optional
 
+from agentpedia.api.sse import sse_response
+from agentpedia.core.config import settings
 from agentpedia.services.wechat_auth_service import wechat_auth_service
 from agentpedia.schemas.wechat import (
     WechatLoginResponse,
@@ -35,10 +37,21 @@ async def generate_login_qr_code():
 
 
 @router.get("/status/{session_id}", response_model=LoginStatusResponse)
-async def check_login_status(session_id: str):
-    """检查登录状态"""
+async def check_login_status(
+    session_id: str,
+    wait: int = Query(
+        0,
+        ge=0,
+        le=settings.WECHAT_LOGIN_WAIT_TIMEOUT,
+        description="长轮询：最多等待的秒数，登录完成时立即返回"
+    )
+):
+    """检查登录状态（wait>0 时为长轮询）"""
     try:
-        status_data = await wechat_auth_service.check_login_status(session_id)
+        if wait:
+            status_data = await wechat_auth_service.wait_for_login(session_id, wait)
+        else:
+            status_data = await wechat_auth_service.check_login_status(session_id)
         return LoginStatusResponse(**status_data)
     except HTTPException:
         raise
@@ -50,6 +63,12 @@ async def check_login_status(session_id: str):
         )
 
 
+@router.get("/status/{session_id}/stream")
+async def stream_login_status(session_id: str):
+    """以SSE推送登录状态，登录完成或会话过期后结束"""
+    return sse_response(wechat_auth_service.stream_login_status(session_id), event="status")
+
+
 @router.post("/callback", response_model=TokenResponse)
 async def handle_wechat_callback(request: WechatCallbackRequest):
     """处理微信登录回调"""
@@ -27,6 +27,10 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
     ALGORITHM: str = "HS256"
+    TOKEN_CACHE_SIZE: int = 10000  # 已验证令牌的进程内缓存条目上限
+    PASSWORD_BCRYPT_ROUNDS: int = 12  # bcrypt 成本因子，每加 1 计算时间翻倍
+    PASSWORD_HASH_WORKERS: int = 4  # 密码哈希线程数
+    PASSWORD_HASH_QUEUE_SIZE: int = 64  # 排队等待的哈希任务上限，超出时返回 429
     
     # CORS配置
     BACKEND_CORS_ORIGINS: str = ""
@@ -64,6 +68,16 @@ class Settings(BaseSettings):
             return self.REDIS_URL
         password_part = f":{self.REDIS_PASSWORD}@" if self.REDIS_PASSWORD else ""
         return f"redis://{password_part}{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
+
+    # 进程内近端缓存（Redis 服务端协助的客户端缓存，需要 Redis 6+）
+    REDIS_NEAR_CACHE_ENABLED: bool = False
+    REDIS_NEAR_CACHE_PREFIXES: str = ""  # 逗号分隔的键前缀，只有这些键会被跟踪并缓存
+    REDIS_NEAR_CACHE_SIZE: int = 10000
+    REDIS_NEAR_CACHE_TTL: int = 300  # seconds，兜底有效期
+
+    def get_near_cache_prefixes(self) -> List[str]:
+        """获取近端缓存跟踪的键前缀列表"""
+        return [prefix.strip() for prefix in self.REDIS_NEAR_CACHE_PREFIXES.split(",") if prefix.strip()]
     
     # MongoDB配置
     MONGODB_HOST: str = "localhost"
@@ -96,6 +110,43 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: Optional[str] = None
     OPENAI_API_BASE: str = "https://api.openai.com/v1"
     DEFAULT_MODEL: str = "gpt-3.5-turbo"
+    OPENAI_COST_PER_1K_TOKENS: float = 0.002
+    LLM_DEFAULT_PROVIDER: str = "local"  # 未注册的 model_provider 使用该提供商
+    LLM_REQUEST_TIMEOUT: float = 120.0  # seconds
+    CHAT_DEFAULT_MEMORY_WINDOW: int = 10  # Agent未设置 memory_window 时携带的历史消息数
+    CHAT_DEFAULT_CONTEXT_TOKENS: int = 4096  # Agent未设置 max_tokens 时的上下文token预算
+    CHAT_WINDOW_CACHE_TTL: int = 86400  # seconds
+
+    # 消息归档配置
+    MESSAGE_ARCHIVE_INTERVAL: int = 3600  # seconds
+    MESSAGE_ARCHIVE_INACTIVE_DAYS: int = 90  # 超过该天数未更新的对话会被归档
+    MESSAGE_ARCHIVE_BATCH_SIZE: int = 100  # 每轮归档的对话数
+    MESSAGE_ARCHIVE_ZSTD_LEVEL: int = 10
+
+    # 统计缓存配置
+    STATS_CACHE_TTL: int = 600  # seconds，增量计数器的最长存活时间，到期后从数据库重算
+
+    # 配额配置（API密钥与Agent的分钟/小时/天限额）
+    QUOTA_ENABLED: bool = True
+
+    # API密钥认证缓存配置
+    API_KEY_CACHE_TTL: int = 300  # seconds，有效密钥（不超过密钥过期时间）
+    API_KEY_NEGATIVE_CACHE_TTL: int = 60  # seconds，无效密钥
+    API_KEY_CACHE_TOMBSTONE_TTL: int = 10  # seconds，失效后拒绝回填缓存的时长
+    API_KEY_LOCAL_CACHE_TTL: int = 60  # seconds，进程内缓存上限
+    API_KEY_LOCAL_CACHE_SIZE: int = 10000
+
+    # 用户身份缓存配置
+    USER_CACHE_TTL: int = 300  # seconds
+    USER_CACHE_TOMBSTONE_TTL: int = 10  # seconds，失效后拒绝回填缓存的时长
+    USER_LOCAL_CACHE_TTL: int = 60  # seconds，进程内缓存上限
+    USER_LOCAL_CACHE_SIZE: int = 10000
+
+    # 权限缓存配置
+    RBAC_CACHE_TTL: int = 600  # seconds，编译后的用户权限集（不超过最早的角色分配过期时间）
+    RBAC_LOCAL_CACHE_SIZE: int = 10000
+    RBAC_VERSION_POLL_INTERVAL: float = 1.0  # seconds，订阅断开时轮询权限版本号的最小间隔
+    RBAC_ASSIGNMENT_CLEANUP_INTERVAL: int = 3600  # seconds，停用过期角色分配的间隔
 
     # 微信登录配置
     WECHAT_APP_ID: Optional[str] = None
@@ -103,6 +154,14 @@ class Settings(BaseSettings):
     WECHAT_REDIRECT_URI: Optional[str] = None
     WECHAT_TOKEN: Optional[str] = None
     WECHAT_ENCODING_AES_KEY: Optional[str] = None
+    WECHAT_LOGIN_WAIT_TIMEOUT: int = 25  # seconds，单次长轮询 / SSE 心跳间隔
+    WECHAT_LOGIN_POLL_INTERVAL: float = 1.0  # seconds，订阅不可用时退回轮询的间隔
+    WECHAT_API_BASE: str = "https://api.weixin.qq.com"
+    WECHAT_API_TIMEOUT: float = 5.0  # seconds
+    WECHAT_API_CONNECT_TIMEOUT: float = 3.0  # seconds
+    WECHAT_API_MAX_CONNECTIONS: int = 20
+    WECHAT_APP_TOKEN_REFRESH_MARGIN: int = 300  # seconds，应用级 access_token 提前刷新的时长
+    WECHAT_QR_RENDER_WORKERS: int = 2
 
     # MongoDB配置
     MONGODB_HOST: str = "localhost"
@@ -132,10 +191,33 @@ class Settings(BaseSettings):
     ENABLE_METRICS: bool = True
     METRICS_PORT: int = 9090
     
+    # 分析数据汇总配置
+    ANALYTICS_ROLLUP_INTERVAL: int = 300  # seconds
+    ANALYTICS_WATERMARK_LAG: int = 600  # seconds，水位线回退量，覆盖晚提交的日数据
+    ANALYTICS_MAX_LATENESS_DAYS: int = 7  # 超过该天数的迟到事件将被丢弃
+    ANALYTICS_PARTITION_MONTHS_AHEAD: int = 3
+    ANALYTICS_STREAM_KEY: str = "analytics:page_views"
+    ANALYTICS_STREAM_MAXLEN: int = 1_000_000
+    ANALYTICS_FLUSH_INTERVAL: int = 10  # seconds
+    ANALYTICS_FLUSH_BATCH_SIZE: int = 5000
+
+    # 使用统计写回配置
+    AGENT_USAGE_FLUSH_INTERVAL: int = 15  # seconds
+    API_KEY_USAGE_FLUSH_INTERVAL: int = 15  # seconds
+    API_KEY_USAGE_RETENTION_DAYS: int = 30  # 每小时使用量序列的保留天数
+
     # 限流配置
     RATE_LIMIT_ENABLED: bool = True
     RATE_LIMIT_REQUESTS: int = 100
     RATE_LIMIT_WINDOW: int = 60  # seconds
+    RATE_LIMIT_PROXY_HOPS: int = 0  # 前置可信代理层数，>0 时从 X-Forwarded-For 取客户端IP
+    RATE_LIMIT_LOCAL_LEASE: int = 5  # 令牌充足时每次预扣给本进程的额外令牌数
+    RATE_LIMIT_LEASE_TTL: float = 2.0  # seconds
+    RATE_LIMIT_WALK_THRESHOLD: int = 20  # 连续顺序翻页次数达到该值即封禁
+    RATE_LIMIT_WALK_TTL: int = 600  # seconds，翻页序列的记忆时长
+    RATE_LIMIT_PENALTY_BASE: int = 300  # seconds，首次封禁时长，此后每次翻倍
+    RATE_LIMIT_PENALTY_MAX: int = 86400  # seconds
+    RATE_LIMIT_PENALTY_TTL: int = 86400  # seconds，封禁等级的记忆时长
     
     # 邮件配置
     SMTP_TLS: bool = True
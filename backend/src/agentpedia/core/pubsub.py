@@ -0,0 +1,158 @@
+"""
+Redis 发布/订阅分发器
+
+每个进程只维持一条订阅连接，各模块按频道注册回调，
+连接断开后自动重连并重新订阅全部频道。
+"""
+import asyncio
+import inspect
+from typing import Callable, Dict, List, Optional
+
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+
+logger = get_logger(__name__)
+
+# 始终订阅的频道：没有任何订阅时 listen() 会立即返回
+HUB_CHANNEL = "pubsub:hub"
+
+Handler = Callable[[str, str], object]
+
+
+class PubSubHub:
+    """进程内共享的订阅连接"""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = {}
+        self._reconnect_handlers: List[Callable[[], object]] = []
+        self._connect_handlers: List[Callable[[object], object]] = []
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        """订阅连接是否可用"""
+        return self._pubsub is not None
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        """
+        订阅频道
+
+        Args:
+            channel: 频道名
+            handler: 回调 handler(channel, data)，可以是协程函数
+        """
+        handlers = self._handlers.setdefault(channel, [])
+        handlers.append(handler)
+        if len(handlers) == 1 and self._pubsub is not None:
+            try:
+                await self._pubsub.subscribe(channel)
+            except Exception as e:
+                # 重连时会重新订阅
+                logger.warning("Subscribe failed", channel=channel, error=str(e))
+
+    async def unsubscribe(self, channel: str, handler: Handler) -> None:
+        """取消订阅，频道没有回调时退订"""
+        handlers = self._handlers.get(channel)
+        if not handlers or handler not in handlers:
+            return
+        handlers.remove(handler)
+        if not handlers:
+            del self._handlers[channel]
+            if self._pubsub is not None:
+                try:
+                    await self._pubsub.unsubscribe(channel)
+                except Exception as e:
+                    logger.warning("Unsubscribe failed", channel=channel, error=str(e))
+
+    def on_reconnect(self, handler: Callable[[], object]) -> None:
+        """注册（重新）建立连接后的回调，用于清理断线期间可能过期的本地状态"""
+        self._reconnect_handlers.append(handler)
+
+    def on_connect(self, handler: Callable[[object], object]) -> None:
+        """
+        注册订阅连接建立后、进入订阅模式之前的回调 handler(connection)，
+        用于在该连接上执行订阅模式下不允许的命令（例如 CLIENT TRACKING）
+        """
+        self._connect_handlers.append(handler)
+
+    async def publish(self, channel: str, message: str) -> int:
+        """发布消息，返回收到消息的订阅者数量"""
+        client = redis_manager.redis_client
+        if not client:
+            return 0
+        try:
+            return await client.publish(channel, message)
+        except Exception as e:
+            logger.warning("Publish failed", channel=channel, error=str(e))
+            return 0
+
+    def start(self) -> None:
+        """启动订阅循环"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._listen(), name="pubsub_hub")
+
+    async def stop(self) -> None:
+        """停止订阅循环"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self) -> None:
+        delay = 1
+        while True:
+            client = redis_manager.redis_client
+            if client is None:
+                await asyncio.sleep(delay)
+                continue
+
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                if self._connect_handlers:
+                    await pubsub.connect()
+                    for handler in self._connect_handlers:
+                        await self._call(handler, pubsub.connection)
+                await pubsub.subscribe(HUB_CHANNEL, *self._handlers)
+                self._pubsub = pubsub
+                delay = 1
+                for handler in self._reconnect_handlers:
+                    await self._call(handler)
+                logger.info("Pub/sub connected", channels=len(self._handlers))
+
+                async for message in pubsub.listen():
+                    if message["type"] in ("message", "pmessage"):
+                        await self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Pub/sub connection lost", error=str(e))
+            finally:
+                self._pubsub = None
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    async def _dispatch(self, channel: str, data: str) -> None:
+        for handler in list(self._handlers.get(channel, ())):
+            await self._call(handler, channel, data)
+
+    @staticmethod
+    async def _call(handler: Callable, *args) -> None:
+        try:
+            result = handler(*args)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error("Pub/sub handler failed", error=str(e))
+
+
+# 创建全局发布/订阅分发器实例
+pubsub_hub = PubSubHub()
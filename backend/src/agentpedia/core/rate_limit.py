@@ -0,0 +1,269 @@
+"""
+全局限流中间件
+
+按客户端IP与路由分组使用 Redis 令牌桶限流，并识别爬虫特征施加逐级加重的封禁：
+- 进程内预过滤：桶内令牌充足时一次预扣多个令牌作为本地租约，
+  租约有效期内同一IP的请求不再访问 Redis；已被封禁的IP在本地直接拒绝
+- 爬虫识别：连续顺序翻页（page=1,2,3,...）超过阈值即封禁，
+  同一IP再次触发时封禁时长翻倍
+"""
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+
+# 路由分组：(名称, 匹配API前缀之后路径的正则, 相对 RATE_LIMIT_REQUESTS 的倍数)
+ROUTE_GROUPS = (
+    ("auth", re.compile(r"^/(users/(login|register|refresh|reset-password|change-password|verify-email)|wechat/(qrcode|callback))"), 0.2),
+    ("chat", re.compile(r"/chat/?$"), 0.5),
+    ("browse", re.compile(r"^/(agents-prd|agents|search)(/|$)"), 1.0),
+)
+DEFAULT_GROUP = ("default", None, 1.0)
+
+# 只有这些分组会记录翻页序列
+WALK_GROUPS = {"browse"}
+
+# 本地状态最多保留的条目数
+LOCAL_STATE_SIZE = 10000
+
+# KEYS: 令牌桶, 封禁键, 翻页记录, 惩罚等级
+# ARGV: capacity, refill_per_ms, cost, page(-1 表示不记录), walk_threshold, walk_ttl_ms,
+#       penalty_base_ms, penalty_max_ms, penalty_ttl_ms
+# 返回: allowed, granted, remaining, retry_after_ms, penalized
+RATE_LIMIT_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local blocked = redis.call('PTTL', KEYS[2])
+if blocked > 0 then
+    return {0, 0, 0, blocked, 1}
+end
+
+local page = tonumber(ARGV[4])
+if page >= 0 then
+    local last = tonumber(redis.call('HGET', KEYS[3], 'last') or '-2')
+    local streak = 0
+    if page == last + 1 then
+        streak = redis.call('HINCRBY', KEYS[3], 'streak', 1)
+    else
+        redis.call('HSET', KEYS[3], 'streak', 0)
+    end
+    redis.call('HSET', KEYS[3], 'last', page)
+    redis.call('PEXPIRE', KEYS[3], ARGV[6])
+
+    if streak >= tonumber(ARGV[5]) then
+        local level = redis.call('INCR', KEYS[4])
+        redis.call('PEXPIRE', KEYS[4], ARGV[9])
+        local block = math.min(tonumber(ARGV[7]) * 2 ^ (level - 1), tonumber(ARGV[8]))
+        redis.call('SET', KEYS[2], level, 'PX', math.floor(block))
+        redis.call('DEL', KEYS[3])
+        return {0, 0, 0, math.floor(block), 1}
+    end
+end
+
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+if tokens < 1 then
+    return {0, 0, 0, math.ceil((1 - tokens) / rate), 0}
+end
+
+-- 只有桶内令牌超过一半时才预扣本地租约
+local granted = 1
+if tokens - cost >= capacity / 2 then
+    granted = cost
+end
+tokens = tokens - granted
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1000)
+return {1, granted, math.floor(tokens), 0, 0}
+"""
+
+
+class RateLimitMiddleware:
+    """按IP与路由分组限流的中间件"""
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = get_logger("rate_limit")
+        self._script = redis_manager.register_script(RATE_LIMIT_SCRIPT)
+        self._exempt = {
+            "/health",
+            f"{settings.API_V1_STR}/docs",
+            f"{settings.API_V1_STR}/redoc",
+            f"{settings.API_V1_STR}/openapi.json",
+        }
+        # (分组, IP) -> [剩余本地令牌, 过期时间]
+        self._leases: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+        # (分组或 "*", IP) -> 解封时间
+        self._blocked: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path in self._exempt:
+            await self.app(scope, receive, send)
+            return
+
+        ip = self._client_ip(scope)
+        group, factor = self._route_group(path)
+        page = self._walk_page(scope, group)
+
+        retry_after = self._check_local(group, ip, page)
+        if retry_after is None:
+            retry_after = await self._check_redis(group, factor, ip, page, path)
+
+        if retry_after:
+            await self._reject(send, retry_after)
+            return
+
+        await self.app(scope, receive, send)
+
+    def _client_ip(self, scope) -> str:
+        """客户端IP（配置了可信代理层数时从 X-Forwarded-For 中取）"""
+        hops = settings.RATE_LIMIT_PROXY_HOPS
+        if hops > 0:
+            for name, value in scope.get("headers", []):
+                if name == b"x-forwarded-for":
+                    addresses = [a.strip() for a in value.decode("latin-1").split(",") if a.strip()]
+                    if addresses:
+                        return addresses[max(len(addresses) - hops, 0)]
+                    break
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def _route_group(self, path: str) -> Tuple[str, float]:
+        """请求所属的路由分组及其限额倍数"""
+        prefix = settings.API_V1_STR
+        relative = path[len(prefix):] if path.startswith(prefix) else path
+        for name, pattern, factor in ROUTE_GROUPS:
+            if pattern.search(relative):
+                return name, factor
+        return DEFAULT_GROUP[0], DEFAULT_GROUP[2]
+
+    def _walk_page(self, scope, group: str) -> int:
+        """需要记录翻页序列时返回页码，否则返回 -1"""
+        if group not in WALK_GROUPS or scope["method"] != "GET":
+            return -1
+        query = scope.get("query_string", b"")
+        if b"page=" not in query:
+            return -1
+        values = parse_qs(query.decode("latin-1")).get("page")
+        if not values or not values[0].isdigit():
+            return -1
+        return int(values[0])
+
+    def _check_local(self, group: str, ip: str, page: int) -> Optional[float]:
+        """
+        进程内预过滤
+
+        Returns:
+            需要等待的秒数（拒绝）、0（放行）或 None（需要询问 Redis）
+        """
+        now = time.monotonic()
+        for key in (("*", ip), (group, ip)):
+            until = self._blocked.get(key)
+            if until is not None:
+                if until > now:
+                    return until - now
+                del self._blocked[key]
+
+        # 翻页请求必须经过 Redis 才能识别跨进程的翻页序列
+        if page >= 0:
+            return None
+
+        lease = self._leases.get((group, ip))
+        if lease is not None:
+            if lease[1] > now and lease[0] > 0:
+                lease[0] -= 1
+                return 0
+            del self._leases[(group, ip)]
+        return None
+
+    async def _check_redis(self, group: str, factor: float, ip: str, page: int, path: str) -> float:
+        """在 Redis 中扣减令牌，返回需要等待的秒数（0 表示放行）"""
+        client = redis_manager.redis_client
+        if not client:
+            return 0
+
+        capacity = max(int(settings.RATE_LIMIT_REQUESTS * factor), 1)
+        refill_per_ms = capacity / (settings.RATE_LIMIT_WINDOW * 1000)
+        cost = 1 if page >= 0 else 1 + settings.RATE_LIMIT_LOCAL_LEASE
+
+        try:
+            allowed, granted, _, retry_after_ms, penalized = await self._script(
+                keys=[
+                    f"ratelimit:{group}:{ip}",
+                    f"ratelimit:block:{ip}",
+                    f"ratelimit:walk:{ip}",
+                    f"ratelimit:penalty:{ip}",
+                ],
+                args=[
+                    capacity,
+                    refill_per_ms,
+                    cost,
+                    page,
+                    settings.RATE_LIMIT_WALK_THRESHOLD,
+                    settings.RATE_LIMIT_WALK_TTL * 1000,
+                    settings.RATE_LIMIT_PENALTY_BASE * 1000,
+                    settings.RATE_LIMIT_PENALTY_MAX * 1000,
+                    settings.RATE_LIMIT_PENALTY_TTL * 1000,
+                ]
+            )
+        except Exception as e:
+            # 限流不能成为单点故障，Redis 异常时放行
+            self.logger.warning("Rate limit check failed", error=str(e))
+            return 0
+
+        now = time.monotonic()
+        if int(allowed):
+            granted = int(granted)
+            if granted > 1:
+                self._remember(self._leases, (group, ip), [granted - 1, now + settings.RATE_LIMIT_LEASE_TTL])
+            return 0
+
+        retry_after = int(retry_after_ms) / 1000
+        key = ("*", ip) if int(penalized) else (group, ip)
+        self._remember(self._blocked, key, now + retry_after)
+        if int(penalized):
+            self.logger.warning("Client blocked", ip=ip, path=path, retry_after=retry_after)
+        return retry_after
+
+    @staticmethod
+    def _remember(store: OrderedDict, key, value) -> None:
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > LOCAL_STATE_SIZE:
+            store.popitem(last=False)
+
+    async def _reject(self, send, retry_after: float) -> None:
+        body = json.dumps({"detail": "请求过于频繁，请稍后再试"}, ensure_ascii=False).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(math.ceil(retry_after), 1)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,15 +1,326 @@
 """
 Redis连接和缓存管理
+
+除单键命令外提供批量接口：mget_json / mset_json、
+把多条命令合并为一次往返的 pipeline()，以及按 SHA 调用的 Lua 脚本注册表。
+cache_result 装饰器提供跨进程共享、防击穿、可按标签失效的函数结果缓存。
+near_cache 是可选的进程内近端缓存：热点键的读取命中本地内存，
+由 Redis 的客户端缓存跟踪（CLIENT TRACKING）在键变更时通知淘汰。
 """
+import asyncio
+import functools
+import hashlib
+import inspect
 import json
-from typing import Any, Optional, Union
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, is_dataclass
+from datetime import date, datetime, time as time_type
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Dict, Generic, Iterable, List, Optional, Sequence, TypeVar, Union
 
 import redis.asyncio as redis
 from redis.asyncio import Redis
+from redis.exceptions import NoScriptError
 
 from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
 
 settings = get_settings()
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+def _loads(value: Optional[str]) -> Optional[Union[dict, list]]:
+    """解析JSON缓存值，缺失或格式错误时返回 None"""
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        return None
+
+
+def _dumps(value: Union[str, dict, list]) -> str:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class LuaScript:
+    """已注册的 Lua 脚本：按 SHA 调用（EVALSHA），服务端缺失时自动加载"""
+
+    def __init__(self, manager: "RedisManager", source: str):
+        self._manager = manager
+        self.source = source
+        self.sha = hashlib.sha1(source.encode()).hexdigest()
+
+    async def __call__(self, keys: Sequence = (), args: Sequence = ()) -> Any:
+        return await self._manager.run_script(self, keys, args)
+
+
+class PipelineResult(Generic[T]):
+    """管道中一条命令的结果，管道执行后可用"""
+
+    __slots__ = ("_value", "_done")
+
+    def __init__(self):
+        self._value = None
+        self._done = False
+
+    @property
+    def value(self) -> T:
+        if not self._done:
+            raise RuntimeError("管道尚未执行")
+        return self._value
+
+    def _resolve(self, value) -> None:
+        self._value = value
+        self._done = True
+
+
+class RedisPipeline:
+    """
+    批量命令
+
+    排队的命令在 execute()（或退出 redis_manager.pipeline() 上下文）时一次往返发送，
+    每条命令返回 PipelineResult，执行后按与 RedisManager 对应方法相同的类型取值。
+    Redis 不可用时不发送任何命令，结果为对应方法在无连接时的默认值。
+    """
+
+    def __init__(self, manager: "RedisManager", pipe=None):
+        self._manager = manager
+        self._pipe = pipe
+        # (结果, 转换函数, 无连接时的默认值)
+        self._pending: List[tuple] = []
+        self._scripts: Dict[str, LuaScript] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _queue(self, command: Callable, convert: Optional[Callable], default: Any) -> PipelineResult:
+        result = PipelineResult()
+        if self._pipe is not None:
+            command(self._pipe)
+        self._pending.append((result, convert, default))
+        return result
+
+    def get(self, key: str) -> PipelineResult[Optional[str]]:
+        return self._queue(lambda p: p.get(key), None, None)
+
+    def get_json(self, key: str) -> PipelineResult[Optional[Union[dict, list]]]:
+        return self._queue(lambda p: p.get(key), _loads, None)
+
+    def set(
+        self,
+        key: str,
+        value: Union[str, dict, list],
+        expire: Optional[int] = None
+    ) -> PipelineResult[bool]:
+        return self._queue(lambda p: p.set(key, _dumps(value), ex=expire), bool, False)
+
+    def set_json(
+        self,
+        key: str,
+        value: Union[dict, list],
+        expire: Optional[int] = None
+    ) -> PipelineResult[bool]:
+        return self.set(key, json.dumps(value, ensure_ascii=False), expire)
+
+    def delete(self, *keys: str) -> PipelineResult[int]:
+        return self._queue(lambda p: p.delete(*keys), int, 0)
+
+    def exists(self, key: str) -> PipelineResult[bool]:
+        return self._queue(lambda p: p.exists(key), bool, False)
+
+    def expire(self, key: str, seconds: int) -> PipelineResult[bool]:
+        return self._queue(lambda p: p.expire(key, seconds), bool, False)
+
+    def incr(self, key: str, amount: int = 1) -> PipelineResult[int]:
+        return self._queue(lambda p: p.incr(key, amount), int, 0)
+
+    def decr(self, key: str, amount: int = 1) -> PipelineResult[int]:
+        return self._queue(lambda p: p.decr(key, amount), int, 0)
+
+    def hgetall(self, key: str) -> PipelineResult[dict]:
+        return self._queue(lambda p: p.hgetall(key), dict, {})
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> PipelineResult[int]:
+        return self._queue(lambda p: p.hincrby(key, field, amount), int, 0)
+
+    def sadd(self, key: str, *values: Any) -> PipelineResult[int]:
+        return self._queue(lambda p: p.sadd(key, *values), int, 0)
+
+    def srem(self, key: str, *values: Any) -> PipelineResult[int]:
+        return self._queue(lambda p: p.srem(key, *values), int, 0)
+
+    def smembers(self, key: str) -> PipelineResult[set]:
+        return self._queue(lambda p: p.smembers(key), set, set())
+
+    def sismember(self, key: str, value: Any) -> PipelineResult[bool]:
+        return self._queue(lambda p: p.sismember(key, value), bool, False)
+
+    def script(self, script: LuaScript, keys: Sequence = (), args: Sequence = ()) -> PipelineResult[Any]:
+        """按 SHA 调用已注册的脚本"""
+        self._scripts[script.sha] = script
+        return self._queue(lambda p: p.evalsha(script.sha, len(keys), *keys, *args), None, None)
+
+    async def execute(self) -> List[Any]:
+        """发送排队的命令，返回各命令的结果（同时写入各 PipelineResult）"""
+        pending, self._pending = self._pending, []
+        scripts, self._scripts = self._scripts, {}
+        if not pending:
+            return []
+
+        if self._pipe is None:
+            for result, _, default in pending:
+                result._resolve(default)
+            return [default for _, _, default in pending]
+
+        if scripts:
+            await self._manager.load_scripts(scripts.values())
+        try:
+            values = await self._pipe.execute()
+        except NoScriptError:
+            # 服务端脚本缓存被清空（重启或 SCRIPT FLUSH），下次执行前重新加载
+            self._manager.forget_scripts()
+            raise
+
+        converted = []
+        for (result, convert, default), value in zip(pending, values):
+            if convert is not None:
+                value = default if value is None else convert(value)
+            result._resolve(value)
+            converted.append(value)
+        return converted
+
+
+# 服务端发送失效通知的频道（RESP2 下通过 REDIRECT 投递到订阅连接）
+INVALIDATION_CHANNEL = "__redis__:invalidate"
+
+
+class NearCache:
+    """
+    进程内近端缓存
+
+    订阅连接（pubsub_hub）建立时在该连接上开启
+    CLIENT TRACKING ON REDIRECT <自身ID> BCAST PREFIX ...，
+    服务端在被跟踪前缀下的任何键变更时向该连接推送失效通知。
+    跟踪与订阅共用一条连接：连接断开时跟踪随之失效，此时绕过本地缓存，重连后清空。
+    读取过程中收到的失效通知会使这次读取结果不被写入本地缓存，避免回填旧值。
+    """
+
+    def __init__(self, manager: "RedisManager"):
+        self._manager = manager
+        self.prefixes = tuple(settings.get_near_cache_prefixes())
+        # 键 -> (过期时间, 值)；值为 None 表示键不存在
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()
+        # 键 -> 进行中的读取标记，收到失效通知时移除
+        self._loading: Dict[str, object] = {}
+        self._tracking = False
+        self._hub = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        """跟踪已开启且订阅连接可用"""
+        return self._tracking and self._hub is not None and self._hub.connected
+
+    async def start(self) -> None:
+        """注册到订阅连接（需在 pubsub_hub.start() 之前调用）"""
+        if not settings.REDIS_NEAR_CACHE_ENABLED:
+            return
+        if not self.prefixes:
+            # 不限前缀的广播模式会把每一次写入都推送给每个进程
+            logger.warning("Near cache enabled without REDIS_NEAR_CACHE_PREFIXES, disabled")
+            return
+
+        from agentpedia.core.pubsub import pubsub_hub
+
+        self._hub = pubsub_hub
+        pubsub_hub.on_connect(self._enable_tracking)
+        await pubsub_hub.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+
+    async def _enable_tracking(self, connection) -> None:
+        # 断线期间可能错过失效通知；在其他模块的重连回调读取热点键之前清空
+        self._tracking = False
+        self.clear()
+        try:
+            await connection.send_command("CLIENT", "ID")
+            client_id = await connection.read_response()
+            args = ["CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST"]
+            for prefix in self.prefixes:
+                args.extend(["PREFIX", prefix])
+            await connection.send_command(*args)
+            await connection.read_response()
+        except Exception as e:
+            logger.warning("Enable client tracking failed", error=str(e))
+            return
+        self._tracking = True
+
+    def _on_invalidate(self, channel: str, keys) -> None:
+        # FLUSHDB / FLUSHALL 时通知内容为空
+        if keys is None:
+            self.clear()
+            return
+        for key in [keys] if isinstance(keys, str) else keys:
+            self._local.pop(key, None)
+            self._loading.pop(key, None)
+
+    def clear(self) -> None:
+        self._local.clear()
+        self._loading.clear()
+
+    def tracks(self, key: str) -> bool:
+        return bool(self.prefixes) and key.startswith(self.prefixes)
+
+    async def get(self, key: str) -> Optional[str]:
+        """读取键：被跟踪的键先查本地缓存，未命中时从 Redis 读取并缓存"""
+        client = self._manager.redis_client
+        if not client:
+            return None
+        if not self.enabled or not self.tracks(key):
+            return await client.get(key)
+
+        entry = self._local.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._local[key]
+
+        self.misses += 1
+        marker = object()
+        self._loading[key] = marker
+        try:
+            value = await client.get(key)
+        finally:
+            loaded = self._loading.get(key) is marker
+            if loaded:
+                del self._loading[key]
+
+        # 读取期间没有收到失效通知才写入
+        if loaded and self.enabled:
+            self._local[key] = (time.monotonic() + settings.REDIS_NEAR_CACHE_TTL, value)
+            self._local.move_to_end(key)
+            while len(self._local) > settings.REDIS_NEAR_CACHE_SIZE:
+                self._local.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": len(self._local),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
 
 
 class RedisManager:
@@ -17,9 +328,14 @@ class RedisManager:
     
     def __init__(self):
         self.redis_client: Optional[Redis] = None
+        self.near_cache = NearCache(self)
+        # SHA -> 脚本；以及已确认加载到服务端的 SHA
+        self._scripts: Dict[str, LuaScript] = {}
+        self._loaded_scripts: set = set()
     
     async def init_redis(self) -> None:
         """初始化Redis连接"""
+        self._loaded_scripts.clear()
         self.redis_client = redis.from_url(
             settings.get_redis_url(),
             encoding="utf-8",
@@ -29,6 +345,7 @@ class RedisManager:
     
     async def close_redis(self) -> None:
         """关闭Redis连接"""
+        self.near_cache.clear()
         if self.redis_client:
             await self.redis_client.close()
     
@@ -73,13 +390,15 @@ class RedisManager:
     
     async def get_json(self, key: str) -> Optional[Union[dict, list]]:
         """获取JSON格式的缓存值"""
-        value = await self.get(key)
-        if value:
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return None
-        return None
+        return _loads(await self.get(key))
+
+    async def get_cached(self, key: str) -> Optional[str]:
+        """获取缓存值，热点键（REDIS_NEAR_CACHE_PREFIXES）优先读取进程内近端缓存"""
+        return await self.near_cache.get(key)
+
+    async def get_json_cached(self, key: str) -> Optional[Union[dict, list]]:
+        """获取JSON格式的缓存值，热点键优先读取进程内近端缓存（每次返回新的对象）"""
+        return _loads(await self.near_cache.get(key))
     
     async def set_json(
         self,
@@ -157,6 +476,83 @@ class RedisManager:
             return []
         return await self.redis_client.lrange(key, start, end)
 
+    async def mget_json(self, keys: Sequence[str]) -> List[Optional[Union[dict, list]]]:
+        """批量获取JSON格式的缓存值（一次往返），结果与 keys 一一对应"""
+        if not self.redis_client or not keys:
+            return [None] * len(keys)
+        return [_loads(value) for value in await self.redis_client.mget(keys)]
+
+    async def mset_json(
+        self,
+        mapping: Dict[str, Union[dict, list]],
+        expire: Optional[int] = None
+    ) -> bool:
+        """批量设置JSON格式的缓存值（一次往返）"""
+        if not self.redis_client or not mapping:
+            return False
+        if expire is None:
+            return await self.redis_client.mset(
+                {key: json.dumps(value, ensure_ascii=False) for key, value in mapping.items()}
+            )
+        # MSET 不支持过期时间，改用管道
+        async with self.pipeline() as pipe:
+            results = [pipe.set_json(key, value, expire) for key, value in mapping.items()]
+        return all(result.value for result in results)
+
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = False) -> AsyncIterator[RedisPipeline]:
+        """
+        批量命令上下文：退出时一次往返发送排队的命令
+
+        Example:
+            async with redis_manager.pipeline() as pipe:
+                views = pipe.incr("views:1")
+                agent = pipe.get_json("agent:1")
+            print(views.value, agent.value)
+        """
+        if not self.redis_client:
+            batch = RedisPipeline(self)
+            yield batch
+            await batch.execute()
+            return
+
+        async with self.redis_client.pipeline(transaction=transaction) as pipe:
+            batch = RedisPipeline(self, pipe)
+            yield batch
+            await batch.execute()
+
+    def register_script(self, source: str) -> LuaScript:
+        """注册 Lua 脚本（相同内容只注册一次），返回可按 SHA 调用的脚本对象"""
+        script = LuaScript(self, source)
+        return self._scripts.setdefault(script.sha, script)
+
+    async def run_script(self, script: LuaScript, keys: Sequence = (), args: Sequence = ()) -> Any:
+        """按 SHA 执行脚本，服务端没有该脚本时加载后重试"""
+        if not self.redis_client:
+            return None
+        try:
+            result = await self.redis_client.evalsha(script.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            await self.redis_client.script_load(script.source)
+            result = await self.redis_client.evalsha(script.sha, len(keys), *keys, *args)
+        self._loaded_scripts.add(script.sha)
+        return result
+
+    async def load_scripts(self, scripts: Iterable[LuaScript]) -> None:
+        """确保脚本已加载到服务端（管道中的 EVALSHA 无法在出错时单独重试）"""
+        missing = [script for script in scripts if script.sha not in self._loaded_scripts]
+        if not missing or not self.redis_client:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for script in missing:
+            pipe.script_load(script.source)
+        await pipe.execute()
+        self._loaded_scripts.update(script.sha for script in missing)
+
+    def forget_scripts(self) -> None:
+        """服务端脚本缓存被清空后调用，下次使用前重新加载"""
+        self._loaded_scripts.clear()
+
 
 # 创建全局Redis管理器实例
 redis_manager = RedisManager()
@@ -168,23 +564,305 @@ async def get_redis() -> RedisManager:
 
 
 # 缓存装饰器
-def cache_result(expire: int = 300, key_prefix: str = ""):
-    """缓存结果装饰器"""
+
+CACHE_KEY_PREFIX = "cache"
+
+# 默认不参与缓存键的参数（实例、数据库会话等每次调用都不同的对象）
+UNKEYED_ARGS = frozenset({"self", "cls", "db", "session"})
+
+# 等待其他进程计算结果时的轮询间隔
+CACHE_LOCK_POLL_INTERVAL = 0.05
+
+# KEYS[1]: 缓存键, KEYS[2..]: 标签集合; ARGV[1]: 值, ARGV[2]: TTL（毫秒）
+CACHE_STORE_SCRIPT = """
+local ttl = tonumber(ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ttl)
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    if redis.call('PTTL', KEYS[i]) < ttl then
+        redis.call('PEXPIRE', KEYS[i], ttl)
+    end
+end
+return 1
+"""
+
+# KEYS: 标签集合；删除集合中记录的全部缓存键及集合本身
+CACHE_INVALIDATE_TAGS_SCRIPT = """
+local deleted = 0
+for _, tag in ipairs(KEYS) do
+    local keys = redis.call('SMEMBERS', tag)
+    for i = 1, #keys, 500 do
+        deleted = deleted + redis.call('DEL', unpack(keys, i, math.min(i + 499, #keys)))
+    end
+    redis.call('DEL', tag)
+end
+return deleted
+"""
+
+# 只释放自己持有的锁
+CACHE_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_store_script = redis_manager.register_script(CACHE_STORE_SCRIPT)
+_invalidate_tags_script = redis_manager.register_script(CACHE_INVALIDATE_TAGS_SCRIPT)
+_release_lock_script = redis_manager.register_script(CACHE_RELEASE_LOCK_SCRIPT)
+
+# 后台刷新任务（保留引用避免被回收）
+_refresh_tasks: set = set()
+
+# 未能取得计算锁（结果由其他进程计算）
+_NOT_COMPUTED = object()
+
+
+def _canonical(value: Any) -> Any:
+    """把参数转换为可稳定序列化的值（跨进程、跨重启一致）"""
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date, time_type)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    if is_dataclass(value) and not isinstance(value, type):
+        return asdict(value)
+    raise TypeError(f"无法为 {type(value).__name__} 类型的参数生成稳定的缓存键")
+
+
+def canonical_cache_key(namespace: str, arguments: Dict[str, Any]) -> str:
+    """按参数的规范化 JSON 生成缓存键"""
+    payload = json.dumps(arguments, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_canonical)
+    digest = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+    return f"{CACHE_KEY_PREFIX}:{namespace}:{digest}"
+
+
+def tag_key(tag: str) -> str:
+    return f"{CACHE_KEY_PREFIX}:tag:{tag}"
+
+
+async def invalidate_tags(*tags: str) -> int:
+    """删除带有任一标签的全部缓存条目，返回删除的条目数"""
+    if not tags or not redis_manager.redis_client:
+        return 0
+    try:
+        return int(await _invalidate_tags_script(keys=[tag_key(tag) for tag in tags]) or 0)
+    except Exception as e:
+        logger.warning("Invalidate cache tags failed", tags=list(tags), error=str(e))
+        return 0
+
+
+@dataclass(slots=True)
+class CacheEntry:
+    """缓存条目：值、逻辑过期时间（Unix 时间戳）与上次计算耗时"""
+
+    value: Any
+    expires_at: float
+    delta: float
+
+    def to_json(self) -> str:
+        return json.dumps({"v": self.value, "e": self.expires_at, "d": self.delta}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "CacheEntry":
+        data = json.loads(raw)
+        return cls(data["v"], data["e"], data["d"])
+
+    def should_refresh_early(self, now: float, beta: float) -> bool:
+        """
+        概率提前刷新（XFetch）：越接近过期、计算越慢，越可能提前重算，
+        使热点条目在过期前由单个调用方刷新，而不是过期瞬间所有调用方同时重算
+        """
+        if beta <= 0 or self.delta <= 0:
+            return False
+        return now - self.delta * beta * math.log(1.0 - random.random()) >= self.expires_at
+
+
+def cache_result(
+    expire: int = 300,
+    key_prefix: str = "",
+    key_args: Optional[Sequence[str]] = None,
+    tags: Sequence[str] = (),
+    stale_ttl: int = 0,
+    beta: float = 1.0,
+    lock_timeout: float = 10.0
+):
+    """
+    缓存结果装饰器
+
+    - 缓存键由参与缓存的参数的规范化 JSON 生成，各进程共享同一条目
+    - 缓存缺失时单飞：进程内并发调用共享一次计算，跨进程由 Redis 锁保证只有一个进程计算，
+      其余进程等待结果写入
+    - 条目临近过期时按概率由单个调用方提前刷新
+    - stale_ttl > 0 时，过期后 stale_ttl 秒内先返回旧值并在后台刷新
+      （后台刷新在请求结束后执行，不要对依赖请求级数据库会话的函数开启）
+    - 条目可以打标签，invalidate_tags() 按标签批量失效
+    - 返回 None 的结果不缓存；Redis 不可用时直接调用原函数
+
+    Args:
+        expire: 条目的有效期（秒）
+        key_prefix: 缓存键命名空间，默认为函数的模块与限定名
+        key_args: 参与缓存键的参数名，默认除 self/cls/db/session 外的全部参数
+        tags: 标签模板，用参数格式化，例如 "agent:{agent_id}"
+        stale_ttl: 过期后仍可返回旧值的时长（秒）
+        beta: 提前刷新的激进程度，0 表示关闭
+        lock_timeout: 计算锁的有效期，也是等待其他进程计算结果的最长时间（秒）
+
+    被装饰的函数额外提供 cache_key(*args, **kwargs) 与 invalidate(*args, **kwargs)。
+    """
     def decorator(func):
+        signature = inspect.signature(func)
+        namespace = key_prefix or f"{func.__module__}.{func.__qualname__}"
+        # 缓存键 -> 进程内正在进行的计算
+        inflight: Dict[str, asyncio.Future] = {}
+
+        def bind(args, kwargs) -> Dict[str, Any]:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return bound.arguments
+
+        def make_key(arguments: Dict[str, Any]) -> str:
+            if key_args is not None:
+                keyed = {name: arguments[name] for name in key_args}
+            else:
+                keyed = {name: value for name, value in arguments.items() if name not in UNKEYED_ARGS}
+            return canonical_cache_key(namespace, keyed)
+
+        async def read(key: str) -> Optional[CacheEntry]:
+            try:
+                # 热点条目（键前缀在 REDIS_NEAR_CACHE_PREFIXES 中）命中进程内近端缓存
+                raw = await redis_manager.get_cached(key)
+                return CacheEntry.from_json(raw) if raw else None
+            except Exception as e:
+                logger.warning("Read cache failed", key=key, error=str(e))
+                return None
+
+        async def compute(key: str, entry_tags: List[str], args, kwargs) -> Any:
+            started = time.monotonic()
+            value = await func(*args, **kwargs)
+            if value is None:
+                return None
+            entry = CacheEntry(value, time.time() + expire, time.monotonic() - started)
+            try:
+                await _store_script(
+                    keys=[key, *(tag_key(tag) for tag in entry_tags)],
+                    args=[entry.to_json(), int((expire + stale_ttl) * 1000)]
+                )
+            except Exception as e:
+                logger.warning("Write cache failed", key=key, error=str(e))
+            return value
+
+        async def acquire(lock_key: str, token: str) -> bool:
+            try:
+                return bool(await redis_manager.redis_client.set(lock_key, token, px=int(lock_timeout * 1000), nx=True))
+            except Exception as e:
+                # 锁不可用时退化为各自计算
+                logger.warning("Acquire cache lock failed", key=lock_key, error=str(e))
+                return True
+
+        async def release(lock_key: str, token: str) -> None:
+            try:
+                await _release_lock_script(keys=[lock_key], args=[token])
+            except Exception as e:
+                logger.warning("Release cache lock failed", key=lock_key, error=str(e))
+
+        async def refresh(key: str, entry_tags: List[str], args, kwargs) -> Any:
+            """持锁时重算并返回新值；其他进程正在重算时立即返回 _NOT_COMPUTED"""
+            lock_key, token = f"{key}:lock", uuid.uuid4().hex
+            if not await acquire(lock_key, token):
+                return _NOT_COMPUTED
+            try:
+                return await compute(key, entry_tags, args, kwargs)
+            finally:
+                await release(lock_key, token)
+
+        async def load(key: str, entry_tags: List[str], args, kwargs) -> Any:
+            """缓存缺失：持锁计算，或等待持锁进程写入结果"""
+            value = await refresh(key, entry_tags, args, kwargs)
+            if value is not _NOT_COMPUTED:
+                return value
+
+            lock_key = f"{key}:lock"
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(CACHE_LOCK_POLL_INTERVAL)
+                try:
+                    async with redis_manager.pipeline() as pipe:
+                        raw = pipe.get(key)
+                        locked = pipe.exists(lock_key)
+                except Exception as e:
+                    logger.warning("Wait for cache failed", key=key, error=str(e))
+                    break
+                if raw.value:
+                    return CacheEntry.from_json(raw.value).value
+                if not locked.value:
+                    # 持锁方已结束但没有写入（结果为 None 或计算失败）
+                    break
+            return await compute(key, entry_tags, args, kwargs)
+
+        def single_flight(key: str, factory) -> "asyncio.Future":
+            future = inflight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(factory())
+                inflight[key] = future
+                future.add_done_callback(lambda f: (inflight.pop(key, None), f.cancelled() or f.exception()))
+            # shield：一个调用方被取消不影响共享同一计算的其他调用方
+            return asyncio.shield(future)
+
+        def refresh_in_background(key: str, entry_tags: List[str], args, kwargs) -> None:
+            if key in inflight:
+                return
+
+            async def run():
+                try:
+                    return await refresh(key, entry_tags, args, kwargs)
+                except Exception as e:
+                    logger.warning("Background cache refresh failed", key=key, error=str(e))
+                    return _NOT_COMPUTED
+
+            task = single_flight(key, run)
+            _refresh_tasks.add(task)
+            task.add_done_callback(_refresh_tasks.discard)
+
+        @functools.wraps(func)
         async def wrapper(*args, **kwargs):
-            # 生成缓存键
-            cache_key = f"{key_prefix}:{func.__name__}:{hash(str(args) + str(kwargs))}"
-            
-            # 尝试从缓存获取
-            cached_result = await redis_manager.get_json(cache_key)
-            if cached_result is not None:
-                return cached_result
-            
-            # 执行函数并缓存结果
-            result = await func(*args, **kwargs)
-            if result is not None:
-                await redis_manager.set_json(cache_key, result, expire)
-            
-            return result
+            if not redis_manager.redis_client:
+                return await func(*args, **kwargs)
+
+            arguments = bind(args, kwargs)
+            key = make_key(arguments)
+            entry = await read(key)
+
+            if entry is None:
+                entry_tags = [tag.format(**arguments) for tag in tags]
+                value = await single_flight(key, lambda: load(key, entry_tags, args, kwargs))
+                if value is _NOT_COMPUTED:
+                    # 加入的是未取得锁的后台刷新
+                    value = await load(key, entry_tags, args, kwargs)
+                return value
+
+            now = time.time()
+            if now < entry.expires_at:
+                if key in inflight or not entry.should_refresh_early(now, beta):
+                    return entry.value
+                entry_tags = [tag.format(**arguments) for tag in tags]
+                value = await single_flight(key, lambda: refresh(key, entry_tags, args, kwargs))
+                return entry.value if value is _NOT_COMPUTED or value is None else value
+
+            # 过期但仍在 stale_ttl 内：返回旧值，后台刷新
+            refresh_in_background(key, [tag.format(**arguments) for tag in tags], args, kwargs)
+            return entry.value
+
+        def cache_key(*args, **kwargs) -> str:
+            return make_key(bind(args, kwargs))
+
+        async def invalidate(*args, **kwargs) -> bool:
+            return await redis_manager.delete(cache_key(*args, **kwargs))
+
+        wrapper.cache_key = cache_key
+        wrapper.invalidate = invalidate
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
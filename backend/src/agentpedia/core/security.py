@@ -1,18 +1,32 @@
 """
 安全认证和授权模块
 """
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Optional, Union
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar, Union
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 from agentpedia.core.config import get_settings
+from agentpedia.core.exceptions import RateLimitError
+from agentpedia.core.logging import get_logger
 
 settings = get_settings()
+logger = get_logger(__name__)
 
-# 密码加密上下文
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 密码加密上下文（成本因子变更后，旧哈希会在下次登录成功时重新计算）
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS
+)
+
+T = TypeVar("T")
 
 
 def create_access_token(
@@ -26,7 +40,7 @@ def create_access_token(
             minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
         )
     
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {"exp": expire, "iat": datetime.utcnow(), "sub": str(subject)}
     encoded_jwt = jwt.encode(
         to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
     )
@@ -44,52 +58,210 @@ def create_refresh_token(
             days=settings.REFRESH_TOKEN_EXPIRE_DAYS
         )
     
-    to_encode = {"exp": expire, "sub": str(subject), "type": "refresh"}
+    to_encode = {"exp": expire, "iat": datetime.utcnow(), "sub": str(subject), "type": "refresh"}
     encoded_jwt = jwt.encode(
         to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM
     )
     return encoded_jwt
 
 
-def verify_token(token: str) -> Optional[str]:
-    """验证令牌"""
+class VerifiedTokenCache:
+    """
+    已验证令牌缓存
+
+    按令牌摘要缓存验证通过的载荷，缓存条目在令牌的 exp 到期时失效，
+    重复请求不再重新计算签名。只缓存验证通过的令牌。
+    """
+
+    def __init__(self):
+        # 令牌摘要 -> (exp 时间戳, 载荷)
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        key = self.digest(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, token: str, payload: Dict[str, Any]) -> None:
+        exp = payload.get("exp")
+        # 没有过期时间的令牌不缓存
+        if not isinstance(exp, (int, float)):
+            return
+        key = self.digest(token)
+        self._entries[key] = (float(exp), payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# 创建全局已验证令牌缓存实例
+verified_token_cache = VerifiedTokenCache()
+
+
+def decode_token(token: str) -> Optional[Dict[str, Any]]:
+    """验证令牌签名与有效期并返回载荷（验证结果按令牌缓存至过期）"""
+    payload = verified_token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
         )
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            return None
-        return user_id
     except JWTError:
         return None
+    verified_token_cache.put(token, payload)
+    return payload
+
+
+def verify_token(token: str) -> Optional[str]:
+    """验证令牌"""
+    payload = decode_token(token)
+    if payload is None:
+        return None
+    user_id: str = payload.get("sub")
+    if user_id is None:
+        return None
+    return user_id
 
 
 def verify_refresh_token(token: str) -> Optional[str]:
     """验证刷新令牌"""
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        user_id: str = payload.get("sub")
-        token_type: str = payload.get("type")
-        if user_id is None or token_type != "refresh":
-            return None
-        return user_id
-    except JWTError:
+    payload = decode_token(token)
+    if payload is None:
         return None
+    user_id: str = payload.get("sub")
+    token_type: str = payload.get("type")
+    if user_id is None or token_type != "refresh":
+        return None
+    return user_id
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
+    """验证密码（同步，会阻塞事件循环；异步代码请使用 password_hasher）"""
     return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
-    """获取密码哈希"""
+    """获取密码哈希（同步，会阻塞事件循环；异步代码请使用 password_hasher）"""
     return pwd_context.hash(password)
 
 
+class PasswordHasherBusyError(RateLimitError):
+    """密码哈希线程池已满"""
+
+    def __init__(self, retry_after: int = 1, message: str = "服务繁忙，请稍后再试"):
+        super().__init__(message, "PASSWORD_HASHER_BUSY")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """
+    密码哈希执行器
+
+    bcrypt 计算在专用的有界线程池中执行（bcrypt 计算期间释放 GIL），不阻塞事件循环；
+    排队的任务超过上限时直接拒绝，由接口返回 429。
+    """
+
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        # 排队等待时间的指数滑动平均（秒）
+        self._avg_wait = 0.0
+
+    @property
+    def workers(self) -> int:
+        return settings.PASSWORD_HASH_WORKERS
+
+    @property
+    def capacity(self) -> int:
+        """同时在执行与排队的任务上限"""
+        return settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_QUEUE_SIZE
+
+    async def hash(self, password: str) -> str:
+        """计算密码哈希"""
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """验证密码"""
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        验证密码，哈希使用的成本因子与当前配置不同时一并返回新哈希
+
+        Returns:
+            (是否通过, 新哈希或 None)
+        """
+        return await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+    def stats(self) -> Dict[str, Any]:
+        """队列指标"""
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": min(self._pending, self.workers),
+            "queue_depth": max(self._pending - self.workers, 0),
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_wait_ms": round(self._avg_wait * 1000, 2),
+        }
+
+    def shutdown(self) -> None:
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        if self._pending >= self.capacity:
+            self._rejected += 1
+            # 按排队任务全部完成所需的时间估算重试间隔
+            retry_after = max(int(self._pending / self.workers * max(self._avg_wait, 0.3)) + 1, 1)
+            logger.warning("Password hasher saturated", pending=self._pending, retry_after=retry_after)
+            raise PasswordHasherBusyError(retry_after)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="password-hash"
+            )
+
+        submitted = time.perf_counter()
+
+        def task():
+            self._record_wait(time.perf_counter() - submitted)
+            return func(*args)
+
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, task)
+        finally:
+            self._pending -= 1
+            self._completed += 1
+
+    def _record_wait(self, wait: float) -> None:
+        self._avg_wait = self._avg_wait * 0.9 + wait * 0.1
+
+
+# 创建全局密码哈希执行器实例
+password_hasher = PasswordHasher()
+
+
 def generate_password_reset_token(email: str) -> str:
     """生成密码重置令牌"""
     delta = timedelta(hours=24)  # 24小时有效
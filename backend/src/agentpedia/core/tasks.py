@@ -0,0 +1,108 @@
+"""
+后台周期任务管理
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from agentpedia.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class PeriodicTask:
+    """按固定间隔执行的后台任务"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[object]],
+        interval: float,
+        run_on_stop: bool = False
+    ):
+        """
+        初始化周期任务
+
+        Args:
+            name: 任务名称
+            func: 每次执行的协程函数
+            interval: 执行间隔（秒）
+            run_on_stop: 停止时是否再执行一次（用于落盘缓冲数据）
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_on_stop = run_on_stop
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        """任务是否在运行"""
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """启动任务"""
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._loop(), name=self.name)
+
+    async def stop(self) -> None:
+        """停止任务"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self.run_on_stop:
+            await self.run_once()
+
+    async def run_once(self) -> None:
+        """立即执行一次（与周期执行互斥）"""
+        async with self._lock:
+            try:
+                await self.func()
+            except Exception as e:
+                logger.error("Background task failed", task=self.name, error=str(e))
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+
+class BackgroundTaskManager:
+    """后台任务管理器"""
+
+    def __init__(self):
+        self.tasks: Dict[str, PeriodicTask] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], Awaitable[object]],
+        interval: float,
+        run_on_stop: bool = False
+    ) -> PeriodicTask:
+        """注册周期任务"""
+        task = PeriodicTask(name, func, interval, run_on_stop)
+        self.tasks[name] = task
+        return task
+
+    def start(self) -> None:
+        """启动所有任务"""
+        for task in self.tasks.values():
+            task.start()
+            logger.info("Background task started", task=task.name, interval=task.interval)
+
+    async def stop(self) -> None:
+        """停止所有任务，需要落盘的任务会再执行一次"""
+        for task in reversed(list(self.tasks.values())):
+            await task.stop()
+            logger.info("Background task stopped", task=task.name)
+
+
+# 创建全局后台任务管理器实例
+task_manager = BackgroundTaskManager()
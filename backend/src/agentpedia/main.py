@@ -17,11 +17,23 @@ from agentpedia.core.logging import (
     configure_logging,
     get_logger,
 )
+from agentpedia.core.pubsub import pubsub_hub
+from agentpedia.core.rate_limit import RateLimitMiddleware
 from agentpedia.core.redis import redis_manager
 from agentpedia.core.mongodb import mongodb_manager
 from agentpedia.core.elasticsearch import elasticsearch_manager
 from agentpedia.services.search_service import search_service
-from agentpedia.core.security import get_password_hash
+from agentpedia.core.security import password_hasher
+from agentpedia.core.tasks import task_manager
+from agentpedia.services.analytics_service import analytics_event_buffer, analytics_rollup_service
+from agentpedia.services.usage_service import agent_usage_buffer, api_key_usage_buffer
+from agentpedia.services.llm_service import llm_registry
+from agentpedia.services.archive_service import message_archive_service
+from agentpedia.services.api_key_cache import api_key_auth_cache
+from agentpedia.services.permission_cache import permission_cache
+from agentpedia.services.rbac_service import rbac_service
+from agentpedia.services.user_cache import user_principal_cache
+from agentpedia.services.wechat_auth_service import wechat_auth_service
 from sqlalchemy import select
 from agentpedia.models.user import User, UserRole, UserStatus
 
@@ -41,10 +53,30 @@ async def lifespan(app: FastAPI):
     # 初始化数据库
     await init_db()
     logger.info("Database initialized")
+
+    # 预建分析数据分区
+    try:
+        await analytics_rollup_service.ensure_upcoming_partitions()
+    except Exception as e:
+        logger.warning("Failed to ensure analytics partitions", error=str(e))
     
     # 初始化Redis
     await redis_manager.init_redis()
     logger.info("Redis initialized")
+
+    # 订阅跨进程的缓存失效通知
+    await api_key_auth_cache.start()
+    await permission_cache.start()
+    await user_principal_cache.start()
+    await redis_manager.near_cache.start()
+    pubsub_hub.start()
+
+    # 初始化默认权限与角色（已存在的跳过）
+    try:
+        await rbac_service.initialize_default_permissions()
+        await rbac_service.initialize_default_roles()
+    except Exception as e:
+        logger.warning("Failed to initialize default roles and permissions", error=str(e))
     
     # 初始化MongoDB
     try:
@@ -87,7 +119,7 @@ async def lifespan(app: FastAPI):
                     mock = User(
                         username="mock_admin",
                         email="mock@example.com",
-                        hashed_password=get_password_hash("mockpass"[:72]),
+                        hashed_password=await password_hasher.hash("mockpass"[:72]),
                         role=UserRole.ADMIN,
                         status=UserStatus.ACTIVE,
                         full_name="Mock Admin",
@@ -98,10 +130,62 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             logger.warning("Seeding mock user failed", error=str(e))
     
+    # 启动后台任务
+    task_manager.add(
+        "agent_usage_flush",
+        agent_usage_buffer.flush,
+        settings.AGENT_USAGE_FLUSH_INTERVAL,
+        run_on_stop=True
+    )
+    task_manager.add(
+        "api_key_usage_flush",
+        api_key_usage_buffer.flush,
+        settings.API_KEY_USAGE_FLUSH_INTERVAL,
+        run_on_stop=True
+    )
+    task_manager.add(
+        "analytics_event_flush",
+        analytics_event_buffer.flush,
+        settings.ANALYTICS_FLUSH_INTERVAL,
+        run_on_stop=True
+    )
+    task_manager.add(
+        "analytics_rollup",
+        analytics_rollup_service.refresh_rollups,
+        settings.ANALYTICS_ROLLUP_INTERVAL
+    )
+    task_manager.add(
+        "rbac_assignment_cleanup",
+        rbac_service.cleanup_expired_assignments,
+        settings.RBAC_ASSIGNMENT_CLEANUP_INTERVAL
+    )
+    task_manager.add(
+        "message_archive",
+        message_archive_service.archive_batch,
+        settings.MESSAGE_ARCHIVE_INTERVAL
+    )
+    task_manager.start()
+
     yield
     
     # 关闭时执行
     logger.info("Shutting down AgentPedia application")
+
+    # 停止后台任务
+    await task_manager.stop()
+    logger.info("Background tasks stopped")
+
+    # 关闭模型提供商连接
+    await llm_registry.close()
+
+    # 关闭密码哈希线程池
+    password_hasher.shutdown()
+
+    # 关闭微信接口连接与二维码渲染线程池
+    await wechat_auth_service.close()
+
+    # 停止订阅
+    await pubsub_hub.stop()
     
     # 关闭数据库连接
     await close_db()
@@ -153,7 +237,8 @@ def create_app() -> FastAPI:
         allowed_hosts=["localhost", "127.0.0.1", "0.0.0.0"]
     )
     
-    # 添加自定义中间件
+    # 添加自定义中间件（限流在日志中间件内层，被拒绝的请求同样会被记录）
+    app.add_middleware(RateLimitMiddleware)
     app.add_middleware(PerformanceLoggingMiddleware)
     app.add_middleware(RequestLoggingMiddleware)
     
@@ -168,6 +253,8 @@ def create_app() -> FastAPI:
             "status": "healthy",
             "version": settings.VERSION,
             "environment": settings.ENVIRONMENT,
+            "password_hasher": password_hasher.stats(),
+            "near_cache": redis_manager.near_cache.stats(),
         }
     
     # 添加指标端点（如果启用）
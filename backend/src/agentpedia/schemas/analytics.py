@@ -0,0 +1,32 @@
+"""
+分析事件相关的Pydantic schemas
+"""
+from datetime import datetime
+from typing import Optional
+
+from pydantic import Field
+
+from agentpedia.schemas.base import BaseSchema
+
+
+class AnalyticsEvent(BaseSchema):
+    """原始分析事件（汇总前）"""
+
+    agent_id: int = Field(..., description="Agent ID")
+    occurred_at: datetime = Field(default_factory=datetime.utcnow, description="发生时间（UTC）")
+    page_views: int = Field(0, ge=0, description="页面浏览量")
+    bounces: int = Field(0, ge=0, description="跳出次数")
+    conversations: int = Field(0, ge=0, description="新对话数")
+    messages: int = Field(0, ge=0, description="消息数")
+    tokens: int = Field(0, ge=0, description="token使用量")
+    revenue: float = Field(0.0, description="收入")
+    cost: float = Field(0.0, description="成本")
+    response_time: float = Field(0.0, ge=0.0, description="消息响应总耗时（秒）")
+    failed_messages: int = Field(0, ge=0, description="失败消息数")
+
+
+class PageViewEvent(BaseSchema):
+    """页面浏览上报"""
+
+    visitor_id: Optional[str] = Field(None, max_length=128, description="访客标识（未提供时按登录用户或客户端推断）")
+    bounced: bool = Field(False, description="是否为跳出（仅浏览了该页面即离开）")
@@ -82,6 +82,12 @@ class APIKeyStats(BaseSchema):
     total_usage: int = Field(..., description="总使用次数")
 
 
+class APIKeyHourlyUsage(BaseSchema):
+    """API密钥每小时使用次数schema"""
+    hour: datetime = Field(..., description="整点时间（UTC）")
+    count: int = Field(..., description="该小时使用次数")
+
+
 class APIKeyUsage(BaseSchema):
     """API密钥使用情况schema"""
     key_id: int = Field(..., description="密钥ID")
@@ -89,6 +95,7 @@ class APIKeyUsage(BaseSchema):
     usage_count: int = Field(..., description="使用次数")
     last_used_at: Optional[datetime] = Field(None, description="最后使用时间")
     rate_limit_remaining: dict = Field(..., description="剩余请求限制")
+    hourly_usage: List[APIKeyHourlyUsage] = Field(default_factory=list, description="每小时使用次数")
 
 
 class RateLimitInfo(BaseSchema):
@@ -1,6 +1,8 @@
 """
 基础Pydantic模式
 """
+import base64
+import json
 from datetime import datetime
 from typing import Any, Dict, Generic, List, Optional, TypeVar
 
@@ -95,6 +97,37 @@ class PaginatedResponse(BaseSchema, Generic[T]):
         )
 
 
+class CursorPage(BaseSchema, Generic[T]):
+    """游标（键集）分页响应"""
+    
+    items: List[T] = Field(..., description="数据列表")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，为空表示没有更多数据")
+    has_more: bool = Field(..., description="是否还有更多数据")
+    
+    @staticmethod
+    def encode_cursor(values: Dict[str, Any]) -> str:
+        """把键集位置编码为不透明的游标字符串"""
+        raw = json.dumps(values, separators=(",", ":"), default=str)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Dict[str, Any]:
+        """
+        解码游标字符串
+        
+        Raises:
+            ValueError: 游标格式无效
+        """
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except Exception as e:
+            raise ValueError("无效的分页游标") from e
+        if not isinstance(values, dict):
+            raise ValueError("无效的分页游标")
+        return values
+
+
 class APIResponse(BaseSchema, Generic[T]):
     """API响应"""
     
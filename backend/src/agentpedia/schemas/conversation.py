@@ -4,7 +4,7 @@
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, validator
 
 from agentpedia.models.conversation import ConversationStatus, MessageRole, MessageType
 from agentpedia.schemas.base import BaseSchema, TimestampSchema, IDSchema
@@ -75,7 +75,9 @@ class ConversationResponse(ConversationBase, IDSchema, TimestampSchema):
 
 class ConversationDetail(ConversationResponse):
     """对话详情schema"""
-    messages: List[MessageResponse] = Field(default=[], description="消息列表")
+    messages: List[MessageResponse] = Field(default=[], description="最新一页消息（按时间正序）")
+    next_cursor: Optional[str] = Field(None, description="更早消息的分页游标")
+    has_more: bool = Field(default=False, description="是否还有更早的消息")
 
 
 class ConversationStats(BaseSchema):
@@ -88,6 +90,17 @@ class ConversationStats(BaseSchema):
     average_messages_per_conversation: float = Field(..., description="平均每对话消息数")
 
 
+class MessageSearchResult(BaseSchema):
+    """消息搜索结果schema"""
+    message_id: int = Field(..., description="消息ID")
+    conversation_id: int = Field(..., description="对话ID")
+    conversation_title: Optional[str] = Field(None, description="对话标题")
+    role: MessageRole = Field(..., description="消息角色")
+    snippet: str = Field(..., description="命中片段（已HTML转义），关键词以<mark>标记")
+    rank: float = Field(..., description="相关度")
+    created_at: datetime = Field(..., description="消息时间")
+
+
 class ChatRequest(BaseSchema):
     """聊天请求schema"""
     message: str = Field(..., min_length=1, max_length=50000, description="消息内容")
@@ -110,6 +123,9 @@ class ChatResponse(BaseSchema):
 
 class ChatStreamChunk(BaseSchema):
     """聊天流式响应块schema"""
+    # 内容块之间的空白是正文的一部分，不能去除
+    model_config = ConfigDict(str_strip_whitespace=False)
+
     conversation_id: int = Field(..., description="对话ID")
     message_id: Optional[int] = Field(None, description="消息ID")
     content: str = Field(..., description="内容块")
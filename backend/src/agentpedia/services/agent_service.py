@@ -5,15 +5,18 @@ import json
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-from sqlalchemy import and_, func, or_
+from sqlalchemy import and_, func, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 
+from agentpedia.core.exceptions import NotFoundError
 from agentpedia.models.agent import Agent, AgentStatus, AgentTool, AgentType, AgentVisibility
 from agentpedia.schemas.agent import AgentCreate, AgentUpdate, AgentFilterParams
 from agentpedia.schemas.base import PaginationParams
 from agentpedia.services.base import BaseService
+from agentpedia.services.usage_service import agent_usage_buffer
 
 
 class AgentService(BaseService[Agent, AgentCreate, AgentUpdate]):
@@ -337,13 +340,12 @@ class AgentService(BaseService[Agent, AgentCreate, AgentUpdate]):
         cost: float,
         processing_time: float
     ) -> bool:
-        """更新使用统计"""
-        agent = await self.get(agent_id)
-        if not agent:
-            return False
-        
-        agent.update_usage_stats(tokens_used, cost, processing_time)
-        await self.db.commit()
+        """
+        更新使用统计
+
+        只记录增量，由后台任务批量写回数据库（见 usage_service）
+        """
+        await agent_usage_buffer.record(agent_id, tokens_used, cost, processing_time)
         return True
     
     async def publish_agent(self, agent_id: int, user_id: int) -> bool:
@@ -466,7 +468,7 @@ class AgentService(BaseService[Agent, AgentCreate, AgentUpdate]):
             .order_by(AgentAnalytics.date.desc())
             .limit(limit)
         )
-        result = self.db.execute(stmt)
+        result = await self.db.execute(stmt)
         return list(result.scalars())
 
     async def get_agent_traffic_data(self, agent_id: int, days: int = 30) -> List:
@@ -485,7 +487,7 @@ class AgentService(BaseService[Agent, AgentCreate, AgentUpdate]):
             )
             .order_by(AgentAnalytics.date.asc())
         )
-        result = self.db.execute(stmt)
+        result = await self.db.execute(stmt)
         return list(result.scalars())
 
     async def get_agent_reviews(
@@ -520,50 +522,90 @@ class AgentService(BaseService[Agent, AgentCreate, AgentUpdate]):
         title: Optional[str] = None,
         content: Optional[str] = None
     ) -> bool:
-        """添加Agent评论"""
+        """
+        添加Agent评论
+        
+        评论写入与评分累加在同一条语句中完成：
+        INSERT ... ON CONFLICT DO NOTHING 依赖 (agent_id, user_id) 的部分唯一索引判重，
+        插入成功的行再驱动一次原子的 UPDATE agents（已删除的Agent不更新，整体回滚）。
+
+        Raises:
+            NotFoundError: Agent不存在或已删除
+            ValueError: 已经评论过此Agent
+        """
         from agentpedia.models.review import AgentReview
 
-        # 检查是否已经评论过
-        existing_review = await self.db.execute(
-            select(AgentReview).where(
-                AgentReview.agent_id == agent_id,
-                AgentReview.user_id == user_id,
-                AgentReview.deleted_at.is_(None)
+        new_review = (
+            pg_insert(AgentReview)
+            .values(
+                agent_id=agent_id,
+                user_id=user_id,
+                rating=rating,
+                title=title,
+                content=content
+            )
+            .on_conflict_do_nothing(
+                index_elements=[AgentReview.agent_id, AgentReview.user_id],
+                index_where=AgentReview.deleted_at.is_(None)
             )
+            .returning(AgentReview.agent_id, AgentReview.rating)
+            .cte("new_review")
         )
-        if existing_review.scalar_one_or_none():
-            raise ValueError("您已经评论过此Agent")
 
-        # 创建评论
-        review = AgentReview(
-            agent_id=agent_id,
-            user_id=user_id,
-            rating=rating,
-            title=title,
-            content=content
+        stmt = (
+            update(Agent)
+            .where(
+                Agent.id == new_review.c.agent_id,
+                Agent.deleted_at.is_(None)
+            )
+            .values(
+                average_rating=(
+                    (Agent.average_rating * Agent.total_ratings + new_review.c.rating)
+                    / (Agent.total_ratings + 1)
+                ),
+                total_ratings=Agent.total_ratings + 1,
+                total_reviews=Agent.total_reviews + 1,
+            )
+            .returning(Agent.id)
+            .execution_options(synchronize_session=False)
         )
-
-        self.db.add(review)
-
-        # 更新Agent评分
-        agent = await self.get(agent_id)
-        if agent:
-            agent.update_rating(rating)
-            agent.increment_reviews()
+        result = await self.db.execute(stmt)
+        updated = result.scalar_one_or_none()
+
+        if updated is None:
+            # 重复评论或Agent已被删除：评论不能脱离评分单独落库
+            await self.db.rollback()
+            agent_exists = await self.db.scalar(
+                select(Agent.id).where(
+                    Agent.id == agent_id,
+                    Agent.deleted_at.is_(None)
+                )
+            )
+            if agent_exists is None:
+                raise NotFoundError("Agent不存在")
+            raise ValueError("您已经评论过此Agent")
 
         await self.db.commit()
         return True
 
     async def toggle_favorite(self, agent_id: int, user_id: int, is_favorite: bool) -> bool:
         """切换收藏状态（这里简化处理，实际可能需要单独的收藏表）"""
-        agent = await self.get(agent_id)
-        if not agent:
-            return False
-
         if is_favorite:
-            agent.increment_favorites()
+            total_favorites = Agent.total_favorites + 1
         else:
-            agent.decrement_favorites()
+            total_favorites = func.greatest(Agent.total_favorites - 1, 0)
 
+        stmt = (
+            update(Agent)
+            .where(
+                Agent.id == agent_id,
+                Agent.deleted_at.is_(None)
+            )
+            .values(total_favorites=total_favorites)
+            .returning(Agent.id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.db.execute(stmt)
+        updated = result.scalar_one_or_none()
         await self.db.commit()
-        return True
\ No newline at end of file
+        return updated is not None
@@ -0,0 +1,593 @@
+"""
+Agent分析数据汇总服务
+
+原始事件按 (agent_id, 日) 增量累加到 daily 桶；
+weekly / monthly 桶只从 daily 桶派生，不再回看原始事件。
+派生时以 daily 行的 updated_at 为水位线，只重算自上次运行以来有变化的周期，
+迟到数据会刷新对应 daily 行的 updated_at，从而在下一轮被重新派生。
+
+页面浏览与对话用量事件先写入 Redis Stream（独立访客用按 Agent 按天的 HyperLogLog 计数），
+由后台任务批量消费后写入 daily 桶。
+"""
+import asyncio
+import os
+import socket
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, literal, literal_column, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.database import AsyncSessionLocal, async_engine
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+from agentpedia.models.agent import Agent
+from agentpedia.models.review import AgentAnalytics
+from agentpedia.schemas.analytics import AnalyticsEvent
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+# 数据库时钟（UTC，无时区），水位线与 updated_at 统一使用
+UTC_NOW = func.timezone("utc", func.now())
+
+BUCKET_KEYS = ("agent_id", "period_type", "date")
+
+# 派生周期 -> date_trunc 单位
+ROLLUP_PERIODS = (("weekly", "week"), ("monthly", "month"))
+
+# 汇总时直接求和的列
+SUM_COLUMNS = (
+    "new_users",
+    "active_users",
+    "returning_users",
+    "total_conversations",
+    "total_messages",
+    "total_tokens_used",
+    "revenue",
+    "cost",
+    "page_views",
+    "unique_visitors",
+)
+
+# 汇总时按权重列加权平均的列
+WEIGHTED_COLUMNS = (
+    ("average_response_time", "total_messages"),
+    ("success_rate", "total_messages"),
+    ("satisfaction_score", "total_messages"),
+    ("bounce_rate", "page_views"),
+)
+
+# 事件写入 daily 桶时累加的列
+DAILY_SUM_COLUMNS = (
+    "page_views",
+    "total_conversations",
+    "total_messages",
+    "total_tokens_used",
+    "revenue",
+    "cost",
+)
+
+# 事件写入 daily 桶时加权合并的列
+DAILY_WEIGHTED_COLUMNS = (
+    ("average_response_time", "total_messages"),
+    ("success_rate", "total_messages"),
+    ("bounce_rate", "page_views"),
+)
+
+# 事件写入 daily 桶时取较大值的列（值为当天累计的绝对量）
+DAILY_MAX_COLUMNS = (
+    "unique_visitors",
+)
+
+# 积压达到流长度上限的该比例时告警（超过上限后 XADD 会裁剪最早的未消费事件）
+TRIM_WARNING_RATIO = 0.9
+
+# 事件流中的条目类型（早期写入的条目没有类型字段，均为页面浏览）
+EVENT_VIEW = "view"
+EVENT_USAGE = "usage"
+
+# 用量事件的字段 -> 类型
+USAGE_FIELDS = (
+    ("conversations", int),
+    ("messages", int),
+    ("tokens", int),
+    ("revenue", float),
+    ("cost", float),
+    ("response_time", float),
+    ("failed_messages", int),
+)
+
+
+def month_start(day: date) -> date:
+    """返回所在月份的第一天"""
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    """返回下个月的第一天"""
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+class AnalyticsRollupService:
+    """分析数据汇总服务"""
+
+    WATERMARK_NAME = "agent_analytics_rollup"
+
+    def __init__(self):
+        self._known_partitions: Set[date] = set()
+
+    async def ingest(
+        self,
+        events: Iterable[AnalyticsEvent],
+        unique_visitors: Optional[Dict[Tuple[int, date], int]] = None
+    ) -> int:
+        """
+        写入一批原始事件
+
+        Args:
+            events: 原始事件
+            unique_visitors: (agent_id, 日) -> 当天独立访客数
+
+        Returns:
+            受影响的 daily 桶数量
+        """
+        rows = self.aggregate_daily(events, unique_visitors)
+        if not rows:
+            return 0
+
+        await self.ensure_partitions_for_days(row["date"].date() for row in rows)
+
+        async with AsyncSessionLocal() as session:
+            await self.upsert_daily(session, rows)
+            await session.commit()
+
+        return len(rows)
+
+    def aggregate_daily(
+        self,
+        events: Iterable[AnalyticsEvent],
+        unique_visitors: Optional[Dict[Tuple[int, date], int]] = None
+    ) -> List[dict]:
+        """在内存中按 (agent_id, 日) 预聚合事件"""
+        unique_visitors = unique_visitors or {}
+        cutoff = (datetime.utcnow() - timedelta(days=settings.ANALYTICS_MAX_LATENESS_DAYS)).date()
+        buckets: Dict[Tuple[int, date], Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        dropped = 0
+
+        for event in events:
+            day = event.occurred_at.date()
+            if day < cutoff:
+                dropped += 1
+                continue
+
+            bucket = buckets[(event.agent_id, day)]
+            bucket["page_views"] += event.page_views
+            bucket["bounces"] += event.bounces
+            bucket["total_conversations"] += event.conversations
+            bucket["total_messages"] += event.messages
+            bucket["total_tokens_used"] += event.tokens
+            bucket["revenue"] += event.revenue
+            bucket["cost"] += event.cost
+            bucket["response_time"] += event.response_time
+            bucket["failed_messages"] += event.failed_messages
+
+        if dropped:
+            logger.warning("Dropped late analytics events", count=dropped, cutoff=cutoff.isoformat())
+
+        rows = []
+        for (agent_id, day), bucket in buckets.items():
+            messages = int(bucket["total_messages"])
+            page_views = int(bucket["page_views"])
+            rows.append({
+                "agent_id": agent_id,
+                "period_type": "daily",
+                "date": datetime.combine(day, time.min),
+                "page_views": page_views,
+                "unique_visitors": unique_visitors.get((agent_id, day), 0),
+                "total_conversations": int(bucket["total_conversations"]),
+                "total_messages": messages,
+                "total_tokens_used": int(bucket["total_tokens_used"]),
+                "revenue": bucket["revenue"],
+                "cost": bucket["cost"],
+                "average_response_time": bucket["response_time"] / messages if messages else 0.0,
+                "success_rate": (messages - bucket["failed_messages"]) / messages if messages else 0.0,
+                "bounce_rate": bucket["bounces"] / page_views if page_views else 0.0,
+            })
+        return rows
+
+    async def upsert_daily(self, session: AsyncSession, rows: List[dict]) -> None:
+        """将预聚合的 daily 行以一条多行 INSERT ... ON CONFLICT 累加到表中"""
+        table = AgentAnalytics.__table__
+        values = [{**row, "created_at": UTC_NOW, "updated_at": UTC_NOW} for row in rows]
+
+        stmt = pg_insert(table).values(values)
+        excluded = stmt.excluded
+
+        set_ = {"updated_at": excluded.updated_at}
+        for column in DAILY_SUM_COLUMNS:
+            set_[column] = table.c[column] + excluded[column]
+        for column, weight in DAILY_WEIGHTED_COLUMNS:
+            total_weight = table.c[weight] + excluded[weight]
+            set_[column] = func.coalesce(
+                (table.c[column] * table.c[weight] + excluded[column] * excluded[weight])
+                / func.nullif(total_weight, 0),
+                table.c[column],
+            )
+        for column in DAILY_MAX_COLUMNS:
+            set_[column] = func.greatest(table.c[column], excluded[column])
+
+        await session.execute(
+            stmt.on_conflict_do_update(index_elements=list(BUCKET_KEYS), set_=set_)
+        )
+
+    async def refresh_rollups(self) -> None:
+        """从 daily 桶重新派生自水位线以来有变化的 weekly / monthly 桶"""
+        await self.ensure_upcoming_partitions()
+
+        async with AsyncSessionLocal() as session:
+            watermark = await self._get_watermark(session)
+            scan_started = (await session.execute(select(UTC_NOW))).scalar_one()
+
+            for period_type, unit in ROLLUP_PERIODS:
+                await session.execute(self._derive_statement(period_type, unit, watermark))
+
+            # 回退一段时间，覆盖扫描开始前已写入但尚未提交的 daily 行；重算是幂等的
+            new_watermark = scan_started - timedelta(seconds=settings.ANALYTICS_WATERMARK_LAG)
+            if new_watermark > watermark:
+                await self._set_watermark(session, new_watermark)
+
+            await session.commit()
+
+        logger.info("Analytics rollups refreshed", watermark=watermark.isoformat())
+
+    def _derive_statement(self, period_type: str, unit: str, watermark: datetime):
+        """构建从 daily 桶派生指定周期桶的 INSERT ... SELECT ... ON CONFLICT 语句"""
+        table = AgentAnalytics.__table__
+        # 单位以字面量内联，保证 SELECT 与 GROUP BY 中的表达式完全一致
+        bucket = func.date_trunc(literal_column(f"'{unit}'"), table.c.date)
+
+        dirty = (
+            select(table.c.agent_id, bucket.label("bucket"))
+            .where(
+                table.c.period_type == "daily",
+                table.c.updated_at > watermark
+            )
+            .distinct()
+            .subquery("dirty")
+        )
+
+        columns = [
+            ("agent_id", table.c.agent_id),
+            ("period_type", literal(period_type)),
+            ("date", bucket),
+        ]
+        for column in SUM_COLUMNS:
+            columns.append((column, func.coalesce(func.sum(table.c[column]), 0)))
+        for column, weight in WEIGHTED_COLUMNS:
+            columns.append((
+                column,
+                func.coalesce(
+                    func.sum(table.c[column] * table.c[weight])
+                    / func.nullif(func.sum(table.c[weight]), 0),
+                    0.0,
+                ),
+            ))
+        columns.append(("created_at", UTC_NOW))
+        columns.append(("updated_at", UTC_NOW))
+
+        aggregate = (
+            select(*[expr.label(name) for name, expr in columns])
+            .select_from(table)
+            .join(
+                dirty,
+                and_(
+                    table.c.agent_id == dirty.c.agent_id,
+                    bucket == dirty.c.bucket
+                )
+            )
+            .where(table.c.period_type == "daily")
+            .group_by(table.c.agent_id, bucket)
+        )
+
+        names = [name for name, _ in columns]
+        stmt = pg_insert(table).from_select(names, aggregate)
+        return stmt.on_conflict_do_update(
+            index_elements=list(BUCKET_KEYS),
+            set_={
+                name: stmt.excluded[name]
+                for name in names
+                if name not in BUCKET_KEYS and name != "created_at"
+            },
+        )
+
+    async def _get_watermark(self, session: AsyncSession) -> datetime:
+        result = await session.execute(
+            text("SELECT watermark FROM analytics_watermarks WHERE name = :name"),
+            {"name": self.WATERMARK_NAME}
+        )
+        watermark = result.scalar_one_or_none()
+        return watermark or datetime(1970, 1, 1)
+
+    async def _set_watermark(self, session: AsyncSession, watermark: datetime) -> None:
+        await session.execute(
+            text(
+                "INSERT INTO analytics_watermarks (name, watermark, updated_at) "
+                "VALUES (:name, :watermark, timezone('utc', now())) "
+                "ON CONFLICT (name) DO UPDATE "
+                "SET watermark = EXCLUDED.watermark, updated_at = EXCLUDED.updated_at"
+            ),
+            {"name": self.WATERMARK_NAME, "watermark": watermark}
+        )
+
+    async def ensure_upcoming_partitions(self) -> None:
+        """确保当月及未来若干个月的分区存在"""
+        month = month_start(datetime.utcnow().date())
+        months = [month]
+        for _ in range(settings.ANALYTICS_PARTITION_MONTHS_AHEAD):
+            month = next_month(month)
+            months.append(month)
+        await self.ensure_partitions(months)
+
+    async def ensure_partitions_for_days(self, days: Iterable[date]) -> None:
+        """确保日期所在月份及其所属周的起始月份的分区存在"""
+        months = set()
+        for day in days:
+            months.add(month_start(day))
+            months.add(month_start(day - timedelta(days=day.weekday())))
+        await self.ensure_partitions(months)
+
+    async def ensure_partitions(self, months: Iterable[date]) -> None:
+        """按月创建 agent_analytics 的范围分区（幂等）"""
+        missing = sorted(set(months) - self._known_partitions)
+        if not missing:
+            return
+
+        async with async_engine.begin() as conn:
+            for month in missing:
+                await conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS agent_analytics_p{month:%Y%m} "
+                    f"PARTITION OF agent_analytics "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+                ))
+
+        self._known_partitions.update(missing)
+
+
+class AnalyticsEventBuffer:
+    """分析事件缓冲（Redis Stream + HyperLogLog），承载页面浏览与对话用量事件"""
+
+    GROUP_NAME = "analytics-flusher"
+
+    def __init__(self, rollup_service: AnalyticsRollupService):
+        self.rollup_service = rollup_service
+        self.stream_key = settings.ANALYTICS_STREAM_KEY
+        self.consumer_name = f"{socket.gethostname()}-{os.getpid()}"
+        self._group_ready = False
+
+    @staticmethod
+    def visitors_key(agent_id: int, day: date) -> str:
+        """独立访客 HyperLogLog 键"""
+        return f"analytics:uv:{agent_id}:{day:%Y%m%d}"
+
+    async def record_view(self, agent_id: int, visitor_id: str, bounced: bool = False) -> bool:
+        """
+        记录一次页面浏览，一次流水线往返完成
+
+        Returns:
+            是否写入成功
+        """
+        client = redis_manager.redis_client
+        if not client:
+            return False
+
+        now = datetime.utcnow()
+        visitors_key = self.visitors_key(agent_id, now.date())
+
+        pipe = client.pipeline(transaction=False)
+        pipe.xadd(
+            self.stream_key,
+            {
+                "kind": EVENT_VIEW,
+                "agent_id": agent_id,
+                "ts": now.isoformat(),
+                "bounced": int(bounced),
+            },
+            maxlen=settings.ANALYTICS_STREAM_MAXLEN,
+            approximate=True
+        )
+        pipe.pfadd(visitors_key, visitor_id)
+        # 保留到迟到窗口之后，便于补算
+        pipe.expire(visitors_key, (settings.ANALYTICS_MAX_LATENESS_DAYS + 1) * 86400)
+        await pipe.execute()
+        return True
+
+    async def record_usage(
+        self,
+        agent_id: int,
+        conversations: int = 0,
+        messages: int = 0,
+        tokens: int = 0,
+        revenue: float = 0.0,
+        cost: float = 0.0,
+        response_time: float = 0.0,
+        failed_messages: int = 0
+    ) -> bool:
+        """
+        记录一次对话用量（一次 Redis 往返）
+
+        写入失败只记录日志，不影响调用方的请求。
+
+        Returns:
+            是否写入成功
+        """
+        client = redis_manager.redis_client
+        if not client:
+            return False
+
+        fields = {
+            "kind": EVENT_USAGE,
+            "agent_id": agent_id,
+            "ts": datetime.utcnow().isoformat(),
+            "conversations": conversations,
+            "messages": messages,
+            "tokens": tokens,
+            "revenue": revenue,
+            "cost": cost,
+            "response_time": response_time,
+            "failed_messages": failed_messages,
+        }
+        try:
+            await client.xadd(
+                self.stream_key,
+                fields,
+                maxlen=settings.ANALYTICS_STREAM_MAXLEN,
+                approximate=True
+            )
+            return True
+        except Exception as e:
+            logger.warning("Buffer analytics usage event failed", error=str(e), agent_id=agent_id)
+            return False
+
+    async def flush(self) -> int:
+        """
+        消费缓冲事件并写入 daily 桶
+
+        读到满批时继续消费，直到积压清空或用完一个刷新间隔的时间预算；
+        预算用完仍有积压时检查流长度，接近 ANALYTICS_STREAM_MAXLEN 时
+        最早的未消费事件会被 XADD 裁剪丢失，记录告警。
+
+        Returns:
+            处理的事件数量
+        """
+        client = redis_manager.redis_client
+        if not client:
+            return 0
+
+        await self._ensure_group(client)
+
+        deadline = asyncio.get_running_loop().time() + settings.ANALYTICS_FLUSH_INTERVAL
+        total = 0
+        while True:
+            processed = await self._flush_batch(client)
+            total += processed
+            if processed < settings.ANALYTICS_FLUSH_BATCH_SIZE:
+                return total
+            if asyncio.get_running_loop().time() >= deadline:
+                break
+
+        backlog = await client.xlen(self.stream_key)
+        if backlog >= settings.ANALYTICS_STREAM_MAXLEN * TRIM_WARNING_RATIO:
+            logger.warning(
+                "Analytics stream backlog near its length limit, oldest events may be trimmed",
+                backlog=backlog,
+                maxlen=settings.ANALYTICS_STREAM_MAXLEN,
+                flushed=total
+            )
+        return total
+
+    async def _flush_batch(self, client) -> int:
+        """消费一批事件，返回本批的条目数"""
+        # 先接管长时间未确认的事件（例如上一个进程写库失败或已退出）
+        _, entries, *_ = await client.xautoclaim(
+            self.stream_key,
+            self.GROUP_NAME,
+            self.consumer_name,
+            min_idle_time=settings.ANALYTICS_FLUSH_INTERVAL * 3 * 1000,
+            start_id="0-0",
+            count=settings.ANALYTICS_FLUSH_BATCH_SIZE
+        )
+        remaining = settings.ANALYTICS_FLUSH_BATCH_SIZE - len(entries)
+        if remaining > 0:
+            response = await client.xreadgroup(
+                self.GROUP_NAME,
+                self.consumer_name,
+                {self.stream_key: ">"},
+                count=remaining
+            )
+            for _, stream_entries in response:
+                entries.extend(stream_entries)
+
+        if not entries:
+            return 0
+
+        events = self._parse_entries(entries)
+        events = await self._filter_existing_agents(events)
+
+        buckets = sorted({(e.agent_id, e.occurred_at.date()) for e in events})
+        view_buckets = sorted({(e.agent_id, e.occurred_at.date()) for e in events if e.page_views})
+        unique_visitors: Dict[Tuple[int, date], int] = {}
+        if view_buckets:
+            pipe = client.pipeline(transaction=False)
+            for agent_id, day in view_buckets:
+                pipe.pfcount(self.visitors_key(agent_id, day))
+            unique_visitors = dict(zip(view_buckets, await pipe.execute()))
+
+        await self.rollup_service.ingest(events, unique_visitors)
+
+        # 写库成功后再确认并删除，失败的事件会在之后被重新接管
+        entry_ids = [entry_id for entry_id, _ in entries]
+        pipe = client.pipeline(transaction=False)
+        pipe.xack(self.stream_key, self.GROUP_NAME, *entry_ids)
+        pipe.xdel(self.stream_key, *entry_ids)
+        await pipe.execute()
+
+        logger.info("Analytics events flushed", events=len(entries), buckets=len(buckets))
+        return len(entries)
+
+    async def _ensure_group(self, client) -> None:
+        if self._group_ready:
+            return
+        try:
+            await client.xgroup_create(self.stream_key, self.GROUP_NAME, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    def _parse_entries(self, entries: List[tuple]) -> List[AnalyticsEvent]:
+        events = []
+        for entry_id, fields in entries:
+            try:
+                agent_id = int(fields["agent_id"])
+                occurred_at = datetime.fromisoformat(fields["ts"])
+                if fields.get("kind", EVENT_VIEW) == EVENT_USAGE:
+                    events.append(AnalyticsEvent(
+                        agent_id=agent_id,
+                        occurred_at=occurred_at,
+                        **{name: convert(fields.get(name) or 0) for name, convert in USAGE_FIELDS}
+                    ))
+                else:
+                    events.append(AnalyticsEvent(
+                        agent_id=agent_id,
+                        occurred_at=occurred_at,
+                        page_views=1,
+                        bounces=int(fields.get("bounced", 0))
+                    ))
+            except (KeyError, ValueError) as e:
+                logger.warning("Malformed analytics event", entry_id=entry_id, error=str(e))
+        return events
+
+    async def _filter_existing_agents(self, events: List[AnalyticsEvent]) -> List[AnalyticsEvent]:
+        """丢弃指向不存在 Agent 的事件，避免整批写入因外键失败"""
+        agent_ids = {event.agent_id for event in events}
+        if not agent_ids:
+            return events
+
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Agent.id).where(Agent.id.in_(agent_ids))
+            )
+            existing = set(result.scalars())
+
+        return [event for event in events if event.agent_id in existing]
+
+
+# 创建全局分析汇总服务实例
+analytics_rollup_service = AnalyticsRollupService()
+
+# 创建全局分析事件缓冲实例
+analytics_event_buffer = AnalyticsEventBuffer(analytics_rollup_service)
@@ -0,0 +1,216 @@
+"""
+API密钥认证缓存
+
+按密钥哈希缓存认证结果：进程内 LRU 在前，Redis 在后。
+有效密钥缓存为 APIKeyPrincipal，无效密钥缓存为负结果，
+有效密钥的缓存时间不超过其过期时间。
+撤销、停用、更新、删除密钥时写入短期墓碑并通过 pub/sub 通知所有进程立即淘汰。
+"""
+import json
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
+from agentpedia.core.pubsub import pubsub_hub
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+INVALIDATION_CHANNEL = "apikey:invalidate"
+
+# 墓碑：失效后的短时间内不信任、也不写入缓存，避免并发的旧查询结果回填
+TOMBSTONE = "stale"
+NEGATIVE = "null"
+
+
+@dataclass(slots=True)
+class APIKeyPrincipal:
+    """认证通过的API密钥（缓存用的只读快照）"""
+
+    id: int
+    user_id: int
+    name: str
+    scopes: List[str]
+    expires_at: Optional[datetime]
+    rate_limit_per_minute: Optional[int]
+    rate_limit_per_hour: Optional[int]
+    rate_limit_per_day: Optional[int]
+
+    @classmethod
+    def from_model(cls, api_key) -> "APIKeyPrincipal":
+        return cls(
+            id=api_key.id,
+            user_id=api_key.user_id,
+            name=api_key.name,
+            scopes=[getattr(scope, "value", scope) for scope in (api_key.scopes or [])],
+            expires_at=api_key.expires_at,
+            rate_limit_per_minute=api_key.rate_limit_per_minute,
+            rate_limit_per_hour=api_key.rate_limit_per_hour,
+            rate_limit_per_day=api_key.rate_limit_per_day
+        )
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        if self.expires_at:
+            data["expires_at"] = self.expires_at.isoformat()
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "APIKeyPrincipal":
+        data = json.loads(raw)
+        if data.get("expires_at"):
+            data["expires_at"] = datetime.fromisoformat(data["expires_at"])
+        return cls(**data)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= datetime.utcnow()
+
+
+@dataclass(slots=True)
+class CacheLookup:
+    """缓存查询结果"""
+
+    found: bool
+    principal: Optional[APIKeyPrincipal] = None
+    # 为 False 时（墓碑期内）查库结果不得写回缓存
+    cacheable: bool = True
+
+
+class APIKeyAuthCache:
+    """API密钥认证缓存"""
+
+    def __init__(self):
+        # 密钥哈希 -> (过期时间, 认证结果)
+        self._local: "OrderedDict[str, Tuple[float, Optional[APIKeyPrincipal]]]" = OrderedDict()
+        # 密钥哈希 -> 墓碑过期时间
+        self._tombstones: dict = {}
+
+    @staticmethod
+    def redis_key(key_hash: str) -> str:
+        return f"apikey:auth:{key_hash}"
+
+    async def start(self) -> None:
+        """订阅失效通知"""
+        await pubsub_hub.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+        # 断线期间可能错过通知，重连后清空本地缓存
+        pubsub_hub.on_reconnect(self._local.clear)
+
+    async def get(self, key_hash: str) -> CacheLookup:
+        """查询缓存：先查进程内 LRU，再查 Redis"""
+        now = time.monotonic()
+        entry = self._local.get(key_hash)
+        if entry is not None:
+            expires, principal = entry
+            if expires > now and not (principal and principal.expired):
+                self._local.move_to_end(key_hash)
+                return CacheLookup(True, principal)
+            del self._local[key_hash]
+
+        if self._tombstoned(key_hash, now):
+            return CacheLookup(False, cacheable=False)
+
+        client = redis_manager.redis_client
+        if not client:
+            return CacheLookup(False)
+
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.get(self.redis_key(key_hash))
+            pipe.pttl(self.redis_key(key_hash))
+            raw, ttl_ms = await pipe.execute()
+        except Exception as e:
+            logger.warning("Read API key cache failed", error=str(e))
+            return CacheLookup(False)
+
+        if raw is None:
+            return CacheLookup(False)
+        if raw == TOMBSTONE:
+            return CacheLookup(False, cacheable=False)
+
+        principal = None if raw == NEGATIVE else APIKeyPrincipal.from_json(raw)
+        if principal is not None and principal.expired:
+            return CacheLookup(False)
+        self._store_local(key_hash, principal, ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else None)
+        return CacheLookup(True, principal)
+
+    async def store(self, key_hash: str, principal: Optional[APIKeyPrincipal]) -> None:
+        """写入认证结果（principal 为 None 表示无效密钥）"""
+        if self._tombstoned(key_hash, time.monotonic()):
+            return
+
+        if principal is None:
+            ttl = settings.API_KEY_NEGATIVE_CACHE_TTL
+        else:
+            ttl = settings.API_KEY_CACHE_TTL
+            if principal.expires_at is not None:
+                ttl = min(ttl, (principal.expires_at - datetime.utcnow()).total_seconds())
+        if ttl <= 0:
+            return
+
+        self._store_local(key_hash, principal, ttl)
+
+        client = redis_manager.redis_client
+        if not client:
+            return
+        try:
+            # NX：不覆盖已有的墓碑
+            await client.set(
+                self.redis_key(key_hash),
+                NEGATIVE if principal is None else principal.to_json(),
+                px=max(int(ttl * 1000), 1),
+                nx=True
+            )
+        except Exception as e:
+            logger.warning("Write API key cache failed", error=str(e))
+
+    async def invalidate(self, key_hash: str) -> None:
+        """使密钥的缓存立即失效（所有进程）"""
+        self._evict(key_hash)
+
+        client = redis_manager.redis_client
+        if not client:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.set(self.redis_key(key_hash), TOMBSTONE, ex=settings.API_KEY_CACHE_TOMBSTONE_TTL)
+            pipe.publish(INVALIDATION_CHANNEL, key_hash)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("Invalidate API key cache failed", error=str(e))
+
+    def _on_invalidate(self, channel: str, key_hash: str) -> None:
+        self._evict(key_hash)
+
+    def _evict(self, key_hash: str) -> None:
+        now = time.monotonic()
+        self._local.pop(key_hash, None)
+        if len(self._tombstones) > settings.API_KEY_LOCAL_CACHE_SIZE:
+            self._tombstones = {h: until for h, until in self._tombstones.items() if until > now}
+        self._tombstones[key_hash] = now + settings.API_KEY_CACHE_TOMBSTONE_TTL
+
+    def _tombstoned(self, key_hash: str, now: float) -> bool:
+        until = self._tombstones.get(key_hash)
+        if until is None:
+            return False
+        if until > now:
+            return True
+        del self._tombstones[key_hash]
+        return False
+
+    def _store_local(self, key_hash: str, principal: Optional[APIKeyPrincipal], ttl: Optional[float]) -> None:
+        # 本地条目时间更短，作为错过失效通知时的兜底
+        local_ttl = settings.API_KEY_LOCAL_CACHE_TTL if ttl is None else min(ttl, settings.API_KEY_LOCAL_CACHE_TTL)
+        self._local[key_hash] = (time.monotonic() + local_ttl, principal)
+        self._local.move_to_end(key_hash)
+        while len(self._local) > settings.API_KEY_LOCAL_CACHE_SIZE:
+            self._local.popitem(last=False)
+
+
+# 创建全局API密钥认证缓存实例
+api_key_auth_cache = APIKeyAuthCache()
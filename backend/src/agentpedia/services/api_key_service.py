@@ -11,10 +11,25 @@ from sqlalchemy import select, and_, func
 from agentpedia.models.api_key import APIKey, APIKeyStatus, APIKeyScope
 from agentpedia.models.user import User
 from agentpedia.schemas.api_key import APIKeyCreate, APIKeyUpdate
+from agentpedia.services.api_key_cache import APIKeyPrincipal, api_key_auth_cache
 from agentpedia.services.base import BaseService
+from agentpedia.services.quota_service import QuotaLimit, build_limits, quota_engine
+from agentpedia.services.stats_service import api_key_stats_cache
+from agentpedia.services.usage_service import api_key_usage_buffer
 from agentpedia.core.exceptions import NotFoundError, PermissionError, ValidationError
 
 
+def api_key_quota_limits(api_key: APIKey) -> List[QuotaLimit]:
+    """API密钥的配额限额"""
+    return build_limits(
+        "key",
+        api_key.id,
+        api_key.rate_limit_per_minute,
+        api_key.rate_limit_per_hour,
+        api_key.rate_limit_per_day
+    )
+
+
 class APIKeyService(BaseService[APIKey, APIKeyCreate, APIKeyUpdate]):
     """API密钥服务类"""
     
@@ -72,6 +87,11 @@ class APIKeyService(BaseService[APIKey, APIKeyCreate, APIKeyUpdate]):
         self.db.add(api_key)
         await self.db.commit()
         await self.db.refresh(api_key)
+
+        if api_key.expires_at:
+            await api_key_stats_cache.invalidate(user_id)
+        else:
+            await self._record_status_change(user_id, None, APIKeyStatus.ACTIVE)
         
         return api_key, key
     
@@ -130,12 +150,19 @@ class APIKeyService(BaseService[APIKey, APIKeyCreate, APIKeyUpdate]):
         
         await self.db.commit()
         await self.db.refresh(api_key)
+
+        await api_key_auth_cache.invalidate(api_key.key_hash)
+
+        # 过期时间变化会影响过期数与下一个到期时间
+        if 'expires_at' in update_data:
+            await api_key_stats_cache.invalidate(user_id)
         
         return api_key
     
     async def activate_api_key(self, key_id: int, user_id: int) -> APIKey:
         """激活API密钥"""
         api_key = await self.get_api_key_by_id(key_id, user_id)
+        previous_status = api_key.status
         
         if api_key.status == APIKeyStatus.REVOKED:
             raise ValidationError("已撤销的密钥无法激活")
@@ -143,53 +170,83 @@ class APIKeyService(BaseService[APIKey, APIKeyCreate, APIKeyUpdate]):
         api_key.status = APIKeyStatus.ACTIVE
         await self.db.commit()
         await self.db.refresh(api_key)
+
+        await api_key_auth_cache.invalidate(api_key.key_hash)
+        await self._record_status_change(user_id, previous_status, APIKeyStatus.ACTIVE)
         
         return api_key
     
     async def deactivate_api_key(self, key_id: int, user_id: int) -> APIKey:
         """停用API密钥"""
         api_key = await self.get_api_key_by_id(key_id, user_id)
+        previous_status = api_key.status
         
         api_key.status = APIKeyStatus.INACTIVE
         await self.db.commit()
         await self.db.refresh(api_key)
+
+        await api_key_auth_cache.invalidate(api_key.key_hash)
+        await self._record_status_change(user_id, previous_status, APIKeyStatus.INACTIVE)
         
         return api_key
     
     async def revoke_api_key(self, key_id: int, user_id: int) -> APIKey:
         """撤销API密钥"""
         api_key = await self.get_api_key_by_id(key_id, user_id)
+        previous_status = api_key.status
         
         api_key.status = APIKeyStatus.REVOKED
         await self.db.commit()
         await self.db.refresh(api_key)
+
+        await api_key_auth_cache.invalidate(api_key.key_hash)
+        await self._record_status_change(user_id, previous_status, APIKeyStatus.REVOKED)
         
         return api_key
     
     async def delete_api_key(self, key_id: int, user_id: int) -> bool:
         """删除API密钥"""
         api_key = await self.get_api_key_by_id(key_id, user_id)
+        key_hash = api_key.key_hash
         
-        self.db.delete(api_key)
+        await self.db.delete(api_key)
         await self.db.commit()
-        
+        await api_key_auth_cache.invalidate(key_hash)
+
+        # 删除会同时减少使用次数与过期数，直接丢弃缓存
+        await api_key_stats_cache.invalidate(user_id)
         return True
     
-    async def update_usage(self, key_id: int, ip_address: str) -> bool:
-        """更新API密钥使用情况"""
-        api_key = await self.db.get(APIKey, key_id)
-        if not api_key:
-            return False
-        
-        api_key.usage_count += 1
-        api_key.last_used_at = datetime.utcnow()
-        api_key.last_used_ip = ip_address
-        
-        await self.db.commit()
+    async def update_usage(self, key_id: int, ip_address: Optional[str]) -> bool:
+        """
+        记录API密钥使用情况
+
+        只累加到写回缓冲，由后台任务批量写回数据库（同时更新使用统计缓存）
+        """
+        await api_key_usage_buffer.record(key_id, ip_address)
         return True
+
+    async def get_usage(self, key_id: int, user_id: int, hours: int = 24) -> Dict[str, Any]:
+        """获取API密钥使用情况（含尚未写回的次数与最近若干小时的使用序列）"""
+        api_key = await self.get_api_key_by_id(key_id, user_id)
+        pending_calls, pending_last_used_at = await api_key_usage_buffer.pending(key_id)
+        series = await api_key_usage_buffer.hourly_usage(key_id, hours)
+
+        last_used_at = api_key.last_used_at
+        if pending_last_used_at and (last_used_at is None or pending_last_used_at > last_used_at):
+            last_used_at = pending_last_used_at
+
+        return {
+            'key_id': api_key.id,
+            'key_name': api_key.name,
+            'usage_count': api_key.usage_count + pending_calls,
+            'last_used_at': last_used_at,
+            'rate_limit_remaining': await self.check_rate_limit(key_id),
+            'hourly_usage': [{'hour': hour, 'count': count} for hour, count in series],
+        }
     
     async def check_rate_limit(self, key_id: int) -> Dict[str, Any]:
-        """检查速率限制"""
+        """检查速率限制（查询当前剩余配额，不扣减）"""
         api_key = await self.db.get(APIKey, key_id)
         if not api_key:
             return {'allowed': False, 'reason': 'API密钥不存在'}
@@ -201,15 +258,19 @@ class APIKeyService(BaseService[APIKey, APIKeyCreate, APIKeyUpdate]):
         if api_key.expires_at and api_key.expires_at < datetime.utcnow():
             return {'allowed': False, 'reason': 'API密钥已过期'}
         
-        # 这里应该实现实际的速率限制检查逻辑
-        # 可以使用Redis或内存缓存来跟踪请求频率
-        # 暂时返回允许
-        return {
-            'allowed': True,
-            'rate_limit_per_minute': api_key.rate_limit_per_minute,
-            'rate_limit_per_hour': api_key.rate_limit_per_hour,
-            'rate_limit_per_day': api_key.rate_limit_per_day
-        }
+        limits = api_key_quota_limits(api_key)
+        decision = await quota_engine.peek(limits)
+        states = {state.limit.window: state for state in decision.states} if decision else {}
+        
+        now = datetime.utcnow()
+        info: Dict[str, Any] = {'allowed': True}
+        for limit in limits:
+            state = states.get(limit.window)
+            info[f'limit_per_{limit.window}'] = limit.limit
+            info[f'remaining_per_{limit.window}'] = state.remaining if state else limit.limit
+            reset_after = state.reset_after_ms if state else 0
+            info[f'reset_time_{limit.window}'] = now + timedelta(milliseconds=reset_after)
+        return info
     
     async def extend_expiry(self, key_id: int, user_id: int, days: int) -> APIKey:
         """延长API密钥过期时间"""
@@ -224,72 +285,88 @@ class APIKeyService(BaseService[APIKey, APIKeyCreate, APIKeyUpdate]):
         
         await self.db.commit()
         await self.db.refresh(api_key)
+        await api_key_auth_cache.invalidate(api_key.key_hash)
+        await api_key_stats_cache.invalidate(user_id)
         
         return api_key
     
     async def get_api_key_stats(self, user_id: int) -> Dict[str, Any]:
-        """获取用户的API密钥统计信息"""
-        # 总密钥数
-        total_query = select(func.count(APIKey.id)).where(APIKey.user_id == user_id)
-        total_result = await self.db.execute(total_query)
-        total_keys = total_result.scalar() or 0
-        
-        # 活跃密钥数
-        active_query = select(func.count(APIKey.id)).where(
-            and_(
-                APIKey.user_id == user_id,
-                APIKey.status == APIKeyStatus.ACTIVE
-            )
-        )
-        active_result = await self.db.execute(active_query)
-        active_keys = active_result.scalar() or 0
-        
-        # 过期密钥数
-        expired_query = select(func.count(APIKey.id)).where(
-            and_(
-                APIKey.user_id == user_id,
-                APIKey.expires_at < datetime.utcnow()
-            )
-        )
-        expired_result = await self.db.execute(expired_query)
-        expired_keys = expired_result.scalar() or 0
-        
-        # 已撤销密钥数
-        revoked_query = select(func.count(APIKey.id)).where(
-            and_(
-                APIKey.user_id == user_id,
-                APIKey.status == APIKeyStatus.REVOKED
-            )
-        )
-        revoked_result = await self.db.execute(revoked_query)
-        revoked_keys = revoked_result.scalar() or 0
-        
-        # 总使用次数
-        usage_query = select(func.sum(APIKey.usage_count)).where(APIKey.user_id == user_id)
-        usage_result = await self.db.execute(usage_query)
-        total_usage = usage_result.scalar() or 0
-        
+        """获取用户的API密钥统计信息（优先读取缓存的计数器）"""
+        counters = await api_key_stats_cache.get(user_id)
+
+        # 过期数随时间变化，越过缓存中记录的下一个到期时间后重新计算
+        if counters is not None and counters.get('next_expiry'):
+            if datetime.fromisoformat(counters['next_expiry']) <= datetime.utcnow():
+                counters = None
+
+        if counters is None:
+            counters = await self._compute_api_key_stats(user_id)
+            await api_key_stats_cache.store(user_id, counters)
+
         return {
-            'total_keys': total_keys,
-            'active_keys': active_keys,
-            'expired_keys': expired_keys,
-            'revoked_keys': revoked_keys,
-            'total_usage': total_usage
+            'total_keys': counters['total_keys'],
+            'active_keys': counters['active_keys'],
+            'expired_keys': counters['expired_keys'],
+            'revoked_keys': counters['revoked_keys'],
+            'total_usage': counters['total_usage']
         }
+
+    async def _compute_api_key_stats(self, user_id: int) -> Dict[str, Any]:
+        """用一条聚合查询计算用户的API密钥计数"""
+        now = datetime.utcnow()
+        query = select(
+            func.count(),
+            func.count().filter(APIKey.status == APIKeyStatus.ACTIVE),
+            func.count().filter(APIKey.expires_at < now),
+            func.count().filter(APIKey.status == APIKeyStatus.REVOKED),
+            func.coalesce(func.sum(APIKey.usage_count), 0),
+            func.min(APIKey.expires_at).filter(APIKey.expires_at >= now)
+        ).where(APIKey.user_id == user_id)
+
+        result = await self.db.execute(query)
+        total, active, expired, revoked, usage, next_expiry = result.one()
+
+        return {
+            'total_keys': total,
+            'active_keys': active,
+            'expired_keys': expired,
+            'revoked_keys': revoked,
+            'total_usage': int(usage),
+            'next_expiry': next_expiry.isoformat() if next_expiry else None
+        }
+
+    async def _record_status_change(
+        self,
+        user_id: int,
+        previous: Optional[APIKeyStatus],
+        current: Optional[APIKeyStatus]
+    ) -> None:
+        """按状态变化增量更新统计缓存（None 表示新建或删除）"""
+        if previous == current:
+            return
+        deltas = {'total_keys': (current is not None) - (previous is not None)}
+        for status, field in ((APIKeyStatus.ACTIVE, 'active_keys'), (APIKeyStatus.REVOKED, 'revoked_keys')):
+            deltas[field] = (current == status) - (previous == status)
+        await api_key_stats_cache.incr(user_id, **deltas)
     
-    async def validate_api_key(self, key: str) -> Optional[APIKey]:
-        """验证API密钥"""
-        api_key = await self.get_api_key_by_key(key)
-        
-        if not api_key:
-            return None
+    async def validate_api_key(self, key: str) -> Optional[APIKeyPrincipal]:
+        """验证API密钥（结果按密钥哈希缓存，命中时不访问数据库）"""
+        key_hash = hashlib.sha256(key.encode()).hexdigest()
         
-        # 检查状态
-        if api_key.status != APIKeyStatus.ACTIVE:
-            return None
+        cached = await api_key_auth_cache.get(key_hash)
+        if cached.found:
+            return cached.principal
         
-        # 检查过期时间
-        if api_key.expires_at and api_key.expires_at < datetime.utcnow():
-            return None
+        api_key = await self.get_api_key_by_key(key)
         
-        return api_key
\ No newline at end of file
+        principal = None
+        if (
+            api_key is not None
+            and api_key.status == APIKeyStatus.ACTIVE
+            and not (api_key.expires_at and api_key.expires_at < datetime.utcnow())
+        ):
+            principal = APIKeyPrincipal.from_model(api_key)
+        
+        if cached.cacheable:
+            await api_key_auth_cache.store(key_hash, principal)
+        return principal
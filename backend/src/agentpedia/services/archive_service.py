@@ -0,0 +1,245 @@
+"""
+消息归档服务
+
+已删除或长期不活跃对话的消息按对话打包为压缩的 JSON，
+移入冷表 message_archives，热表 messages 只保留活跃数据。
+读取对话时透明地把归档消息恢复回热表。
+"""
+import enum
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import DateTime, and_, column, delete, exists, or_, select, table, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+import zstandard
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.database import AsyncSessionLocal
+from agentpedia.core.logging import get_logger
+from agentpedia.models.conversation import Conversation, ConversationStatus, Message
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+CODEC_ZSTD = "zstd"
+CODEC_ZLIB = "zlib"
+
+# 冷表（无对应ORM模型，仅声明查询用到的列）
+message_archives = table(
+    "message_archives",
+    column("conversation_id"),
+    column("restored_at"),
+)
+
+# 恢复时每条 INSERT 的行数，避免超出驱动的参数数量上限
+RESTORE_CHUNK_SIZE = 1000
+
+
+def compress(data: bytes) -> Tuple[bytes, str]:
+    """压缩数据，返回 (压缩结果, 编码)"""
+    return zstandard.ZstdCompressor(level=settings.MESSAGE_ARCHIVE_ZSTD_LEVEL).compress(data), CODEC_ZSTD
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    """按编码解压数据（zlib 仅用于读取早期写入的归档）"""
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class MessageArchiveService:
+    """消息归档服务"""
+
+    def __init__(self):
+        self.messages = Message.__table__
+
+    def _encode_rows(self, rows: List[Dict[str, Any]]) -> bytes:
+        def default(value):
+            if isinstance(value, datetime):
+                return value.isoformat()
+            if isinstance(value, enum.Enum):
+                return value.name
+            return str(value)
+
+        return json.dumps(rows, ensure_ascii=False, default=default, separators=(",", ":")).encode()
+
+    def _decode_rows(self, payload: bytes) -> List[Dict[str, Any]]:
+        rows = json.loads(payload)
+        for row in rows:
+            for message_column in self.messages.columns:
+                value = row.get(message_column.key)
+                if value is None:
+                    continue
+                if isinstance(message_column.type, DateTime):
+                    row[message_column.key] = datetime.fromisoformat(value)
+                elif getattr(message_column.type, "enum_class", None) is not None:
+                    row[message_column.key] = message_column.type.enum_class[value]
+        return rows
+
+    async def archive_batch(self) -> int:
+        """
+        归档一批符合条件的对话
+
+        Returns:
+            归档的对话数量
+        """
+        cutoff = datetime.utcnow() - timedelta(days=settings.MESSAGE_ARCHIVE_INACTIVE_DAYS)
+
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                select(Conversation.id)
+                .where(
+                    or_(
+                        Conversation.status == ConversationStatus.DELETED,
+                        Conversation.updated_at < cutoff
+                    ),
+                    exists().where(Message.conversation_id == Conversation.id),
+                    # 近期被恢复过的对话暂不再归档，避免反复搬迁
+                    ~exists().where(
+                        message_archives.c.conversation_id == Conversation.id,
+                        message_archives.c.restored_at > cutoff
+                    )
+                )
+                .order_by(Conversation.updated_at)
+                .limit(settings.MESSAGE_ARCHIVE_BATCH_SIZE)
+            )
+            conversation_ids = list(result.scalars())
+
+        archived = 0
+        for conversation_id in conversation_ids:
+            try:
+                async with AsyncSessionLocal() as session:
+                    if await self._archive_conversation(session, conversation_id):
+                        archived += 1
+                    await session.commit()
+            except Exception as e:
+                logger.error("Archive conversation failed", conversation_id=conversation_id, error=str(e))
+
+        if archived:
+            logger.info("Conversations archived", count=archived)
+        return archived
+
+    async def _archive_conversation(self, session: AsyncSession, conversation_id: int) -> bool:
+        """把一个对话的热表消息并入其归档记录"""
+        table = self.messages
+
+        result = await session.execute(
+            select(table)
+            .where(table.c.conversation_id == conversation_id)
+            .order_by(table.c.id)
+            .with_for_update()
+        )
+        rows = [dict(row._mapping) for row in result]
+        if not rows:
+            return False
+
+        # 已有归档（例如恢复后再次归档前又产生了新消息）时合并
+        existing = await session.execute(
+            text(
+                "SELECT payload, codec FROM message_archives "
+                "WHERE conversation_id = :conversation_id FOR UPDATE"
+            ),
+            {"conversation_id": conversation_id}
+        )
+        previous = existing.first()
+        if previous is not None and previous.payload is not None:
+            archived_rows = json.loads(decompress(previous.payload, previous.codec))
+            archived_ids = {row["id"] for row in archived_rows}
+            encoded = json.loads(self._encode_rows(rows))
+            rows_payload = archived_rows + [row for row in encoded if row["id"] not in archived_ids]
+            raw = json.dumps(rows_payload, ensure_ascii=False, separators=(",", ":")).encode()
+            message_count = len(rows_payload)
+        else:
+            raw = self._encode_rows(rows)
+            message_count = len(rows)
+
+        payload, codec = compress(raw)
+        await session.execute(
+            text(
+                "INSERT INTO message_archives "
+                "(conversation_id, payload, codec, message_count, raw_size, archived_at) "
+                "VALUES (:conversation_id, :payload, :codec, :message_count, :raw_size, timezone('utc', now())) "
+                "ON CONFLICT (conversation_id) DO UPDATE SET "
+                "payload = EXCLUDED.payload, codec = EXCLUDED.codec, "
+                "message_count = EXCLUDED.message_count, raw_size = EXCLUDED.raw_size, "
+                "archived_at = EXCLUDED.archived_at, restored_at = NULL"
+            ),
+            {
+                "conversation_id": conversation_id,
+                "payload": payload,
+                "codec": codec,
+                "message_count": message_count,
+                "raw_size": len(raw),
+            }
+        )
+
+        # 只删除已打包的行，归档期间新写入的消息留在热表
+        await session.execute(
+            delete(table).where(
+                and_(
+                    table.c.conversation_id == conversation_id,
+                    table.c.id <= rows[-1]["id"]
+                )
+            )
+        )
+        return True
+
+    async def restore(self, conversation_id: int) -> int:
+        """
+        若对话存在归档，则把消息恢复回热表（在独立事务中执行并提交）
+
+        只在查看历史消息与导出时调用；已删除的对话不恢复，保持归档。
+        没有待恢复的归档时只是两次按主键的查询，几乎没有开销。
+        归档记录保留并标记 restored_at，用于推迟下一次归档。
+
+        Returns:
+            恢复的消息数量
+        """
+        async with AsyncSessionLocal() as session:
+            status = await session.scalar(
+                select(Conversation.status).where(Conversation.id == conversation_id)
+            )
+            if status is None or status == ConversationStatus.DELETED:
+                return 0
+
+            count = await self._restore(session, conversation_id)
+            if count:
+                await session.commit()
+
+        if count:
+            logger.info("Conversation messages restored", conversation_id=conversation_id, count=count)
+        return count
+
+    async def _restore(self, session: AsyncSession, conversation_id: int) -> int:
+        result = await session.execute(
+            text(
+                "WITH archived AS ("
+                "  SELECT conversation_id, payload, codec FROM message_archives "
+                "  WHERE conversation_id = :conversation_id AND payload IS NOT NULL FOR UPDATE"
+                ") "
+                "UPDATE message_archives m "
+                "SET payload = NULL, restored_at = timezone('utc', now()) "
+                "FROM archived WHERE m.conversation_id = archived.conversation_id "
+                "RETURNING archived.payload, archived.codec"
+            ),
+            {"conversation_id": conversation_id}
+        )
+        archive = result.first()
+        if archive is None:
+            return 0
+
+        rows = self._decode_rows(decompress(archive.payload, archive.codec))
+        for start in range(0, len(rows), RESTORE_CHUNK_SIZE):
+            await session.execute(
+                pg_insert(self.messages)
+                .values(rows[start:start + RESTORE_CHUNK_SIZE])
+                .on_conflict_do_nothing(index_elements=["id"])
+            )
+        return len(rows)
+
+
+# 创建全局消息归档服务实例
+message_archive_service = MessageArchiveService()
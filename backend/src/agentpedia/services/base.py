@@ -1,10 +1,12 @@
 """
 基础服务类
 """
+from datetime import datetime
 from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
 
 from pydantic import BaseModel
-from sqlalchemy import and_, func
+from sqlalchemy import and_, bindparam, func, insert, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
@@ -130,79 +132,134 @@ class BaseService(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         defaults: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> tuple[ModelType, bool]:
-        """获取或创建对象"""
-        # 查找现有对象
+        """获取或创建对象（INSERT ... ON CONFLICT DO NOTHING，并发安全）"""
         conditions = [self.model.deleted_at.is_(None)]
         for key, value in kwargs.items():
             if hasattr(self.model, key):
                 conditions.append(getattr(self.model, key) == value)
-        
-        stmt = select(self.model).where(and_(*conditions))
-        result = self.db.execute(stmt)
+        lookup = select(self.model).where(and_(*conditions))
+
+        # 常见路径：对象已存在，一次查询返回
+        result = await self.db.execute(lookup)
         obj = result.scalar_one_or_none()
-        
         if obj:
             return obj, False
-        
-        # 创建新对象
+
         create_data = kwargs.copy()
         if defaults:
             create_data.update(defaults)
-        
-        obj = self.model(**create_data)
-        self.db.add(obj)
+
+        # 依赖唯一约束解决并发创建，冲突时不报错也不返回行
+        stmt = (
+            pg_insert(self.model)
+            .values(**create_data)
+            .on_conflict_do_nothing()
+            .returning(self.model.id)
+        )
+        result = await self.db.execute(stmt)
+        new_id = result.scalar_one_or_none()
         await self.db.commit()
-        await self.db.refresh(obj)
-        
-        return obj, True
+
+        if new_id is None:
+            # 并发请求抢先创建，读取胜出方写入的行
+            result = await self.db.execute(lookup)
+            return result.scalar_one(), False
+
+        result = await self.db.execute(
+            select(self.model).where(self.model.id == new_id)
+        )
+        return result.scalar_one(), True
     
     async def bulk_create(self, objs_in: List[CreateSchemaType]) -> List[ModelType]:
-        """批量创建对象"""
-        db_objs = []
-        for obj_in in objs_in:
-            obj_data = obj_in.model_dump()
-            db_obj = self.model(**obj_data)
-            db_objs.append(db_obj)
-        
-        self.db.add_all(db_objs)
-        await self.db.commit()
+        """批量创建对象（单条 INSERT ... RETURNING）"""
+        if not objs_in:
+            return []
         
-        for db_obj in db_objs:
-            await self.db.refresh(db_obj)
+        rows = [obj_in.model_dump() for obj_in in objs_in]
+        stmt = insert(self.model).returning(
+            self.model.id, sort_by_parameter_order=True
+        )
+        result = await self.db.execute(stmt, rows)
+        ids = list(result.scalars())
+        await self.db.commit()
         
-        return db_objs
+        return await self._get_many_by_ids(ids)
     
     async def bulk_update(
         self,
         updates: List[Dict[str, Any]]
     ) -> List[ModelType]:
-        """批量更新对象"""
-        updated_objs = []
+        """
+        批量更新对象
+        
+        相同字段集合的更新合并为一次 executemany，
+        不同字段集合各执行一次，最后一次查询取回结果。
+        
+        Args:
+            updates: 更新列表，每项必须包含 "id"
+        """
+        table = self.model.__table__
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        ids = []
         
         for update_data in updates:
-            obj_id = update_data.pop("id")
-            db_obj = await self.get(obj_id)
-            if db_obj:
-                for field, value in update_data.items():
-                    if hasattr(db_obj, field):
-                        setattr(db_obj, field, value)
-                updated_objs.append(db_obj)
+            obj_id = update_data["id"]
+            fields = tuple(sorted(
+                field for field in update_data
+                if field != "id" and field in table.c
+            ))
+            ids.append(obj_id)
+            if not fields:
+                continue
+            params = {f"_{field}": update_data[field] for field in fields}
+            params["_id"] = obj_id
+            groups.setdefault(fields, []).append(params)
         
-        await self.db.commit()
+        if not ids:
+            return []
+        
+        for fields, params in groups.items():
+            stmt = (
+                update(table)
+                .where(
+                    table.c.id == bindparam("_id"),
+                    table.c.deleted_at.is_(None)
+                )
+                .values({field: bindparam(f"_{field}") for field in fields})
+            )
+            await self.db.execute(stmt, params)
         
-        for db_obj in updated_objs:
-            await self.db.refresh(db_obj)
+        await self.db.commit()
         
-        return updated_objs
+        return await self._get_many_by_ids(ids)
     
     async def bulk_delete(self, ids: List[Any]) -> int:
-        """批量软删除对象"""
-        count = 0
-        for obj_id in ids:
-            db_obj = await self.get(obj_id)
-            if db_obj:
-                db_obj.soft_delete()
-                count += 1
+        """批量软删除对象（单条 UPDATE）"""
+        if not ids:
+            return 0
         
+        stmt = (
+            update(self.model)
+            .where(
+                self.model.id.in_(ids),
+                self.model.deleted_at.is_(None)
+            )
+            .values(deleted_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        result = await self.db.execute(stmt)
         await self.db.commit()
-        return count
\ No newline at end of file
+        return result.rowcount
+    
+    async def _get_many_by_ids(self, ids: List[Any]) -> List[ModelType]:
+        """按ID列表一次性取回对象，保持输入顺序"""
+        if not ids:
+            return []
+        
+        stmt = select(self.model).where(
+            self.model.id.in_(ids),
+            self.model.deleted_at.is_(None)
+        )
+        result = await self.db.execute(stmt)
+        by_id = {obj.id: obj for obj in result.scalars()}
+        return [by_id[obj_id] for obj_id in dict.fromkeys(ids) if obj_id in by_id]
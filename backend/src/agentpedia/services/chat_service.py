@@ -0,0 +1,289 @@
+"""
+聊天服务
+
+负责解析对话与Agent、组装上下文、调用模型提供商流式生成回复，
+并在生成结束后通过 MessageService 持久化本轮对话。
+"""
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import and_, select
+
+from agentpedia.core.database import AsyncSessionLocal
+from agentpedia.core.exceptions import NotFoundError, PermissionError, ValidationError
+from agentpedia.core.logging import get_logger
+from agentpedia.models.agent import Agent
+from agentpedia.models.conversation import Conversation, ConversationStatus
+from agentpedia.schemas.conversation import ChatStreamChunk, ConversationCreate
+from agentpedia.services.analytics_service import analytics_event_buffer
+from agentpedia.services.api_key_service import api_key_quota_limits
+from agentpedia.services.context_service import context_builder
+from agentpedia.services.conversation_service import ConversationService, MessageService
+from agentpedia.services.llm_service import LLMProvider, llm_registry
+from agentpedia.services.quota_service import QuotaDecision, build_limits, quota_engine
+from agentpedia.services.usage_service import agent_usage_buffer
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class ChatContext:
+    """一次聊天请求的已解析上下文"""
+
+    agent_id: int
+    conversation_id: int
+    user_id: int
+    user_message: str
+    provider: LLMProvider
+    model: str
+    temperature: float
+    max_tokens: Optional[int]
+    memory_window: Optional[int] = None
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    quota: Optional[QuotaDecision] = None
+    # 本次请求新建了对话（计入分析数据的对话数）
+    new_conversation: bool = False
+
+
+class ChatService:
+    """聊天服务"""
+
+    async def prepare(
+        self,
+        user_id: int,
+        message: str,
+        agent_id: Optional[int] = None,
+        conversation_id: Optional[int] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        api_key=None
+    ) -> ChatContext:
+        """
+        解析Agent与对话、扣减配额并组装上下文（在开始流式输出之前完成所有校验）
+
+        Args:
+            api_key: 请求携带的API密钥，其限额与Agent的限额一起检查
+
+        Raises:
+            NotFoundError: Agent或对话不存在
+            PermissionError: 无权访问Agent
+            ValidationError: 对话不属于该Agent
+            QuotaExceededError: 超出API密钥或Agent的配额
+        """
+        async with AsyncSessionLocal() as session:
+            message_count = 0
+            if conversation_id is not None:
+                result = await session.execute(
+                    select(Conversation.agent_id, Conversation.message_count).where(
+                        and_(
+                            Conversation.id == conversation_id,
+                            Conversation.user_id == user_id,
+                            Conversation.status != ConversationStatus.DELETED
+                        )
+                    )
+                )
+                row = result.first()
+                if row is None:
+                    raise NotFoundError("对话不存在或无权访问")
+                conversation_agent_id, message_count = row
+                if agent_id is not None and agent_id != conversation_agent_id:
+                    raise ValidationError("对话不属于该Agent")
+                agent_id = conversation_agent_id
+
+            result = await session.execute(
+                select(Agent).where(
+                    Agent.id == agent_id,
+                    Agent.deleted_at.is_(None)
+                )
+            )
+            agent = result.scalar_one_or_none()
+            if not agent:
+                raise NotFoundError("Agent不存在")
+
+            if agent.visibility.value == "private" and agent.owner_id != user_id:
+                raise PermissionError("无权限访问此Agent")
+
+            limits = build_limits(
+                "agent",
+                agent.id,
+                agent.rate_limit_per_minute,
+                agent.rate_limit_per_hour,
+                agent.rate_limit_per_day
+            )
+            if api_key is not None:
+                limits = api_key_quota_limits(api_key) + limits
+            quota = await quota_engine.enforce(limits)
+
+            # 提交会使实例过期，先取出需要的配置
+            system_prompt = agent.system_prompt
+            chat = ChatContext(
+                agent_id=agent.id,
+                conversation_id=conversation_id,
+                user_id=user_id,
+                user_message=message,
+                provider=llm_registry.for_agent(agent),
+                model=agent.model_name,
+                temperature=temperature if temperature is not None else float(agent.temperature),
+                max_tokens=max_tokens or agent.max_tokens,
+                memory_window=agent.memory_window,
+                quota=quota
+            )
+
+            if chat.conversation_id is None:
+                conversation = await ConversationService(session).create_conversation(
+                    ConversationCreate(agent_id=chat.agent_id), user_id
+                )
+                chat.conversation_id = conversation.id
+                chat.new_conversation = True
+
+            chat.messages = await context_builder.build(
+                session,
+                chat.conversation_id,
+                chat.user_message,
+                chat.provider,
+                system_prompt=system_prompt,
+                memory_window=chat.memory_window,
+                max_tokens=chat.max_tokens,
+                message_count=message_count
+            )
+
+        return chat
+
+    async def stream(self, chat: ChatContext) -> AsyncIterator[ChatStreamChunk]:
+        """
+        流式生成回复
+
+        第一块立即返回（仅含对话ID），随后逐块转发模型输出；
+        生成结束后保存本轮对话，最后一块携带消息ID与用量。
+        """
+        started = time.perf_counter()
+        yield ChatStreamChunk(conversation_id=chat.conversation_id, content="")
+
+        parts: List[str] = []
+        prompt_tokens: Optional[int] = None
+        completion_tokens: Optional[int] = None
+        first_token_at: Optional[float] = None
+
+        try:
+            async for delta in chat.provider.stream(
+                chat.messages,
+                chat.model,
+                temperature=chat.temperature,
+                max_tokens=chat.max_tokens
+            ):
+                if delta.prompt_tokens is not None:
+                    prompt_tokens = delta.prompt_tokens
+                if delta.completion_tokens is not None:
+                    completion_tokens = delta.completion_tokens
+                if not delta.content:
+                    continue
+
+                if first_token_at is None:
+                    first_token_at = time.perf_counter() - started
+                parts.append(delta.content)
+                yield ChatStreamChunk(conversation_id=chat.conversation_id, content=delta.content)
+        except Exception:
+            # 生成失败也计入分析数据，用于成功率统计
+            await analytics_event_buffer.record_usage(
+                chat.agent_id,
+                conversations=int(chat.new_conversation),
+                messages=1,
+                response_time=round(time.perf_counter() - started, 3),
+                failed_messages=1
+            )
+            raise
+
+        reply = "".join(parts)
+        processing_time = round(time.perf_counter() - started, 3)
+
+        provider = chat.provider
+        if prompt_tokens is None:
+            prompt_tokens = sum(provider.count_tokens(m["content"]) for m in chat.messages)
+        if completion_tokens is None:
+            completion_tokens = provider.count_tokens(reply)
+        total_tokens = prompt_tokens + completion_tokens
+        cost = provider.estimate_cost(total_tokens)
+
+        message_id = await self._persist(chat, reply, completion_tokens, total_tokens, cost, processing_time)
+
+        logger.info(
+            "Chat completed",
+            agent_id=chat.agent_id,
+            conversation_id=chat.conversation_id,
+            provider=provider.name,
+            time_to_first_token=round(first_token_at, 3) if first_token_at is not None else None,
+            processing_time=processing_time,
+            tokens=total_tokens
+        )
+
+        yield ChatStreamChunk(
+            conversation_id=chat.conversation_id,
+            message_id=message_id,
+            content="",
+            is_final=True,
+            tokens_used=total_tokens,
+            cost=cost,
+            processing_time=processing_time
+        )
+
+    async def complete(self, chat: ChatContext) -> ChatStreamChunk:
+        """非流式调用：收集完整回复，返回包含全文的最后一块"""
+        parts: List[str] = []
+        final: Optional[ChatStreamChunk] = None
+        async for chunk in self.stream(chat):
+            if chunk.is_final:
+                final = chunk
+            else:
+                parts.append(chunk.content)
+
+        final.content = "".join(parts)
+        return final
+
+    async def _persist(
+        self,
+        chat: ChatContext,
+        reply: str,
+        completion_tokens: int,
+        total_tokens: int,
+        cost: float,
+        processing_time: float
+    ) -> int:
+        """保存本轮对话、追加上下文窗口并累加Agent使用统计与分析事件"""
+        user_tokens = chat.provider.count_tokens(chat.user_message)
+        async with AsyncSessionLocal() as session:
+            message = await MessageService(session).save_chat_exchange(
+                chat.conversation_id,
+                chat.user_message,
+                reply,
+                user_tokens=user_tokens,
+                assistant_tokens=completion_tokens,
+                total_tokens=total_tokens,
+                cost=cost,
+                processing_time=processing_time
+            )
+            message_id = message.id
+
+        await context_builder.append(
+            chat.conversation_id,
+            [
+                {"role": "user", "content": chat.user_message, "tokens": user_tokens},
+                {"role": "assistant", "content": reply, "tokens": completion_tokens},
+            ],
+            chat.memory_window or 0
+        )
+        await agent_usage_buffer.record(chat.agent_id, total_tokens, cost, processing_time)
+        # 分析数据的消息数按回复计，平均响应时间即每条回复的耗时
+        await analytics_event_buffer.record_usage(
+            chat.agent_id,
+            conversations=int(chat.new_conversation),
+            messages=1,
+            tokens=total_tokens,
+            cost=cost,
+            response_time=processing_time
+        )
+        return message_id
+
+
+# 创建全局聊天服务实例
+chat_service = ChatService()
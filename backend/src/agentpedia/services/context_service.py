@@ -0,0 +1,164 @@
+"""
+对话上下文组装服务
+
+按 Agent.memory_window 取最近的消息，并按token预算裁剪。
+最近消息窗口缓存在 Redis 列表中，新消息到达时追加，
+组装上下文的开销只与窗口大小相关，与对话长度无关。
+"""
+import json
+from typing import Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+from agentpedia.services.archive_service import message_archive_service
+from agentpedia.services.conversation_service import MessageService
+from agentpedia.services.llm_service import LLMProvider
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+
+class ConversationContextBuilder:
+    """对话上下文组装器"""
+
+    @staticmethod
+    def window_key(conversation_id: int) -> str:
+        """消息窗口缓存键"""
+        return f"chat:window:{conversation_id}"
+
+    async def build(
+        self,
+        session: AsyncSession,
+        conversation_id: int,
+        user_message: str,
+        provider: LLMProvider,
+        system_prompt: Optional[str] = None,
+        memory_window: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        message_count: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        组装发送给模型的消息列表
+
+        Args:
+            session: 数据库会话（缓存未命中时使用）
+            conversation_id: 对话ID
+            user_message: 本轮用户消息
+            provider: 模型提供商（用于估算token）
+            system_prompt: 系统提示词
+            memory_window: 最多携带的历史消息条数
+            max_tokens: token预算（含系统提示词与本轮消息）
+            message_count: 对话现有消息数，用于判断缓存窗口是否完整
+        """
+        window_size = memory_window or settings.CHAT_DEFAULT_MEMORY_WINDOW
+        history = await self.get_window(session, conversation_id, window_size, provider, message_count)
+
+        head = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        tail = [{"role": "user", "content": user_message}]
+
+        budget = max_tokens or settings.CHAT_DEFAULT_CONTEXT_TOKENS
+        used = sum(provider.count_tokens(m["content"]) for m in head + tail)
+
+        # 从最新的消息向前累加，超出预算即停止，保证历史连续
+        kept: List[dict] = []
+        for entry in reversed(history):
+            if used + entry["tokens"] > budget:
+                break
+            used += entry["tokens"]
+            kept.append(entry)
+        kept.reverse()
+
+        if len(kept) < len(history):
+            logger.debug(
+                "Chat context trimmed",
+                conversation_id=conversation_id,
+                kept=len(kept),
+                window=len(history),
+                tokens=used
+            )
+
+        return head + [{"role": m["role"], "content": m["content"]} for m in kept] + tail
+
+    async def get_window(
+        self,
+        session: AsyncSession,
+        conversation_id: int,
+        window_size: int,
+        provider: LLMProvider,
+        message_count: Optional[int] = None
+    ) -> List[dict]:
+        """
+        获取最近 window_size 条消息（按时间正序），优先读缓存
+
+        热表中的消息少于应有数量时，对话可能已被归档，先恢复归档再读取。
+        """
+        if message_count == 0:
+            return []
+
+        key = self.window_key(conversation_id)
+        client = redis_manager.redis_client
+        expected = window_size if message_count is None else min(window_size, message_count)
+
+        if client:
+            try:
+                cached = await client.lrange(key, -window_size, -1)
+                if cached and len(cached) >= expected:
+                    return [json.loads(item) for item in cached]
+            except Exception as e:
+                logger.warning("Read chat window cache failed", error=str(e), conversation_id=conversation_id)
+
+        message_service = MessageService(session)
+        messages = await message_service.get_recent_messages(conversation_id, window_size)
+        if len(messages) < expected and await message_archive_service.restore(conversation_id):
+            messages = await message_service.get_recent_messages(conversation_id, window_size)
+        window = [
+            {
+                "role": getattr(m.role, "value", m.role),
+                "content": m.content,
+                "tokens": m.tokens_used or provider.count_tokens(m.content),
+            }
+            for m in messages
+        ]
+
+        if client and window:
+            try:
+                pipe = client.pipeline(transaction=True)
+                pipe.delete(key)
+                pipe.rpush(key, *[json.dumps(entry, ensure_ascii=False) for entry in window])
+                pipe.expire(key, settings.CHAT_WINDOW_CACHE_TTL)
+                await pipe.execute()
+            except Exception as e:
+                logger.warning("Populate chat window cache failed", error=str(e), conversation_id=conversation_id)
+
+        return window
+
+    async def append(self, conversation_id: int, entries: List[dict], window_size: int) -> None:
+        """
+        向缓存窗口追加新消息
+
+        只在窗口已存在时追加（RPUSHX），避免生成不完整的窗口。
+        """
+        client = redis_manager.redis_client
+        if not client or not entries:
+            return
+
+        key = self.window_key(conversation_id)
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.rpushx(key, *[json.dumps(entry, ensure_ascii=False) for entry in entries])
+            pipe.ltrim(key, -max(window_size, settings.CHAT_DEFAULT_MEMORY_WINDOW), -1)
+            pipe.expire(key, settings.CHAT_WINDOW_CACHE_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("Append chat window cache failed", error=str(e), conversation_id=conversation_id)
+
+    async def invalidate(self, conversation_id: int) -> None:
+        """消息被修改或删除后使缓存窗口失效"""
+        await redis_manager.delete(self.window_key(conversation_id))
+
+
+# 创建全局上下文组装器实例
+context_builder = ConversationContextBuilder()
@@ -1,21 +1,74 @@
 """
 对话服务类
 """
-from typing import List, Optional, Dict, Any
+import html
+import re
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func, desc
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, and_, or_, func, desc, update, case, cast, tuple_, Float
 
 from agentpedia.models.conversation import Conversation, Message, ConversationStatus, MessageRole, MessageType
 from agentpedia.models.agent import Agent
 from agentpedia.models.user import User
+from agentpedia.schemas.base import CursorPage
 from agentpedia.schemas.conversation import (
     ConversationCreate, ConversationUpdate, MessageCreate, MessageUpdate,
     ChatRequest, ChatResponse
 )
+from agentpedia.services.archive_service import message_archive_service
 from agentpedia.services.base import BaseService
+from agentpedia.services.stats_service import conversation_stats_cache
 from agentpedia.core.exceptions import NotFoundError, PermissionError, ValidationError
 
+# 消息搜索：最多使用的关键词数、片段在命中位置前保留的字符数与片段总长度
+SEARCH_MAX_TERMS = 5
+SNIPPET_LEAD = 40
+SNIPPET_LENGTH = 160
+
+
+def _escape_like(term: str) -> str:
+    """转义 LIKE 通配符"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_terms(query: str) -> List[str]:
+    """拆分搜索关键词：按空白分隔、去重并保留顺序，最多 SEARCH_MAX_TERMS 个"""
+    return list(dict.fromkeys(query.split()))[:SEARCH_MAX_TERMS]
+
+
+def _decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    解码搜索游标
+
+    Raises:
+        ValidationError: 游标无效
+    """
+    try:
+        position = CursorPage.decode_cursor(cursor)
+        return float(position["rank"]), int(position["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ValidationError("无效的分页游标")
+
+
+def highlight_snippet(text: str, terms: List[str]) -> str:
+    """
+    HTML 转义片段文本，并用 <mark> 标出关键词（不区分大小写）
+
+    消息内容来自用户与模型，必须先转义再插入标记，客户端才能安全地按 HTML 渲染。
+    """
+    pattern = re.compile(
+        "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)),
+        re.IGNORECASE
+    )
+    parts = []
+    last = 0
+    for match in pattern.finditer(text):
+        parts.append(html.escape(text[last:match.start()], quote=False))
+        parts.append(f"<mark>{html.escape(match.group(), quote=False)}</mark>")
+        last = match.end()
+    parts.append(html.escape(text[last:], quote=False))
+    return "".join(parts)
+
 
 class ConversationService(BaseService[Conversation, ConversationCreate, ConversationUpdate]):
     """对话服务类"""
@@ -48,17 +101,18 @@ class ConversationService(BaseService[Conversation, ConversationCreate, Conversa
         self.db.add(conversation)
         await self.db.commit()
         await self.db.refresh(conversation)
-        
+
+        await conversation_stats_cache.incr(user_id, total_conversations=1, active_conversations=1)
         return conversation
     
     async def get_conversation_by_id(self, conversation_id: int, user_id: int) -> Conversation:
-        """根据ID获取对话"""
+        """根据ID获取对话（不加载消息，消息通过 MessageService 分页读取）"""
         query = select(Conversation).where(
             and_(
                 Conversation.id == conversation_id,
                 Conversation.user_id == user_id
             )
-        ).options(selectinload(Conversation.messages))
+        )
         
         result = await self.db.execute(query)
         conversation = result.scalar_one_or_none()
@@ -104,6 +158,7 @@ class ConversationService(BaseService[Conversation, ConversationCreate, Conversa
     ) -> Conversation:
         """更新对话"""
         conversation = await self.get_conversation_by_id(conversation_id, user_id)
+        previous_status = conversation.status
         
         # 更新数据
         update_data = conversation_data.model_dump(exclude_unset=True)
@@ -112,87 +167,122 @@ class ConversationService(BaseService[Conversation, ConversationCreate, Conversa
         
         await self.db.commit()
         await self.db.refresh(conversation)
-        
+
+        # 状态变化影响多个计数，直接丢弃缓存
+        if conversation.status != previous_status:
+            await conversation_stats_cache.invalidate(user_id)
         return conversation
     
     async def delete_conversation(self, conversation_id: int, user_id: int) -> bool:
-        """删除对话"""
-        conversation = await self.get_conversation_by_id(conversation_id, user_id)
-        
-        # 软删除对话和所有消息
-        conversation.status = ConversationStatus.DELETED
-        
-        # 删除所有消息
-        messages_query = select(Message).where(Message.conversation_id == conversation_id)
-        messages_result = await self.db.execute(messages_query)
-        messages = list(messages_result.scalars())
-        
-        for message in messages:
-            message.is_deleted = True
-        
-        await self.db.commit()
-        return True
-    
-    async def get_conversation_stats(self, user_id: int) -> Dict[str, Any]:
-        """获取用户的对话统计信息"""
-        # 总对话数
-        total_query = select(func.count(Conversation.id)).where(
-            and_(
-                Conversation.user_id == user_id,
-                Conversation.status != ConversationStatus.DELETED
+        """删除对话（软删除对话及其所有消息，不加载消息对象）"""
+        # 通过CTE取得删除前的状态与计数，用于增量更新统计缓存
+        previous = (
+            select(
+                Conversation.id,
+                Conversation.status,
+                Conversation.message_count,
+                Conversation.total_tokens,
+                Conversation.total_cost
             )
-        )
-        total_result = await self.db.execute(total_query)
-        total_conversations = total_result.scalar() or 0
-        
-        # 活跃对话数
-        active_query = select(func.count(Conversation.id)).where(
-            and_(
-                Conversation.user_id == user_id,
-                Conversation.status == ConversationStatus.ACTIVE
+            .where(
+                and_(
+                    Conversation.id == conversation_id,
+                    Conversation.user_id == user_id
+                )
             )
+            .with_for_update()
+            .cte("previous")
         )
-        active_result = await self.db.execute(active_query)
-        active_conversations = active_result.scalar() or 0
-        
-        # 总消息数
-        messages_query = select(func.count(Message.id)).join(Conversation).where(
-            and_(
-                Conversation.user_id == user_id,
-                Message.is_deleted == False
+        result = await self.db.execute(
+            update(Conversation)
+            .where(Conversation.id == previous.c.id)
+            .values(status=ConversationStatus.DELETED)
+            .returning(
+                previous.c.status,
+                previous.c.message_count,
+                previous.c.total_tokens,
+                previous.c.total_cost
             )
+            .execution_options(synchronize_session=False)
         )
-        messages_result = await self.db.execute(messages_query)
-        total_messages = messages_result.scalar() or 0
-        
-        # 总token数和成本
-        tokens_cost_query = select(
-            func.sum(Conversation.total_tokens),
-            func.sum(Conversation.total_cost)
-        ).where(
-            and_(
-                Conversation.user_id == user_id,
-                Conversation.status != ConversationStatus.DELETED
+        row = result.first()
+        if row is None:
+            raise NotFoundError("对话不存在或无权访问")
+
+        await self.db.execute(
+            update(Message)
+            .where(
+                and_(
+                    Message.conversation_id == conversation_id,
+                    Message.is_deleted == False
+                )
             )
+            .values(is_deleted=True)
+            .execution_options(synchronize_session=False)
         )
-        tokens_cost_result = await self.db.execute(tokens_cost_query)
-        tokens_cost = tokens_cost_result.first()
-        
-        total_tokens = tokens_cost[0] or 0
-        total_cost = float(tokens_cost[1] or 0)
-        
+
+        await self.db.commit()
+
+        if row.status != ConversationStatus.DELETED:
+            await conversation_stats_cache.incr(
+                user_id,
+                total_conversations=-1,
+                active_conversations=-1 if row.status == ConversationStatus.ACTIVE else 0,
+                total_messages=-(row.message_count or 0),
+                total_tokens=-(row.total_tokens or 0),
+                total_cost=-float(row.total_cost or 0)
+            )
+
+        from agentpedia.services.context_service import context_builder
+        await context_builder.invalidate(conversation_id)
+        return True
+    
+    async def get_conversation_stats(self, user_id: int) -> Dict[str, Any]:
+        """获取用户的对话统计信息（优先读取缓存的计数器）"""
+        counters = await conversation_stats_cache.get(user_id)
+        if counters is None:
+            counters = await self._compute_conversation_stats(user_id)
+            await conversation_stats_cache.store(user_id, counters)
+
+        total_conversations = counters['total_conversations']
+        total_messages = counters['total_messages']
+
         # 平均每对话消息数
         avg_messages = total_messages / total_conversations if total_conversations > 0 else 0
-        
+
         return {
             'total_conversations': total_conversations,
-            'active_conversations': active_conversations,
+            'active_conversations': counters['active_conversations'],
             'total_messages': total_messages,
-            'total_tokens': total_tokens,
-            'total_cost': total_cost,
+            'total_tokens': counters['total_tokens'],
+            'total_cost': round(counters['total_cost'], 6),
             'average_messages_per_conversation': round(avg_messages, 2)
         }
 
+    async def _compute_conversation_stats(self, user_id: int) -> Dict[str, Any]:
+        """用一条聚合查询计算用户的对话计数"""
+        visible = Conversation.status != ConversationStatus.DELETED
+        # 消息数取对话上维护的 message_count：归档的消息已移出 messages 表，
+        # 按 messages 表计数会把归档对话漏掉
+        query = select(
+            func.count().filter(visible),
+            func.count().filter(Conversation.status == ConversationStatus.ACTIVE),
+            func.coalesce(func.sum(Conversation.message_count).filter(visible), 0),
+            func.coalesce(func.sum(Conversation.total_tokens).filter(visible), 0),
+            func.coalesce(func.sum(Conversation.total_cost).filter(visible), 0)
+        ).where(Conversation.user_id == user_id)
+
+        result = await self.db.execute(query)
+        total, active, messages, tokens, cost = result.one()
+
+        return {
+            'total_conversations': total,
+            'active_conversations': active,
+            'total_messages': int(messages),
+            'total_tokens': int(tokens),
+            'total_cost': float(cost)
+        }
+
 
 class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
     """消息服务类"""
@@ -216,12 +306,73 @@ class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
         
         # 更新对话的消息计数
         conversation.message_count += 1
+        user_id = conversation.user_id
+        counted = conversation.status != ConversationStatus.DELETED
         
         await self.db.commit()
         await self.db.refresh(message)
+        await self._invalidate_context(conversation_id)
+        if counted:
+            await conversation_stats_cache.incr(user_id, total_messages=1)
         
         return message
     
+    async def save_chat_exchange(
+        self,
+        conversation_id: int,
+        user_content: str,
+        assistant_content: str,
+        user_tokens: int,
+        assistant_tokens: int,
+        total_tokens: int,
+        cost: float,
+        processing_time: float
+    ) -> Message:
+        """
+        在一个事务中保存一轮对话（用户消息与助手回复）并更新对话统计
+
+        Args:
+            user_tokens: 用户消息本身的token数
+            assistant_tokens: 助手回复的token数
+            total_tokens: 本轮计费token数（含上下文）
+        """
+        conversation = await self.db.get(Conversation, conversation_id)
+        if not conversation:
+            raise NotFoundError("对话不存在")
+
+        user_message = Message(
+            conversation_id=conversation_id,
+            role=MessageRole.USER,
+            content=user_content,
+            type=MessageType.TEXT,
+            tokens_used=user_tokens
+        )
+        assistant_message = Message(
+            conversation_id=conversation_id,
+            role=MessageRole.ASSISTANT,
+            content=assistant_content,
+            type=MessageType.TEXT,
+            tokens_used=assistant_tokens,
+            cost=cost,
+            processing_time=processing_time
+        )
+        self.db.add_all([user_message, assistant_message])
+
+        conversation.message_count += 2
+        conversation.total_tokens += total_tokens
+        conversation.total_cost += cost
+        user_id = conversation.user_id
+        counted = conversation.status != ConversationStatus.DELETED
+
+        await self.db.commit()
+        await self.db.refresh(assistant_message)
+
+        if counted:
+            await conversation_stats_cache.incr(
+                user_id, total_messages=2, total_tokens=total_tokens, total_cost=cost
+            )
+        return assistant_message
+
     async def get_conversation_messages(
         self,
         conversation_id: int,
@@ -234,6 +385,8 @@ class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
         conversation = await self.db.get(Conversation, conversation_id)
         if not conversation or conversation.user_id != user_id:
             raise PermissionError("无权限访问此对话")
+
+        await message_archive_service.restore(conversation_id)
         
         query = select(Message).where(
             and_(
@@ -245,6 +398,182 @@ class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
         result = await self.db.execute(query)
         return list(result.scalars())
     
+    async def get_recent_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        before_id: Optional[int] = None
+    ) -> List[Message]:
+        """
+        按键集分页获取最新的若干条消息（不做权限检查，调用方负责）
+
+        从 before_id（不含）向前倒序取 limit 条，返回时按时间正序排列。
+        只读热表，不恢复归档；对话上下文构建在消息不足时自行恢复。
+        """
+        query = select(Message).where(
+            and_(
+                Message.conversation_id == conversation_id,
+                Message.is_deleted == False
+            )
+        )
+        if before_id is not None:
+            query = query.where(Message.id < before_id)
+
+        query = query.order_by(desc(Message.id)).limit(limit)
+
+        result = await self.db.execute(query)
+        messages = list(result.scalars())
+        messages.reverse()
+        return messages
+
+    async def search_messages(
+        self,
+        user_id: int,
+        query: str,
+        cursor: Optional[str] = None,
+        limit: int = 20
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        在用户的全部对话中搜索消息内容
+
+        每个关键词都以子串匹配（走 messages.content 的三元组GIN索引），
+        按与整个查询的三元组相似度排序，片段在数据库中截取，返回前转义并高亮。
+        只搜索热表中的消息，已归档的消息不在结果中。
+
+        Args:
+            user_id: 用户ID
+            query: 搜索关键词，空白分隔的多个词需同时命中
+            cursor: 上一页返回的游标
+            limit: 每页数量
+
+        Returns:
+            (结果列表, 下一页游标)
+
+        Raises:
+            ValidationError: 关键词为空或游标无效
+        """
+        terms = _search_terms(query)
+        if not terms:
+            raise ValidationError("搜索关键词不能为空")
+
+        content = Message.content
+        rank = cast(func.similarity(content, " ".join(terms)), Float)
+
+        # 片段以第一个关键词的首次出现位置为中心截取，转义与 <mark> 标记在返回前完成
+        start = func.greatest(func.strpos(func.lower(content), terms[0].lower()) - SNIPPET_LEAD, 1)
+        snippet = func.concat(
+            case((start > 1, "…"), else_=""),
+            func.substr(content, start, SNIPPET_LENGTH),
+            case((start + SNIPPET_LENGTH <= func.length(content), "…"), else_="")
+        )
+
+        statement = (
+            select(
+                Message.id.label("message_id"),
+                Message.conversation_id,
+                Conversation.title.label("conversation_title"),
+                Message.role,
+                snippet.label("snippet"),
+                rank.label("rank"),
+                Message.created_at
+            )
+            .join(Conversation, Conversation.id == Message.conversation_id)
+            .where(
+                Conversation.user_id == user_id,
+                Conversation.status != ConversationStatus.DELETED,
+                Message.is_deleted == False,
+                *[content.ilike(f"%{_escape_like(term)}%", escape="\\") for term in terms]
+            )
+        )
+
+        if cursor:
+            last_rank, last_id = _decode_search_cursor(cursor)
+            statement = statement.where(tuple_(rank, Message.id) < tuple_(last_rank, last_id))
+
+        statement = statement.order_by(rank.desc(), Message.id.desc()).limit(limit + 1)
+
+        result = await self.db.execute(statement)
+        rows = [dict(row._mapping) for row in result]
+        for row in rows:
+            row["snippet"] = highlight_snippet(row["snippet"], terms)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = CursorPage.encode_cursor({"rank": last["rank"], "id": last["message_id"]})
+        return rows, next_cursor
+
+    async def get_message_page(
+        self,
+        conversation_id: int,
+        limit: int,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[Message], Optional[str]]:
+        """
+        从最新消息向前分页（不做权限检查，调用方负责）
+
+        Returns:
+            (按时间正序的消息, 更早一页的游标；没有更早消息时为 None)
+
+        Raises:
+            ValidationError: 游标无效
+        """
+        before_id = None
+        if cursor:
+            try:
+                before_id = int(CursorPage.decode_cursor(cursor)["before"])
+            except (ValueError, KeyError, TypeError):
+                raise ValidationError("无效的分页游标")
+
+        # 查看历史消息时恢复已归档的消息
+        await message_archive_service.restore(conversation_id)
+
+        # 多取一条用于判断是否还有更早的消息
+        messages = await self.get_recent_messages(conversation_id, limit + 1, before_id)
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[1:]
+            next_cursor = CursorPage.encode_cursor({"before": messages[0].id})
+        return messages, next_cursor
+
+    async def iter_conversation_messages(
+        self,
+        conversation_id: int,
+        batch_size: int = 500
+    ) -> AsyncIterator[List[Message]]:
+        """
+        按时间正序分批遍历对话的全部消息（不做权限检查，调用方负责）
+
+        按 id 键集分批读取，每批交给调用方后即从会话中移除，
+        内存占用只与批大小有关，用于导出超长对话。
+        """
+        await message_archive_service.restore(conversation_id)
+
+        last_id = 0
+        while True:
+            result = await self.db.execute(
+                select(Message)
+                .where(
+                    and_(
+                        Message.conversation_id == conversation_id,
+                        Message.is_deleted == False,
+                        Message.id > last_id
+                    )
+                )
+                .order_by(Message.id)
+                .limit(batch_size)
+            )
+            batch = list(result.scalars())
+            if not batch:
+                return
+
+            last_id = batch[-1].id
+            yield batch
+            self.db.expunge_all()
+            if len(batch) < batch_size:
+                return
+
     async def update_message(self, message_id: int, message_data: MessageUpdate, user_id: int) -> Message:
         """更新消息"""
         # 获取消息和对话
@@ -267,6 +596,7 @@ class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
         
         await self.db.commit()
         await self.db.refresh(message)
+        await self._invalidate_context(message.conversation_id)
         
         return message
     
@@ -285,10 +615,22 @@ class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
         message.is_deleted = True
         
         # 更新对话的消息计数
-        conversation.message_count = max(0, conversation.message_count - 1)
+        removed = min(1, conversation.message_count)
+        conversation.message_count -= removed
         
+        conversation_id = conversation.id
+        counted = conversation.status != ConversationStatus.DELETED
         await self.db.commit()
+        await self._invalidate_context(conversation_id)
+        if counted:
+            await conversation_stats_cache.incr(user_id, total_messages=-removed)
         return True
+
+    async def _invalidate_context(self, conversation_id: int) -> None:
+        """使对话的缓存上下文窗口失效"""
+        from agentpedia.services.context_service import context_builder
+
+        await context_builder.invalidate(conversation_id)
     
     async def update_message_stats(
         self,
@@ -308,9 +650,14 @@ class MessageService(BaseService[Message, MessageCreate, MessageUpdate]):
         
         # 更新对话统计
         conversation = await self.db.get(Conversation, message.conversation_id)
+        user_id = None
         if conversation:
             conversation.total_tokens += tokens_used
             conversation.total_cost += cost
+            if conversation.status != ConversationStatus.DELETED:
+                user_id = conversation.user_id
         
         await self.db.commit()
+        if user_id is not None:
+            await conversation_stats_cache.incr(user_id, total_tokens=tokens_used, total_cost=cost)
         return True
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+大模型提供商抽象层
+
+按 Agent.model_provider 选择提供商，统一以增量流的形式返回生成内容。
+"""
+import abc
+import json
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.exceptions import ExternalServiceError
+from agentpedia.core.logging import get_logger
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+
+@dataclass
+class LLMDelta:
+    """生成内容增量"""
+
+    content: str = ""
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class LLMProviderError(ExternalServiceError):
+    """提供商调用失败"""
+
+    def __init__(self, message: str = "模型服务调用失败", code: str = "LLM_PROVIDER_ERROR"):
+        super().__init__(message, code)
+
+
+class LLMProvider(abc.ABC):
+    """大模型提供商基类"""
+
+    name: str = ""
+    # 每千token费用，用于估算成本
+    cost_per_1k_tokens: float = 0.0
+
+    @abc.abstractmethod
+    def stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[LLMDelta]:
+        """
+        流式生成回复
+
+        Args:
+            messages: [{"role": ..., "content": ...}]
+            model: 模型名称
+            temperature: 温度参数
+            max_tokens: 最大生成token数
+        """
+
+    def count_tokens(self, text: str) -> int:
+        """估算token数量（提供商未返回用量时使用）"""
+        if not text:
+            return 0
+        # 中文约一字一token，其余约四字符一token
+        cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def estimate_cost(self, tokens: int) -> float:
+        """估算成本"""
+        return round(tokens / 1000 * self.cost_per_1k_tokens, 6)
+
+
+class LocalProvider(LLMProvider):
+    """确定性的本地提供商（开发与测试用，不访问外部服务）"""
+
+    name = "local"
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[LLMDelta]:
+        last_user = next(
+            (m["content"] for m in reversed(messages) if m["role"] == "user"),
+            ""
+        )
+        reply = f"[{model}] 收到：{last_user}"
+
+        words = reply.split(" ")
+        if max_tokens:
+            words = words[:max_tokens]
+
+        for index, word in enumerate(words):
+            yield LLMDelta(content=word if index == 0 else f" {word}")
+
+        yield LLMDelta(
+            prompt_tokens=sum(self.count_tokens(m["content"]) for m in messages),
+            completion_tokens=len(words)
+        )
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI 兼容接口提供商"""
+
+    name = "openai"
+
+    def __init__(self, api_base: str, api_key: Optional[str], cost_per_1k_tokens: float = 0.0):
+        self.api_base = api_base.rstrip("/")
+        self.api_key = api_key
+        self.cost_per_1k_tokens = cost_per_1k_tokens
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.LLM_REQUEST_TIMEOUT, connect=10.0)
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None
+    ) -> AsyncIterator[LLMDelta]:
+        if not self.api_key:
+            raise LLMProviderError("未配置模型API密钥")
+
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+
+        async with self.client.stream(
+            "POST",
+            f"{self.api_base}/chat/completions",
+            json=payload,
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        ) as response:
+            if response.status_code != 200:
+                body = await response.aread()
+                raise LLMProviderError(
+                    f"模型服务返回错误 {response.status_code}: {body[:200].decode(errors='ignore')}"
+                )
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                for choice in chunk.get("choices") or []:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield LLMDelta(content=content)
+
+                usage = chunk.get("usage")
+                if usage:
+                    yield LLMDelta(
+                        prompt_tokens=usage.get("prompt_tokens"),
+                        completion_tokens=usage.get("completion_tokens")
+                    )
+
+
+class LLMProviderRegistry:
+    """提供商注册表"""
+
+    def __init__(self):
+        self._providers: Dict[str, LLMProvider] = {}
+
+    def register(self, provider: LLMProvider, *aliases: str) -> None:
+        """注册提供商"""
+        for name in (provider.name, *aliases):
+            self._providers[name.lower()] = provider
+
+    def get(self, provider_name: Optional[str]) -> LLMProvider:
+        """按名称获取提供商，未注册时使用默认提供商"""
+        if provider_name:
+            provider = self._providers.get(str(provider_name).lower())
+            if provider:
+                return provider
+        return self._providers[settings.LLM_DEFAULT_PROVIDER]
+
+    def for_agent(self, agent) -> LLMProvider:
+        """按 Agent.model_provider 获取提供商"""
+        provider = getattr(agent, "model_provider", None)
+        return self.get(getattr(provider, "value", provider))
+
+    async def close(self) -> None:
+        """关闭提供商持有的连接"""
+        for provider in set(self._providers.values()):
+            close = getattr(provider, "close", None)
+            if close:
+                await close()
+
+
+# 创建全局提供商注册表
+llm_registry = LLMProviderRegistry()
+llm_registry.register(LocalProvider(), "mock")
+llm_registry.register(
+    OpenAIProvider(
+        settings.OPENAI_API_BASE,
+        settings.OPENAI_API_KEY,
+        settings.OPENAI_COST_PER_1K_TOKENS
+    )
+)
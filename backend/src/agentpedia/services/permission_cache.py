@@ -0,0 +1,207 @@
+"""
+用户权限缓存
+
+用户的有效权限编译为位集：第 N 位对应 id 为 N 的权限（权限表即驻留的代码表），
+拥有通配角色的用户直接放行。位集按用户缓存在进程内 LRU 与 Redis 中，
+并记录编译时的全局权限版本号；角色、权限或角色分配变更时版本号加一，
+旧版本的缓存全部作废。各进程通过 pub/sub 得知新版本号，检查权限无需访问数据库。
+"""
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
+from agentpedia.core.pubsub import pubsub_hub
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+VERSION_KEY = "rbac:version"
+VERSION_CHANNEL = "rbac:version"
+
+
+@dataclass(slots=True)
+class PermissionSet:
+    """编译后的用户权限集"""
+
+    mask: int
+    wildcard: bool
+    version: int
+    # 最早的角色分配过期时间（Unix 时间戳），过期后需重新编译
+    expires_at: Optional[float] = None
+
+    def has_bit(self, bit: Optional[int]) -> bool:
+        """是否拥有指定位的权限（bit 为 None 表示权限不存在）"""
+        if self.wildcard:
+            return True
+        return bit is not None and (self.mask >> bit) & 1 == 1
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at <= time.time()
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {"m": format(self.mask, "x"), "w": self.wildcard, "v": self.version, "e": self.expires_at},
+            separators=(",", ":")
+        )
+
+    @classmethod
+    def from_json(cls, raw: str) -> "PermissionSet":
+        data = json.loads(raw)
+        return cls(int(data["m"], 16), data["w"], data["v"], data["e"])
+
+    @classmethod
+    def compile(
+        cls,
+        bits: Iterable[int],
+        wildcard: bool,
+        version: int,
+        expires_at: Optional[float] = None
+    ) -> "PermissionSet":
+        mask = 0
+        for bit in bits:
+            mask |= 1 << bit
+        return cls(mask, wildcard, version, expires_at)
+
+
+class PermissionCache:
+    """用户权限缓存"""
+
+    def __init__(self):
+        self._local: "OrderedDict[int, PermissionSet]" = OrderedDict()
+        self._version = 0
+        self._version_read_at = 0.0
+        # 权限代码 -> 位（权限 id），及其加载时的版本号
+        self._bits: Dict[str, int] = {}
+        self._bits_version: Optional[int] = None
+
+    @staticmethod
+    def redis_key(user_id: int) -> str:
+        return f"rbac:perms:{user_id}"
+
+    async def start(self) -> None:
+        """订阅版本号变更"""
+        await pubsub_hub.subscribe(VERSION_CHANNEL, self._on_version)
+        # 断线期间可能错过通知，重连后重新读取版本号
+        pubsub_hub.on_reconnect(self.refresh_version)
+
+    async def current_version(self) -> int:
+        """当前全局权限版本号（订阅可用时不访问 Redis）"""
+        if pubsub_hub.connected:
+            return self._version
+        if time.monotonic() - self._version_read_at >= settings.RBAC_VERSION_POLL_INTERVAL:
+            await self.refresh_version()
+        return self._version
+
+    async def refresh_version(self) -> None:
+        """从 Redis 读取版本号"""
+        if not redis_manager.redis_client:
+            return
+        try:
+            raw = await redis_manager.get_cached(VERSION_KEY)
+        except Exception as e:
+            logger.warning("Read RBAC version failed", error=str(e))
+            return
+        self._version_read_at = time.monotonic()
+        self._set_version(int(raw or 0))
+
+    async def bump_version(self) -> int:
+        """权限数据变更后调用（须在事务提交之后），使所有进程的缓存作废"""
+        client = redis_manager.redis_client
+        if not client:
+            # 没有 Redis 时只有本进程的缓存，直接清空
+            self._set_version(self._version + 1)
+            return self._version
+        try:
+            version = await client.incr(VERSION_KEY)
+            await pubsub_hub.publish(VERSION_CHANNEL, str(version))
+        except Exception as e:
+            logger.warning("Bump RBAC version failed", error=str(e))
+            self._local.clear()
+            return self._version
+        self._set_version(int(version))
+        return self._version
+
+    def _on_version(self, channel: str, data: str) -> None:
+        self._set_version(int(data))
+
+    def _set_version(self, version: int) -> None:
+        if version != self._version:
+            self._version = version
+            self._local.clear()
+
+    def bit(self, code: str) -> Optional[int]:
+        """权限代码对应的位"""
+        return self._bits.get(code)
+
+    def codes_loaded(self, version: int) -> bool:
+        return self._bits_version == version
+
+    def load_codes(self, bits: Dict[str, int], version: int) -> None:
+        self._bits = bits
+        self._bits_version = version
+
+    def decode(self, permission_set: PermissionSet) -> list:
+        """位集还原为权限代码列表"""
+        codes = [code for code, bit in self._bits.items() if permission_set.has_bit(bit)]
+        return ["*", *codes] if permission_set.wildcard else codes
+
+    async def get(self, user_id: int, version: int) -> Optional[PermissionSet]:
+        """查询缓存：先查进程内 LRU，再查 Redis"""
+        entry = self._local.get(user_id)
+        if entry is not None:
+            if entry.version == version and not entry.expired:
+                self._local.move_to_end(user_id)
+                return entry
+            del self._local[user_id]
+
+        client = redis_manager.redis_client
+        if not client:
+            return None
+        try:
+            raw = await client.get(self.redis_key(user_id))
+        except Exception as e:
+            logger.warning("Read permission cache failed", error=str(e), user_id=user_id)
+            return None
+        if raw is None:
+            return None
+
+        entry = PermissionSet.from_json(raw)
+        if entry.version != version or entry.expired:
+            return None
+        self._store_local(user_id, entry)
+        return entry
+
+    async def store(self, user_id: int, permission_set: PermissionSet) -> None:
+        """写入编译后的权限集"""
+        ttl = settings.RBAC_CACHE_TTL
+        if permission_set.expires_at is not None:
+            ttl = min(ttl, permission_set.expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        if permission_set.version == self._version:
+            self._store_local(user_id, permission_set)
+
+        client = redis_manager.redis_client
+        if not client:
+            return
+        try:
+            await client.set(self.redis_key(user_id), permission_set.to_json(), px=max(int(ttl * 1000), 1))
+        except Exception as e:
+            logger.warning("Write permission cache failed", error=str(e), user_id=user_id)
+
+    def _store_local(self, user_id: int, permission_set: PermissionSet) -> None:
+        self._local[user_id] = permission_set
+        self._local.move_to_end(user_id)
+        while len(self._local) > settings.RBAC_LOCAL_CACHE_SIZE:
+            self._local.popitem(last=False)
+
+
+# 创建全局用户权限缓存实例
+permission_cache = PermissionCache()
@@ -0,0 +1,220 @@
+"""
+配额（限流）引擎
+
+API密钥与Agent的每分钟、每小时、每天限额统一用 GCRA（通用信元速率算法）实现：
+每个限额只保存一个“理论到达时间”（TAT），请求在一次 Lua 脚本调用中
+同时检查全部限额，全部通过才一起扣减，任一超限则都不扣减。
+"""
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.exceptions import RateLimitError
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+# 限额窗口名称与时长（毫秒）
+WINDOWS = (
+    ("minute", 60 * 1000),
+    ("hour", 3600 * 1000),
+    ("day", 86400 * 1000),
+)
+
+# KEYS: 每个限额一个键
+# ARGV: cost, 之后每个限额依次为 limit, period_ms
+# 返回: allowed, 之后每个限额依次为 remaining, reset_after_ms, retry_after_ms
+GCRA_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+local cost = tonumber(ARGV[1])
+local allowed = 1
+local tats = {}
+local result = {0}
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 2])
+    local period = tonumber(ARGV[i * 2 + 1])
+    local interval = period / limit
+
+    local tat = now
+    local stored = redis.call('GET', key)
+    if stored then
+        tat = math.max(tonumber(stored), now)
+    end
+
+    local new_tat = tat + interval * cost
+    local diff = now - (new_tat - period)
+    local remaining, reset_after, retry_after
+    if diff < 0 then
+        allowed = 0
+        remaining = math.max(math.floor((now - (tat - period)) / interval), 0)
+        reset_after = tat - now
+        retry_after = -diff
+    else
+        remaining = math.floor(diff / interval)
+        reset_after = new_tat - now
+        retry_after = 0
+    end
+
+    tats[i] = new_tat
+    table.insert(result, remaining)
+    table.insert(result, math.ceil(reset_after))
+    table.insert(result, math.ceil(retry_after))
+end
+
+if allowed == 1 and cost > 0 then
+    for i, key in ipairs(KEYS) do
+        redis.call('SET', key, tostring(tats[i]), 'PX', math.max(math.ceil(tats[i] - now), 1))
+    end
+end
+
+result[1] = allowed
+return result
+"""
+
+
+@dataclass
+class QuotaLimit:
+    """单个限额"""
+
+    scope: str  # 例如 "key" 或 "agent"
+    window: str  # minute / hour / day
+    key: str
+    limit: int
+    period_ms: int
+
+
+@dataclass
+class QuotaState:
+    """单个限额的检查结果"""
+
+    limit: QuotaLimit
+    remaining: int
+    reset_after_ms: int
+    retry_after_ms: int
+
+
+@dataclass
+class QuotaDecision:
+    """一次配额检查的结果"""
+
+    allowed: bool
+    states: List[QuotaState]
+
+    @property
+    def binding(self) -> Optional[QuotaState]:
+        """决定响应头的限额：超限时取需要等待最久的，否则取剩余最少的"""
+        if not self.states:
+            return None
+        if not self.allowed:
+            return max(self.states, key=lambda s: s.retry_after_ms)
+        return min(self.states, key=lambda s: (s.remaining, -s.reset_after_ms))
+
+    def headers(self) -> Dict[str, str]:
+        """限流响应头"""
+        state = self.binding
+        if state is None:
+            return {}
+        headers = {
+            "X-RateLimit-Limit": str(state.limit.limit),
+            "X-RateLimit-Remaining": str(state.remaining),
+            "X-RateLimit-Reset": str(math.ceil(state.reset_after_ms / 1000)),
+            "X-RateLimit-Scope": f"{state.limit.scope}-{state.limit.window}",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(math.ceil(state.retry_after_ms / 1000), 1))
+        return headers
+
+
+class QuotaExceededError(RateLimitError):
+    """超出配额"""
+
+    def __init__(self, decision: QuotaDecision, message: str = "请求过于频繁，请稍后再试"):
+        super().__init__(message, "QUOTA_EXCEEDED")
+        self.decision = decision
+
+
+def build_limits(
+    scope: str,
+    identifier,
+    per_minute: Optional[int],
+    per_hour: Optional[int],
+    per_day: Optional[int]
+) -> List[QuotaLimit]:
+    """根据每分钟/每小时/每天的限额构造限额列表（未设置的窗口忽略）"""
+    limits = []
+    for (window, period_ms), value in zip(WINDOWS, (per_minute, per_hour, per_day)):
+        if value:
+            limits.append(QuotaLimit(scope, window, f"quota:{scope}:{identifier}:{window}", int(value), period_ms))
+    return limits
+
+
+class QuotaEngine:
+    """基于 Redis 的配额引擎"""
+
+    def __init__(self):
+        self._script = redis_manager.register_script(GCRA_SCRIPT)
+
+    async def check(self, limits: List[QuotaLimit], cost: int = 1) -> Optional[QuotaDecision]:
+        """
+        检查并扣减配额（一次往返）
+
+        Args:
+            limits: 需要同时满足的限额
+            cost: 本次请求消耗的配额，0 表示只查询不扣减
+
+        Returns:
+            检查结果；未启用或 Redis 不可用时返回 None（放行）
+        """
+        client = redis_manager.redis_client
+        if not settings.QUOTA_ENABLED or not client or not limits:
+            return None
+
+        args = [cost]
+        for limit in limits:
+            args.extend([limit.limit, limit.period_ms])
+
+        try:
+            raw = await self._script(keys=[limit.key for limit in limits], args=args)
+        except Exception as e:
+            # 限流不能成为单点故障，Redis 异常时放行
+            logger.warning("Quota check failed", error=str(e))
+            return None
+
+        states = [
+            QuotaState(limit, int(raw[1 + i * 3]), int(raw[2 + i * 3]), int(raw[3 + i * 3]))
+            for i, limit in enumerate(limits)
+        ]
+        return QuotaDecision(allowed=bool(int(raw[0])), states=states)
+
+    async def enforce(self, limits: List[QuotaLimit], cost: int = 1) -> Optional[QuotaDecision]:
+        """
+        检查并扣减配额
+
+        Raises:
+            QuotaExceededError: 任一限额超限
+        """
+        decision = await self.check(limits, cost)
+        if decision is not None and not decision.allowed:
+            state = decision.binding
+            logger.info(
+                "Quota exceeded",
+                scope=state.limit.scope,
+                window=state.limit.window,
+                key=state.limit.key,
+                retry_after_ms=state.retry_after_ms
+            )
+            raise QuotaExceededError(decision)
+        return decision
+
+    async def peek(self, limits: List[QuotaLimit]) -> Optional[QuotaDecision]:
+        """查询剩余配额而不扣减"""
+        return await self.check(limits, cost=0)
+
+
+# 创建全局配额引擎实例
+quota_engine = QuotaEngine()
@@ -1,11 +1,16 @@
 """
 基于角色的访问控制(RBAC)服务
+
+权限检查使用编译后的用户权限位集（见 permission_cache），
+角色、权限、角色分配变更后递增全局权限版本号使缓存作废。
 """
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
 import logging
+import time
 
-from sqlalchemy import select, and_, or_
+from sqlalchemy import DateTime, Integer, String, select, update, and_, or_, cast, column, null, union_all, values
+from sqlalchemy.dialects.postgresql import Insert, insert as pg_insert
 from sqlalchemy.orm import selectinload
 
 from agentpedia.core.database import AsyncSessionLocal
@@ -13,10 +18,14 @@ from agentpedia.models.permission import (
     Role, Permission, UserRoleAssignment, PermissionResource, PermissionAction
 )
 from agentpedia.models.user import User
+from agentpedia.services.permission_cache import PermissionSet, permission_cache
 from agentpedia.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# 通配权限：拥有该权限代码的角色放行所有权限检查
+WILDCARD_PERMISSION = "*"
+
 
 class RBACService:
     """RBAC服务类"""
@@ -66,6 +75,10 @@ class RBACService:
                 "agent.read", "conversation.read", "usage_log.read"
             ]
         }
+        # 通配权限不对应权限表中的行，按角色代码识别
+        self._wildcard_roles = frozenset(
+            code for code, perms in self._default_permissions.items() if WILDCARD_PERMISSION in perms
+        )
 
     async def create_permission(
         self,
@@ -100,6 +113,7 @@ class RBACService:
             await session.commit()
             await session.refresh(permission)
 
+            await permission_cache.bump_version()
             logger.info(f"Created permission: {code}")
             return permission
 
@@ -140,16 +154,15 @@ class RBACService:
             session.add(role)
             await session.flush()  # 获取角色ID
 
-            # 添加权限
-            if permission_codes:
-                for perm_code in permission_codes:
-                    permission = await self.get_permission_by_code(perm_code)
-                    if permission:
-                        role.permissions.append(permission)
+            # 添加权限（一条 INSERT ... SELECT）
+            link = self._link_permissions_stmt({role.id: permission_codes or []})
+            if link is not None:
+                await session.execute(link)
 
             await session.commit()
             await session.refresh(role)
 
+            await permission_cache.bump_version()
             logger.info(f"Created role: {code}")
             return role
 
@@ -212,6 +225,7 @@ class RBACService:
             await session.commit()
             await session.refresh(assignment)
 
+            await permission_cache.bump_version()
             logger.info(f"Assigned role {role_code} to user {user_id}")
             return assignment
 
@@ -244,36 +258,95 @@ class RBACService:
             assignment.is_active = False
             await session.commit()
 
+            await permission_cache.bump_version()
             logger.info(f"Revoked role {role_code} from user {user_id}")
             return True
 
-    async def get_user_permissions(self, user_id: int) -> List[str]:
-        """获取用户所有权限"""
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(
-                select(UserRoleAssignment)
-                .options(selectinload(UserRoleAssignment.role).selectinload(Role.permissions))
-                .where(
-                    and_(
-                        UserRoleAssignment.user_id == user_id,
-                        UserRoleAssignment.is_active == True,
-                        or_(
-                            UserRoleAssignment.expires_at.is_(None),
-                            UserRoleAssignment.expires_at > datetime.utcnow()
-                        )
+    async def get_permission_set(self, user_id: int) -> PermissionSet:
+        """
+        获取用户编译后的权限集（优先读缓存）
+
+        权限集包含用户自身角色（users.role）与全部有效角色分配的权限，
+        所有调用方得到同一份结果，可以安全地共用缓存。
+        """
+        # 先读版本号再查库：查询期间发生的变更会使本次结果的版本号过时而不是被掩盖
+        version = await permission_cache.current_version()
+        permission_set = await permission_cache.get(user_id, version)
+        if permission_set is not None:
+            return permission_set
+
+        permission_set = await self._compile_permission_set(user_id, version)
+        await permission_cache.store(user_id, permission_set)
+        return permission_set
+
+    async def _compile_permission_set(self, user_id: int, version: int) -> PermissionSet:
+        """读取用户自身角色后，一次查询取出所有有效角色的权限并编译为位集"""
+        now = datetime.utcnow()
+        stmt = (
+            select(Role.code, Permission.id, UserRoleAssignment.expires_at)
+            .select_from(UserRoleAssignment)
+            .join(Role, Role.id == UserRoleAssignment.role_id)
+            .outerjoin(Role.permissions)
+            .where(
+                and_(
+                    UserRoleAssignment.user_id == user_id,
+                    UserRoleAssignment.is_active == True,
+                    Role.is_active == True,
+                    or_(
+                        UserRoleAssignment.expires_at.is_(None),
+                        UserRoleAssignment.expires_at > now
                     )
                 )
             )
-            assignments = result.scalars().all()
+        )
+
+        async with AsyncSessionLocal() as session:
+            base_role = await session.scalar(select(User.role).where(User.id == user_id))
+            base_role = getattr(base_role, "value", base_role)
+            if base_role:
+                stmt = union_all(
+                    stmt,
+                    select(Role.code, Permission.id, cast(null(), DateTime).label("expires_at"))
+                    .select_from(Role)
+                    .outerjoin(Role.permissions)
+                    .where(and_(Role.code == base_role, Role.is_active == True))
+                )
 
-            permissions = []
-            for assignment in assignments:
-                if assignment.role.is_active:
-                    for permission in assignment.role.permissions:
-                        if permission.code not in permissions:
-                            permissions.append(permission.code)
+            result = await session.execute(stmt)
+            rows = result.all()
+
+        bits = set()
+        wildcard = False
+        earliest_expiry = None
+        for role_code, permission_id, expires_at in rows:
+            if permission_id is not None:
+                bits.add(permission_id)
+            if role_code in self._wildcard_roles:
+                wildcard = True
+            if expires_at is not None and (earliest_expiry is None or expires_at < earliest_expiry):
+                earliest_expiry = expires_at
+
+        # 角色分配过期时需要重新编译
+        expires_at = (
+            time.time() + (earliest_expiry - now).total_seconds()
+            if earliest_expiry is not None else None
+        )
+        return PermissionSet.compile(bits, wildcard, version, expires_at)
+
+    async def get_permission_bit(self, code: str) -> Optional[int]:
+        """权限代码对应的位（代码表按权限版本号加载，版本不变时不访问数据库）"""
+        version = await permission_cache.current_version()
+        if not permission_cache.codes_loaded(version):
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(Permission.code, Permission.id))
+                permission_cache.load_codes(dict(result.all()), version)
+        return permission_cache.bit(code)
 
-            return permissions
+    async def get_user_permissions(self, user_id: int) -> List[str]:
+        """获取用户所有权限"""
+        permission_set = await self.get_permission_set(user_id)
+        await self.get_permission_bit(WILDCARD_PERMISSION)  # 确保代码表已加载
+        return permission_cache.decode(permission_set)
 
     async def check_user_permission(
         self,
@@ -282,33 +355,76 @@ class RBACService:
         action: PermissionAction
     ) -> bool:
         """检查用户权限"""
-        permissions = await self.get_user_permissions(user_id)
-        permission_code = Permission.generate_code(resource, action)
-        return permission_code in permissions or "*" in permissions
+        permission_set = await self.get_permission_set(user_id)
+        if permission_set.wildcard:
+            return True
+        bit = await self.get_permission_bit(Permission.generate_code(resource, action))
+        return permission_set.has_bit(bit)
+
+    @staticmethod
+    def _link_permissions_stmt(role_permissions: Dict[int, List[str]]) -> Optional[Insert]:
+        """
+        为角色批量关联权限的语句：INSERT INTO 角色权限关联表 ... SELECT ... ON CONFLICT DO NOTHING
+
+        Args:
+            role_permissions: 角色ID -> 权限代码列表（不存在的代码忽略）
+
+        Returns:
+            没有需要关联的权限时返回 None
+        """
+        data = [
+            (role_id, code)
+            for role_id, codes in role_permissions.items()
+            for code in codes
+            if code != WILDCARD_PERMISSION
+        ]
+        if not data:
+            return None
+
+        relation = Role.permissions.property
+        role_column = relation.synchronize_pairs[0][1]
+        permission_column = relation.secondary_synchronize_pairs[0][1]
+
+        pairs = values(
+            column("role_id", Integer),
+            column("code", String),
+            name="pairs"
+        ).data(data)
+
+        return (
+            pg_insert(relation.secondary)
+            .from_select(
+                [role_column.name, permission_column.name],
+                select(pairs.c.role_id, Permission.id).join(pairs, Permission.code == pairs.c.code)
+            )
+            .on_conflict_do_nothing()
+        )
 
     async def initialize_default_permissions(self):
-        """初始化默认权限"""
-        logger.info("Initializing default permissions")
-
-        # 为所有资源和动作组合创建权限
-        resources = list(PermissionResource)
-        actions = list(PermissionAction)
-
-        for resource in resources:
-            for action in actions:
-                code = Permission.generate_code(resource, action)
-                name = f"{resource.value} {action.value}"
-                description = f"权限：{resource.value} {action.value}"
-
-                await self.create_permission(
-                    name=name,
-                    resource=resource,
-                    action=action,
-                    description=description,
-                    is_system=True
-                )
+        """初始化默认权限（所有资源和动作组合，一条多行 INSERT）"""
+        rows = [
+            {
+                "name": f"{resource.value} {action.value}",
+                "code": Permission.generate_code(resource, action),
+                "resource": resource.value,
+                "action": action.value,
+                "description": f"权限：{resource.value} {action.value}",
+                "is_system": True
+            }
+            for resource in PermissionResource
+            for action in PermissionAction
+        ]
+
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                pg_insert(Permission).values(rows).on_conflict_do_nothing().returning(Permission.id)
+            )
+            created = len(result.all())
+            await session.commit()
 
-        logger.info("Default permissions initialized")
+        if created:
+            await permission_cache.bump_version()
+        logger.info("Default permissions initialized", created=created, total=len(rows))
 
     async def initialize_default_roles(self):
         """初始化默认角色"""
@@ -373,40 +489,47 @@ class RBACService:
             }
         }
 
-        for role_code, config in role_configs.items():
-            await self.create_role(
-                name=role_code,
-                code=role_code,
-                display_name=config["display_name"],
-                description=config["description"],
-                level=config["level"],
-                is_system=True,
-                max_api_keys=config["max_api_keys"],
-                max_agents=config["max_agents"],
-                permission_codes=self._default_permissions.get(role_code, [])
+        rows = [
+            {"name": role_code, "code": role_code, "is_system": True, **config}
+            for role_code, config in role_configs.items()
+        ]
+
+        async with AsyncSessionLocal() as session:
+            # 已存在的角色保持原样，只为本次新建的角色关联默认权限
+            result = await session.execute(
+                pg_insert(Role).values(rows).on_conflict_do_nothing().returning(Role.id, Role.code)
             )
+            created = {role_id: self._default_permissions.get(code, []) for role_id, code in result.all()}
+            link = self._link_permissions_stmt(created)
+            if link is not None:
+                await session.execute(link)
+            await session.commit()
 
-        logger.info("Default roles initialized")
+        if created:
+            await permission_cache.bump_version()
+        logger.info("Default roles initialized", created=len(created), total=len(rows))
 
-    async def cleanup_expired_assignments(self):
-        """清理过期的角色分配"""
+    async def cleanup_expired_assignments(self) -> int:
+        """停用过期的角色分配（一条 UPDATE，由后台任务定期执行）"""
         async with AsyncSessionLocal() as session:
             result = await session.execute(
-                select(UserRoleAssignment).where(
+                update(UserRoleAssignment)
+                .where(
                     and_(
                         UserRoleAssignment.is_active == True,
+                        # expires_at 存储不带时区的 UTC 时间，与编译权限时的判断保持一致
                         UserRoleAssignment.expires_at < datetime.utcnow()
                     )
                 )
+                .values(is_active=False)
+                .execution_options(synchronize_session=False)
             )
-            expired = result.scalars().all()
-
-            for assignment in expired:
-                assignment.is_active = False
+            await session.commit()
 
-            if expired:
-                await session.commit()
-                logger.info(f"Cleaned up {len(expired)} expired role assignments")
+        # 编译后的权限集按最早的分配过期时间失效，这里无需递增权限版本号
+        if result.rowcount:
+            logger.info("Cleaned up expired role assignments", count=result.rowcount)
+        return result.rowcount
 
 
 # 创建全局RBAC服务实例
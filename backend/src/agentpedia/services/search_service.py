@@ -8,6 +8,7 @@ from enum import Enum
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_
 from agentpedia.core.elasticsearch import elasticsearch_manager
+from agentpedia.core.redis import cache_result
 from agentpedia.services.mongodb_agent_service import mongodb_agent_service
 from agentpedia.models.mongodb_models import AgentStatus, AgentModel
 from agentpedia.schemas.agent_prd import AgentFilterParams, AgentSearchQuery
@@ -416,12 +417,13 @@ class SearchService:
             logger.error(f"Failed to reindex agents: {e}")
             return 0
 
+    @cache_result(expire=60, key_prefix="search:popular")
     async def get_popular_agents(
         self,
         limit: int = 10,
         time_range: Optional[int] = None  # days
     ) -> List[Dict[str, Any]]:
-        """获取热门Agent"""
+        """获取热门Agent（结果按参数缓存 60 秒，键前缀 cache:search:popular）"""
         if self.elasticsearch_available:
             # 使用Elasticsearch聚合获取热门Agent
             try:
@@ -460,7 +462,8 @@ class SearchService:
                 sort_by=[("metrics.popularity_score", -1)],
                 size=limit
             )
-            return [agent.dict() for agent in agents]
+            # 缓存条目以 JSON 存储
+            return [agent.model_dump(mode="json") for agent in agents]
 
         except Exception as e:
             logger.error(f"Failed to get popular agents from MongoDB: {e}")
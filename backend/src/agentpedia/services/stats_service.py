@@ -0,0 +1,134 @@
+"""
+用户统计计数器缓存
+
+统计接口首次读取时用一条聚合查询算出结果写入 Redis 哈希，
+此后创建、删除、消息等事件只对已存在的哈希做增量更新，
+统计接口直接读取缓存值。哈希带TTL，到期后重新从数据库校准。
+"""
+from typing import Dict, Optional, Union
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+Number = Union[int, float]
+
+# 仅当哈希存在时累加，避免缓存缺失时写出不完整的计数
+INCREMENT_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBYFLOAT', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+return 1
+"""
+
+
+class UserStatsCache:
+    """按用户缓存的统计计数器"""
+
+    def __init__(self, namespace: str, fields: Dict[str, type]):
+        """
+        Args:
+            namespace: 缓存键前缀
+            fields: 计数字段及其类型（int 或 float）
+        """
+        self.namespace = namespace
+        self.fields = fields
+        self._script = redis_manager.register_script(INCREMENT_IF_EXISTS)
+
+    def key(self, user_id: int) -> str:
+        """用户计数器缓存键"""
+        return f"stats:{self.namespace}:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[Dict[str, Number]]:
+        """读取缓存的计数，缺失或不完整时返回 None"""
+        client = redis_manager.redis_client
+        if not client:
+            return None
+
+        try:
+            raw = await client.hgetall(self.key(user_id))
+        except Exception as e:
+            logger.warning("Read stats cache failed", namespace=self.namespace, error=str(e))
+            return None
+
+        if not raw or any(name not in raw for name in self.fields):
+            return None
+
+        values = {}
+        for name, kind in self.fields.items():
+            value = float(raw[name])
+            values[name] = int(round(value)) if kind is int else value
+        # 非计数字段（例如下次到期时间）原样返回
+        for name, value in raw.items():
+            values.setdefault(name, value)
+        return values
+
+    async def store(self, user_id: int, values: Dict[str, object]) -> None:
+        """写入完整的计数（覆盖旧值并重置TTL）"""
+        client = redis_manager.redis_client
+        if not client:
+            return
+
+        key = self.key(user_id)
+        mapping = {name: "" if value is None else str(value) for name, value in values.items()}
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, settings.STATS_CACHE_TTL)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("Write stats cache failed", namespace=self.namespace, error=str(e))
+
+    async def incr(self, user_id: int, **deltas: Number) -> None:
+        """对已缓存的计数做增量更新，缓存不存在时不做任何事"""
+        client = redis_manager.redis_client
+        args = []
+        for name, delta in deltas.items():
+            if delta:
+                args.extend([name, delta])
+        if not client or not args:
+            return
+
+        try:
+            await self._script(keys=[self.key(user_id)], args=args)
+        except Exception as e:
+            # 增量失败时丢弃缓存，下次读取重新计算
+            logger.warning("Increment stats cache failed", namespace=self.namespace, error=str(e))
+            await self.invalidate(user_id)
+
+    async def invalidate(self, user_id: int) -> None:
+        """丢弃用户的缓存计数"""
+        try:
+            await redis_manager.delete(self.key(user_id))
+        except Exception as e:
+            logger.warning("Invalidate stats cache failed", namespace=self.namespace, error=str(e))
+
+
+# 创建全局统计缓存实例
+conversation_stats_cache = UserStatsCache(
+    "conversations",
+    {
+        "total_conversations": int,
+        "active_conversations": int,
+        "total_messages": int,
+        "total_tokens": int,
+        "total_cost": float,
+    }
+)
+api_key_stats_cache = UserStatsCache(
+    "api_keys",
+    {
+        "total_keys": int,
+        "active_keys": int,
+        "expired_keys": int,
+        "revoked_keys": int,
+        "total_usage": int,
+    }
+)
@@ -0,0 +1,504 @@
+"""
+使用统计写回服务
+
+聊天请求与API密钥请求只累加增量（Redis 哈希，Redis 不可用时退回进程内），
+后台任务按间隔把所有 Agent / API密钥的增量各合并为一条 UPDATE 写回数据库。
+API密钥另按小时记录调用次数，用于查询使用量时间序列。
+
+Redis 中的增量以快照为单位写库，每个快照带唯一ID并在写库的同一事务中登记，
+重放同一快照（删除前进程退出、锁过期后被另一个 worker 接手）不会重复累加。
+"""
+import asyncio
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Float, Integer, String, cast, column, func, text, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.database import AsyncSessionLocal
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import CACHE_RELEASE_LOCK_SCRIPT, redis_manager
+from agentpedia.models.agent import Agent
+from agentpedia.models.api_key import APIKey
+from agentpedia.services.stats_service import api_key_stats_cache
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+# 增量字段 -> 类型
+DELTA_FIELDS = (
+    ("calls", int),
+    ("tokens", int),
+    ("cost", float),
+    ("processing_time", float),
+)
+
+# 小时序列字段格式
+HOUR_FORMAT = "%Y%m%d%H"
+
+# 快照哈希中保存快照ID的字段（增量字段均为 "<id>:<name>"，不会冲突）
+SNAPSHOT_ID_FIELD = "_snapshot_id"
+
+# 上次写库失败（或进程崩溃）留下的快照优先处理，否则原子地把当前增量改名为快照；
+# 快照缺少ID时补上
+TAKE_SNAPSHOT_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 0
+    end
+    redis.call('RENAME', KEYS[1], KEYS[2])
+end
+redis.call('HSETNX', KEYS[2], ARGV[1], ARGV[2])
+return 1
+"""
+
+# 只删除仍是同一个快照的 flushing 键，避免误删其他 worker 随后截取的快照
+DELETE_SNAPSHOT_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_take_snapshot_script = redis_manager.register_script(TAKE_SNAPSHOT_SCRIPT)
+_delete_snapshot_script = redis_manager.register_script(DELETE_SNAPSHOT_SCRIPT)
+_release_lock_script = redis_manager.register_script(CACHE_RELEASE_LOCK_SCRIPT)
+
+
+async def _flush_snapshot(
+    client,
+    pending_key: str,
+    flushing_key: str,
+    lock_key: str,
+    lock_ttl: int,
+    handle: Callable[[Dict[str, str], str], Awaitable[int]]
+) -> int:
+    """
+    截取 Redis 中累加的增量快照并交给 handle 写库，成功后删除快照
+
+    handle 接收快照内容与快照ID，需在写库的同一事务中调用 _claim_snapshot。
+    """
+    # 多个 worker 同时刷新时只允许一个处理 flushing 快照；锁只由持有者释放
+    token = uuid.uuid4().hex
+    if not await client.set(lock_key, token, nx=True, ex=lock_ttl):
+        return 0
+
+    try:
+        taken = await redis_manager.run_script(
+            _take_snapshot_script,
+            keys=[pending_key, flushing_key],
+            args=[SNAPSHOT_ID_FIELD, uuid.uuid4().hex]
+        )
+        if not taken:
+            return 0
+
+        raw = await client.hgetall(flushing_key)
+        snapshot_id = raw.pop(SNAPSHOT_ID_FIELD, None)
+        if snapshot_id is None:
+            return 0
+
+        updated = await handle(raw, snapshot_id)
+        await redis_manager.run_script(
+            _delete_snapshot_script,
+            keys=[flushing_key],
+            args=[SNAPSHOT_ID_FIELD, snapshot_id]
+        )
+        return updated
+    finally:
+        await redis_manager.run_script(_release_lock_script, keys=[lock_key], args=[token])
+
+
+async def _claim_snapshot(session: AsyncSession, name: str, snapshot_id: str) -> bool:
+    """
+    在写库事务中登记已应用的快照ID
+
+    每个缓冲同一时间只有一个快照，只需记住最后一个；并发的重放会在行锁上等待，
+    先提交者生效，后者看到相同ID。
+
+    Returns:
+        False 表示该快照已经写过库，本次应跳过
+    """
+    result = await session.execute(
+        text(
+            "INSERT INTO usage_flush_marks (name, snapshot_id, applied_at) "
+            "VALUES (:name, :snapshot_id, timezone('utc', now())) "
+            "ON CONFLICT (name) DO UPDATE "
+            "SET snapshot_id = EXCLUDED.snapshot_id, applied_at = EXCLUDED.applied_at "
+            "WHERE usage_flush_marks.snapshot_id <> EXCLUDED.snapshot_id "
+            "RETURNING name"
+        ),
+        {"name": name, "snapshot_id": snapshot_id}
+    )
+    return result.first() is not None
+
+
+class AgentUsageBuffer:
+    """Agent使用统计写回缓冲"""
+
+    PENDING_KEY = "agent_usage:pending"
+    FLUSHING_KEY = "agent_usage:flushing"
+    LOCK_KEY = "agent_usage:flush_lock"
+
+    def __init__(self):
+        self._local: Dict[int, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._local_lock = asyncio.Lock()
+
+    async def record(
+        self,
+        agent_id: int,
+        tokens_used: int,
+        cost: float,
+        processing_time: float
+    ) -> None:
+        """累加一次调用的增量（一次 Redis 往返）"""
+        client = redis_manager.redis_client
+        if client:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hincrby(self.PENDING_KEY, f"{agent_id}:calls", 1)
+                pipe.hincrby(self.PENDING_KEY, f"{agent_id}:tokens", tokens_used)
+                pipe.hincrbyfloat(self.PENDING_KEY, f"{agent_id}:cost", cost)
+                pipe.hincrbyfloat(self.PENDING_KEY, f"{agent_id}:processing_time", processing_time)
+                await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning("Buffer agent usage in Redis failed", error=str(e), agent_id=agent_id)
+
+        deltas = self._local[agent_id]
+        deltas["calls"] += 1
+        deltas["tokens"] += tokens_used
+        deltas["cost"] += cost
+        deltas["processing_time"] += processing_time
+
+    async def flush(self) -> int:
+        """
+        将缓冲的增量写回数据库
+
+        Returns:
+            更新的 Agent 数量
+        """
+        updated = await self._flush_local()
+
+        client = redis_manager.redis_client
+        if client:
+            updated += await self._flush_redis(client)
+
+        return updated
+
+    async def _flush_local(self) -> int:
+        async with self._local_lock:
+            if not self._local:
+                return 0
+            pending, self._local = self._local, defaultdict(lambda: defaultdict(float))
+
+        rows = [
+            {"agent_id": agent_id, **{name: convert(d[name]) for name, convert in DELTA_FIELDS}}
+            for agent_id, d in pending.items()
+        ]
+        try:
+            return await self._apply(rows)
+        except Exception:
+            # 写库失败时把增量合并回去，等待下一轮
+            async with self._local_lock:
+                for agent_id, d in pending.items():
+                    for name, value in d.items():
+                        self._local[agent_id][name] += value
+            raise
+
+    async def _flush_redis(self, client) -> int:
+        async def handle(raw: Dict[str, str], snapshot_id: str) -> int:
+            rows = self._parse_snapshot(raw)
+            return await self._apply(rows, snapshot_id) if rows else 0
+
+        return await _flush_snapshot(
+            client,
+            self.PENDING_KEY,
+            self.FLUSHING_KEY,
+            self.LOCK_KEY,
+            settings.AGENT_USAGE_FLUSH_INTERVAL * 6,
+            handle
+        )
+
+    def _parse_snapshot(self, raw: Dict[str, str]) -> List[dict]:
+        casts = dict(DELTA_FIELDS)
+        agents: Dict[int, dict] = {}
+        for key, value in raw.items():
+            agent_id, _, name = key.partition(":")
+            if name not in casts:
+                continue
+            row = agents.setdefault(
+                int(agent_id),
+                {"agent_id": int(agent_id), **{n: c() for n, c in DELTA_FIELDS}}
+            )
+            row[name] = casts[name](float(value))
+        return list(agents.values())
+
+    async def _apply(self, rows: List[dict], snapshot_id: Optional[str] = None) -> int:
+        """以一条 UPDATE ... FROM (VALUES ...) 写回所有 Agent 的增量"""
+        deltas = values(
+            column("agent_id", Integer),
+            column("calls", Integer),
+            column("tokens", Integer),
+            column("cost", Float),
+            column("processing_time", Float),
+            name="deltas"
+        ).data([
+            (row["agent_id"], row["calls"], row["tokens"], row["cost"], row["processing_time"])
+            for row in rows
+        ])
+
+        # 浮点参数在 VALUES 中没有类型推断，显式转换
+        cost = cast(deltas.c.cost, Float)
+        processing_time = cast(deltas.c.processing_time, Float)
+
+        stmt = (
+            update(Agent)
+            .where(Agent.id == deltas.c.agent_id)
+            .values(
+                usage_count=Agent.usage_count + deltas.c.calls,
+                total_tokens_used=Agent.total_tokens_used + deltas.c.tokens,
+                total_cost=Agent.total_cost + cost,
+                average_processing_time=(
+                    Agent.average_processing_time * Agent.usage_count + processing_time
+                ) / (Agent.usage_count + deltas.c.calls),
+                last_used_at=datetime.utcnow()
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+        async with AsyncSessionLocal() as session:
+            if snapshot_id is not None and not await _claim_snapshot(session, self.FLUSHING_KEY, snapshot_id):
+                logger.warning("Agent usage snapshot already applied", snapshot_id=snapshot_id)
+                return 0
+            result = await session.execute(stmt)
+            await session.commit()
+
+        logger.info("Agent usage stats flushed", agents=len(rows), updated=result.rowcount)
+        return result.rowcount
+
+
+class APIKeyUsageBuffer:
+    """API密钥使用统计写回缓冲"""
+
+    PENDING_KEY = "apikey_usage:pending"
+    FLUSHING_KEY = "apikey_usage:flushing"
+    LOCK_KEY = "apikey_usage:flush_lock"
+
+    def __init__(self):
+        # key_id -> {"calls": 次数, "last_used_at": 时间, "last_used_ip": IP}
+        self._local: Dict[int, dict] = {}
+        self._local_lock = asyncio.Lock()
+
+    @staticmethod
+    def hourly_key(key_id: int, day: datetime) -> str:
+        """按天分片的小时计数哈希（字段为 YYYYMMDDHH），随天过期"""
+        return f"apikey_usage:{key_id}:{day:%Y%m%d}"
+
+    async def record(self, key_id: int, ip_address: Optional[str]) -> None:
+        """记录一次密钥调用（一次 Redis 往返）"""
+        now = datetime.utcnow()
+        client = redis_manager.redis_client
+        if client:
+            try:
+                hourly_key = self.hourly_key(key_id, now)
+                pipe = client.pipeline(transaction=False)
+                pipe.hincrby(self.PENDING_KEY, f"{key_id}:calls", 1)
+                pipe.hset(self.PENDING_KEY, mapping={
+                    f"{key_id}:last_used_at": now.isoformat(),
+                    f"{key_id}:last_used_ip": ip_address or "",
+                })
+                pipe.hincrby(hourly_key, now.strftime(HOUR_FORMAT), 1)
+                pipe.expire(hourly_key, (settings.API_KEY_USAGE_RETENTION_DAYS + 1) * 86400)
+                await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning("Buffer API key usage in Redis failed", error=str(e), key_id=key_id)
+
+        # Redis 不可用时只保留总次数与最后使用信息，小时序列缺失
+        entry = self._local.setdefault(key_id, {"calls": 0})
+        entry["calls"] += 1
+        entry["last_used_at"] = now
+        entry["last_used_ip"] = ip_address
+
+    async def pending(self, key_id: int) -> Tuple[int, Optional[datetime]]:
+        """尚未写回数据库的调用次数与最后使用时间"""
+        calls, last_used_at = 0, None
+        local = self._local.get(key_id)
+        if local:
+            calls, last_used_at = local["calls"], local["last_used_at"]
+
+        client = redis_manager.redis_client
+        if client:
+            try:
+                raw_calls, raw_at = await client.hmget(
+                    self.PENDING_KEY, f"{key_id}:calls", f"{key_id}:last_used_at"
+                )
+            except Exception as e:
+                logger.warning("Read pending API key usage failed", error=str(e), key_id=key_id)
+                return calls, last_used_at
+            if raw_calls:
+                calls += int(raw_calls)
+            if raw_at:
+                at = datetime.fromisoformat(raw_at)
+                last_used_at = max(last_used_at, at) if last_used_at else at
+        return calls, last_used_at
+
+    async def hourly_usage(self, key_id: int, hours: int = 24) -> List[Tuple[datetime, int]]:
+        """
+        最近若干小时（含当前小时）的每小时调用次数
+
+        Returns:
+            按时间升序的 (整点时间, 次数) 列表，没有调用的小时次数为 0
+        """
+        current = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        slots = [current - timedelta(hours=offset) for offset in range(hours - 1, -1, -1)]
+
+        client = redis_manager.redis_client
+        if not client:
+            return [(hour, 0) for hour in slots]
+
+        # 每天一个哈希，一次往返取回全部小时
+        days: Dict[str, List[datetime]] = {}
+        for hour in slots:
+            days.setdefault(self.hourly_key(key_id, hour), []).append(hour)
+
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, day_hours in days.items():
+                pipe.hmget(key, [hour.strftime(HOUR_FORMAT) for hour in day_hours])
+            results = await pipe.execute()
+        except Exception as e:
+            logger.warning("Read API key hourly usage failed", error=str(e), key_id=key_id)
+            return [(hour, 0) for hour in slots]
+
+        counts: Dict[datetime, int] = {}
+        for day_hours, raw in zip(days.values(), results):
+            for hour, value in zip(day_hours, raw):
+                counts[hour] = int(value) if value else 0
+        return [(hour, counts.get(hour, 0)) for hour in slots]
+
+    async def flush(self) -> int:
+        """
+        将缓冲的增量写回数据库
+
+        Returns:
+            更新的API密钥数量
+        """
+        updated = await self._flush_local()
+
+        client = redis_manager.redis_client
+        if client:
+            updated += await _flush_snapshot(
+                client,
+                self.PENDING_KEY,
+                self.FLUSHING_KEY,
+                self.LOCK_KEY,
+                settings.API_KEY_USAGE_FLUSH_INTERVAL * 6,
+                self._apply_snapshot
+            )
+
+        return updated
+
+    async def _flush_local(self) -> int:
+        async with self._local_lock:
+            if not self._local:
+                return 0
+            pending, self._local = self._local, {}
+
+        rows = [
+            {"key_id": key_id, **entry}
+            for key_id, entry in pending.items()
+        ]
+        try:
+            return await self._apply(rows)
+        except Exception:
+            # 写库失败时把增量合并回去，等待下一轮
+            async with self._local_lock:
+                for key_id, entry in pending.items():
+                    current = self._local.get(key_id)
+                    if current is None:
+                        self._local[key_id] = entry
+                        continue
+                    current["calls"] += entry["calls"]
+                    # 最后使用时间取较新者，IP 与之保持一致
+                    if entry["last_used_at"] > current["last_used_at"]:
+                        current["last_used_at"] = entry["last_used_at"]
+                        current["last_used_ip"] = entry["last_used_ip"]
+            raise
+
+    async def _apply_snapshot(self, raw: Dict[str, str], snapshot_id: str) -> int:
+        rows = self._parse_snapshot(raw)
+        return await self._apply(rows, snapshot_id) if rows else 0
+
+    def _parse_snapshot(self, raw: Dict[str, str]) -> List[dict]:
+        keys: Dict[int, dict] = {}
+        for field, value in raw.items():
+            key_id, _, name = field.partition(":")
+            row = keys.setdefault(
+                int(key_id),
+                {"key_id": int(key_id), "calls": 0, "last_used_at": None, "last_used_ip": None}
+            )
+            if name == "calls":
+                row["calls"] = int(value)
+            elif name == "last_used_at":
+                row["last_used_at"] = datetime.fromisoformat(value)
+            elif name == "last_used_ip":
+                row["last_used_ip"] = value or None
+        return [row for row in keys.values() if row["calls"] > 0]
+
+    async def _apply(self, rows: List[dict], snapshot_id: Optional[str] = None) -> int:
+        """以一条 UPDATE ... FROM (VALUES ...) 写回所有API密钥的增量"""
+        deltas = values(
+            column("key_id", Integer),
+            column("calls", Integer),
+            column("last_used_at", DateTime),
+            column("last_used_ip", String),
+            name="deltas"
+        ).data([
+            (row["key_id"], row["calls"], row["last_used_at"], row["last_used_ip"])
+            for row in rows
+        ])
+
+        # VALUES 中的参数没有类型推断，显式转换
+        last_used_at = cast(deltas.c.last_used_at, DateTime)
+        last_used_ip = cast(deltas.c.last_used_ip, String)
+
+        stmt = (
+            update(APIKey)
+            .where(APIKey.id == deltas.c.key_id)
+            .values(
+                usage_count=APIKey.usage_count + deltas.c.calls,
+                last_used_at=func.coalesce(last_used_at, APIKey.last_used_at),
+                last_used_ip=func.coalesce(last_used_ip, APIKey.last_used_ip)
+            )
+            .returning(APIKey.user_id, deltas.c.calls)
+            .execution_options(synchronize_session=False)
+        )
+
+        async with AsyncSessionLocal() as session:
+            if snapshot_id is not None and not await _claim_snapshot(session, self.FLUSHING_KEY, snapshot_id):
+                logger.warning("API key usage snapshot already applied", snapshot_id=snapshot_id)
+                return 0
+            result = await session.execute(stmt)
+            returned = result.all()
+            await session.commit()
+
+        # 统计缓存按数据库口径累加，写库之后再更新
+        per_user: Dict[int, int] = defaultdict(int)
+        for user_id, calls in returned:
+            per_user[user_id] += calls
+        for user_id, calls in per_user.items():
+            await api_key_stats_cache.incr(user_id, total_usage=calls)
+
+        logger.info("API key usage stats flushed", keys=len(rows), updated=len(returned))
+        return len(returned)
+
+
+# 创建全局Agent使用统计缓冲实例
+agent_usage_buffer = AgentUsageBuffer()
+
+# 创建全局API密钥使用统计缓冲实例
+api_key_usage_buffer = APIKeyUsageBuffer()
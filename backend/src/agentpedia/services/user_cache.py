@@ -0,0 +1,197 @@
+"""
+用户身份缓存
+
+认证后的请求只需要用户的少数字段（ID、角色、状态、密码修改时间），
+这些字段以紧凑的只读快照缓存在进程内 LRU 与 Redis 中，避免每个请求都查询用户表。
+用户资料、状态、角色或密码变更时写入短期墓碑并通过 pub/sub 通知所有进程立即淘汰。
+"""
+import calendar
+import json
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.logging import get_logger
+from agentpedia.core.pubsub import pubsub_hub
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+INVALIDATION_CHANNEL = "user:invalidate"
+
+# 墓碑：失效后的短时间内不信任、也不写入缓存，避免并发的旧查询结果回填
+TOMBSTONE = "stale"
+
+
+@dataclass(slots=True)
+class UserPrincipal:
+    """已认证用户（授权所需字段的只读快照）"""
+
+    id: int
+    username: str
+    role: str
+    status: str
+    is_active: bool
+    is_email_verified: bool
+    password_changed_at: Optional[datetime] = None
+
+    @classmethod
+    def from_model(cls, user) -> "UserPrincipal":
+        return cls(
+            id=user.id,
+            username=user.username,
+            role=getattr(user.role, "value", user.role),
+            status=getattr(user.status, "value", user.status),
+            is_active=bool(user.is_active),
+            is_email_verified=bool(user.is_email_verified),
+            password_changed_at=user.password_changed_at
+        )
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        if self.password_changed_at:
+            data["password_changed_at"] = self.password_changed_at.isoformat()
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "UserPrincipal":
+        data = json.loads(raw)
+        if data.get("password_changed_at"):
+            data["password_changed_at"] = datetime.fromisoformat(data["password_changed_at"])
+        return cls(**data)
+
+    def token_revoked(self, issued_at) -> bool:
+        """令牌是否签发于最近一次修改密码之前（修改密码使旧令牌失效）"""
+        if self.password_changed_at is None:
+            return False
+        if not isinstance(issued_at, (int, float)):
+            # 没有签发时间的旧令牌无法判断，视为已失效
+            return True
+        return issued_at < calendar.timegm(self.password_changed_at.utctimetuple())
+
+
+class UserPrincipalCache:
+    """用户身份缓存"""
+
+    def __init__(self):
+        # 用户ID -> (过期时间, 身份快照)
+        self._local: "OrderedDict[int, Tuple[float, UserPrincipal]]" = OrderedDict()
+        # 用户ID -> 墓碑过期时间
+        self._tombstones: dict = {}
+
+    @staticmethod
+    def redis_key(user_id: int) -> str:
+        return f"user:principal:{user_id}"
+
+    async def start(self) -> None:
+        """订阅失效通知"""
+        await pubsub_hub.subscribe(INVALIDATION_CHANNEL, self._on_invalidate)
+        # 断线期间可能错过通知，重连后清空本地缓存
+        pubsub_hub.on_reconnect(self._local.clear)
+
+    async def get(self, user_id: int) -> Tuple[Optional[UserPrincipal], bool]:
+        """
+        查询缓存：先查进程内 LRU，再查 Redis
+
+        Returns:
+            (身份快照或 None, 查库结果是否可以写回缓存)
+        """
+        now = time.monotonic()
+        entry = self._local.get(user_id)
+        if entry is not None:
+            if entry[0] > now:
+                self._local.move_to_end(user_id)
+                return entry[1], True
+            del self._local[user_id]
+
+        if self._tombstoned(user_id, now):
+            return None, False
+
+        client = redis_manager.redis_client
+        if not client:
+            return None, True
+
+        try:
+            raw = await client.get(self.redis_key(user_id))
+        except Exception as e:
+            logger.warning("Read user cache failed", error=str(e), user_id=user_id)
+            return None, True
+
+        if raw is None:
+            return None, True
+        if raw == TOMBSTONE:
+            return None, False
+
+        principal = UserPrincipal.from_json(raw)
+        self._store_local(user_id, principal)
+        return principal, True
+
+    async def store(self, principal: UserPrincipal) -> None:
+        """写入身份快照"""
+        if self._tombstoned(principal.id, time.monotonic()):
+            return
+
+        self._store_local(principal.id, principal)
+
+        client = redis_manager.redis_client
+        if not client:
+            return
+        try:
+            # NX：不覆盖已有的墓碑
+            await client.set(
+                self.redis_key(principal.id),
+                principal.to_json(),
+                ex=settings.USER_CACHE_TTL,
+                nx=True
+            )
+        except Exception as e:
+            logger.warning("Write user cache failed", error=str(e), user_id=principal.id)
+
+    async def invalidate(self, user_id: int) -> None:
+        """使用户的缓存立即失效（所有进程）"""
+        self._evict(user_id)
+
+        client = redis_manager.redis_client
+        if not client:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.set(self.redis_key(user_id), TOMBSTONE, ex=settings.USER_CACHE_TOMBSTONE_TTL)
+            pipe.publish(INVALIDATION_CHANNEL, str(user_id))
+            await pipe.execute()
+        except Exception as e:
+            logger.warning("Invalidate user cache failed", error=str(e), user_id=user_id)
+
+    def _on_invalidate(self, channel: str, user_id: str) -> None:
+        self._evict(int(user_id))
+
+    def _evict(self, user_id: int) -> None:
+        now = time.monotonic()
+        self._local.pop(user_id, None)
+        if len(self._tombstones) > settings.USER_LOCAL_CACHE_SIZE:
+            self._tombstones = {uid: until for uid, until in self._tombstones.items() if until > now}
+        self._tombstones[user_id] = now + settings.USER_CACHE_TOMBSTONE_TTL
+
+    def _tombstoned(self, user_id: int, now: float) -> bool:
+        until = self._tombstones.get(user_id)
+        if until is None:
+            return False
+        if until > now:
+            return True
+        del self._tombstones[user_id]
+        return False
+
+    def _store_local(self, user_id: int, principal: UserPrincipal) -> None:
+        # 本地条目时间更短，作为错过失效通知时的兜底
+        self._local[user_id] = (time.monotonic() + settings.USER_LOCAL_CACHE_TTL, principal)
+        self._local.move_to_end(user_id)
+        while len(self._local) > settings.USER_LOCAL_CACHE_SIZE:
+            self._local.popitem(last=False)
+
+
+# 创建全局用户身份缓存实例
+user_principal_cache = UserPrincipalCache()
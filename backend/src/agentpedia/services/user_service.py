@@ -8,11 +8,12 @@ from sqlalchemy import and_, func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from agentpedia.core.security import create_access_token, create_refresh_token, get_password_hash, verify_password
+from agentpedia.core.security import create_access_token, create_refresh_token, decode_token, password_hasher
 from agentpedia.models.user import User, UserRole, UserStatus
 from agentpedia.schemas.user import UserCreate, UserUpdate
 from agentpedia.schemas.base import PaginationParams, FilterParams
 from agentpedia.services.base import BaseService
+from agentpedia.services.user_cache import UserPrincipal, user_principal_cache
 
 
 class UserService(BaseService[User, UserCreate, UserUpdate]):
@@ -37,7 +38,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         user = User(
             username=user_data.username,
             email=user_data.email,
-            hashed_password=get_password_hash(user_data.password),
+            hashed_password=await password_hasher.hash(user_data.password),
             full_name=user_data.full_name,
             bio=user_data.bio,
             avatar_url=user_data.avatar_url,
@@ -65,10 +66,19 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
             return None
         
         # 验证密码
-        if not verify_password(password, user.hashed_password):
+        valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not valid:
             user.increment_failed_login()
+            locked, user_id = user.is_locked, user.id
             await self.db.commit()
+            if locked:
+                # 连续失败导致锁定，已缓存的身份须立即失效
+                await user_principal_cache.invalidate(user_id)
             return None
+
+        # 成本因子调整后顺带升级旧哈希
+        if new_hash:
+            user.hashed_password = new_hash
         
         # 检查用户状态
         if not user.is_active:
@@ -121,9 +131,24 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         user.updated_at = datetime.utcnow()
         await self.db.commit()
         await self.db.refresh(user)
+        await user_principal_cache.invalidate(user_id)
         
         return user
     
+    async def delete(self, id: int) -> Optional[User]:
+        """软删除用户，已缓存的身份随之失效"""
+        user = await super().delete(id)
+        if user:
+            await user_principal_cache.invalidate(id)
+        return user
+    
+    async def hard_delete(self, id: int) -> bool:
+        """硬删除用户，已缓存的身份随之失效"""
+        deleted = await super().hard_delete(id)
+        if deleted:
+            await user_principal_cache.invalidate(id)
+        return deleted
+    
     async def change_password(self, user_id: int, current_password: str, new_password: str) -> bool:
         """修改密码"""
         user = await self.get(user_id)
@@ -131,14 +156,15 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
             return False
         
         # 验证当前密码
-        if not verify_password(current_password, user.hashed_password):
+        if not await password_hasher.verify(current_password, user.hashed_password):
             return False
         
         # 更新密码
-        user.hashed_password = get_password_hash(new_password)
+        user.hashed_password = await password_hasher.hash(new_password)
         user.change_password()
         
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def reset_password(self, email: str, new_password: str) -> bool:
@@ -147,11 +173,13 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         if not user:
             return False
         
-        user.hashed_password = get_password_hash(new_password)
+        user.hashed_password = await password_hasher.hash(new_password)
         user.change_password()
         user.unlock_account()  # 解锁账户
+        user_id = user.id
         
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def verify_email(self, user_id: int) -> bool:
@@ -162,6 +190,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.verify_email()
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def lock_user(self, user_id: int, duration_minutes: int = 30) -> bool:
@@ -172,6 +201,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.lock_account(duration_minutes)
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def unlock_user(self, user_id: int) -> bool:
@@ -182,6 +212,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.unlock_account()
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def activate_user(self, user_id: int) -> bool:
@@ -192,6 +223,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.status = UserStatus.ACTIVE
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def deactivate_user(self, user_id: int) -> bool:
@@ -202,6 +234,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.status = UserStatus.INACTIVE
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def suspend_user(self, user_id: int) -> bool:
@@ -212,6 +245,7 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.status = UserStatus.SUSPENDED
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
         return True
     
     async def change_role(self, user_id: int, new_role: UserRole) -> bool:
@@ -222,6 +256,11 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
         
         user.role = new_role
         await self.db.commit()
+        await user_principal_cache.invalidate(user_id)
+
+        # 用户自身角色参与权限编译，变更后使权限缓存作废
+        from agentpedia.services.permission_cache import permission_cache
+        await permission_cache.bump_version()
         return True
     
     async def get_users_with_filters(
@@ -288,14 +327,51 @@ class UserService(BaseService[User, UserCreate, UserUpdate]):
             "api_keys_count": 0,
         }
     
+    async def get_principal(self, user_id: int) -> Optional[UserPrincipal]:
+        """获取用户身份快照（优先读缓存）"""
+        principal, cacheable = await user_principal_cache.get(user_id)
+        if principal is not None:
+            return principal
+
+        result = await self.db.execute(
+            select(User).where(User.id == user_id, User.deleted_at.is_(None))
+        )
+        user = result.scalar_one_or_none()
+        if not user:
+            return None
+        principal = UserPrincipal.from_model(user)
+        if cacheable:
+            await user_principal_cache.store(principal)
+        return principal
+
+    async def resolve_access_token(self, token: str) -> Optional[UserPrincipal]:
+        """
+        解析访问令牌对应的用户
+
+        令牌验证结果与用户身份都有缓存，重复请求通常不需要计算签名或查询数据库。
+
+        Returns:
+            令牌有效且用户处于活跃状态时返回身份快照，否则返回 None
+        """
+        payload = decode_token(token)
+        if payload is None or payload.get("type") == "refresh":
+            return None
+        try:
+            user_id = int(payload.get("sub"))
+        except (TypeError, ValueError):
+            return None
+
+        principal = await self.get_principal(user_id)
+        if principal is None or not principal.is_active:
+            return None
+        if principal.token_revoked(payload.get("iat")):
+            return None
+        return principal
+
     async def create_tokens(self, user: User) -> dict:
         """创建访问令牌和刷新令牌"""
-        access_token = create_access_token(
-            data={"sub": str(user.id), "username": user.username}
-        )
-        refresh_token = create_refresh_token(
-            data={"sub": str(user.id), "username": user.username}
-        )
+        access_token = create_access_token(user.id)
+        refresh_token = create_refresh_token(user.id)
         
         return {
             "access_token": access_token,
@@ -1,46 +1,80 @@
 """
 微信扫码登录服务
+
+扫码登录的完成状态通过每个会话的 Redis 频道推送，浏览器用长轮询或 SSE 等待，
+所有等待中的会话共用每个进程的一条订阅连接（pubsub_hub）。
+微信接口通过异步 OAuth 客户端调用；二维码在线程池中渲染，不阻塞事件循环。
 """
+import asyncio
+import json
+import time
 import uuid
-import qrcode
 import io
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
 import logging
 
-from wechatpy import WeChatClient
-from wechatpy.exceptions import WeChatClientException
-from wechatpy.utils import random_string
 from fastapi import HTTPException, status
 
 from agentpedia.core.config import get_settings
+from agentpedia.core.pubsub import pubsub_hub
 from agentpedia.core.redis import redis_manager
 from agentpedia.core.security import create_access_token, create_refresh_token
 from agentpedia.models.user import User, UserRole, UserStatus, LoginMethod
 from agentpedia.schemas.wechat import WechatLoginResponse, WechatCallbackRequest
+from agentpedia.services.wechat_oauth import WechatAPIError, wechat_oauth_client
 
 logger = logging.getLogger(__name__)
 
+# 登录会话的终态
+TERMINAL_STATUSES = {"success", "failed"}
+
+
+def render_qr_code(data: str) -> str:
+    """把文本渲染为 PNG 二维码，返回 base64 编码（CPU 密集，在线程池中调用）"""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode()
+
 
 class WechatAuthService:
     """微信认证服务"""
 
     def __init__(self):
         self.settings = get_settings()
-        self.client: Optional[WeChatClient] = None
-
-    def _get_client(self) -> WeChatClient:
-        """获取微信客户端"""
-        if not self.client:
-            if not self.settings.WECHAT_APP_ID or not self.settings.WECHAT_APP_SECRET:
-                raise ValueError("微信配置缺失")
-
-            self.client = WeChatClient(
-                self.settings.WECHAT_APP_ID,
-                self.settings.WECHAT_APP_SECRET
+        self.oauth = wechat_oauth_client
+        self._qr_executor: Optional[ThreadPoolExecutor] = None
+
+    async def render_qr_code(self, data: str) -> str:
+        """在线程池中渲染二维码"""
+        if self._qr_executor is None:
+            self._qr_executor = ThreadPoolExecutor(
+                max_workers=self.settings.WECHAT_QR_RENDER_WORKERS,
+                thread_name_prefix="wechat-qr"
             )
-        return self.client
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._qr_executor, render_qr_code, data)
+
+    async def close(self) -> None:
+        """关闭微信接口连接与二维码渲染线程池"""
+        await self.oauth.close()
+        if self._qr_executor is not None:
+            self._qr_executor.shutdown(wait=False, cancel_futures=True)
+            self._qr_executor = None
 
     async def generate_login_qr_code(self) -> WechatLoginResponse:
         """生成登录二维码"""
@@ -48,8 +82,8 @@ class WechatAuthService:
             # 生成唯一的会话ID
             session_id = str(uuid.uuid4())
 
-            # 生成微信登录 ticket
-            client = self._get_client()
+            if not self.settings.WECHAT_APP_ID:
+                raise ValueError("微信配置缺失")
 
             # 使用微信开放平台网站应用登录
             # 这里需要根据实际的微信开放平台API调整
@@ -58,30 +92,17 @@ class WechatAuthService:
             login_url += f"&response_type=code&scope=snsapi_login&state={session_id}#wechat_redirect"
 
             # 生成二维码
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(login_url)
-            qr.make(fit=True)
-
-            # 将二维码转换为base64
-            img = qr.make_image(fill_color="black", back_color="white")
-            buffer = io.BytesIO()
-            img.save(buffer, format="PNG")
-            qr_code_base64 = base64.b64encode(buffer.getvalue()).decode()
+            qr_code_base64 = await self.render_qr_code(login_url)
 
             # 在Redis中存储会话信息，有效期5分钟
-            await redis_manager.setex(
+            await redis_manager.set_json(
                 f"wechat_login:{session_id}",
-                300,  # 5分钟
                 {
                     "status": "pending",
                     "created_at": datetime.utcnow().isoformat(),
                     "login_url": login_url
-                }
+                },
+                300  # 5分钟
             )
 
             return WechatLoginResponse(
@@ -102,7 +123,7 @@ class WechatAuthService:
         """检查登录状态"""
         try:
             # 从Redis获取会话信息
-            session_data = await redis_manager.get(f"wechat_login:{session_id}")
+            session_data = await redis_manager.get_json(f"wechat_login:{session_id}")
             if not session_data:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -125,35 +146,109 @@ class WechatAuthService:
                 detail="检查登录状态失败"
             )
 
+    @staticmethod
+    def _done_channel(session_id: str) -> str:
+        """会话完成通知频道"""
+        return f"wechat_login:done:{session_id}"
+
+    async def wait_for_login(self, session_id: str, timeout: float) -> Dict[str, Any]:
+        """
+        等待登录会话进入终态（长轮询）
+
+        先订阅会话频道再读取状态，已完成的会话立即返回；
+        否则最多等待 timeout 秒，超时时返回当前（仍为 pending 的）状态，由客户端重新发起。
+
+        Raises:
+            HTTPException: 会话不存在或已过期
+        """
+        channel = self._done_channel(session_id)
+        done = asyncio.Event()
+
+        def on_done(channel: str, data: str) -> None:
+            done.set()
+
+        await pubsub_hub.subscribe(channel, on_done)
+        try:
+            status_data = await self.check_login_status(session_id)
+            if status_data["status"] in TERMINAL_STATUSES or timeout <= 0:
+                return status_data
+
+            if pubsub_hub.connected:
+                try:
+                    await asyncio.wait_for(done.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                return await self.check_login_status(session_id)
+
+            # 订阅连接不可用时退回服务端轮询，客户端仍只需一次请求
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.settings.WECHAT_LOGIN_POLL_INTERVAL)
+                status_data = await self.check_login_status(session_id)
+                if status_data["status"] in TERMINAL_STATUSES:
+                    break
+            return status_data
+        finally:
+            await pubsub_hub.unsubscribe(channel, on_done)
+
+    async def stream_login_status(self, session_id: str):
+        """
+        推送登录状态（SSE）：先发送当前状态，之后每次状态变化或等待超时（作为心跳）时发送，
+        进入终态或会话过期后结束
+        """
+        timeout = 0
+        while True:
+            try:
+                status_data = await self.wait_for_login(session_id, timeout)
+            except HTTPException as e:
+                if e.status_code == status.HTTP_404_NOT_FOUND:
+                    yield {"session_id": session_id, "status": "expired"}
+                    return
+                raise
+            yield status_data
+            if status_data["status"] in TERMINAL_STATUSES:
+                return
+            timeout = self.settings.WECHAT_LOGIN_WAIT_TIMEOUT
+
+    async def _fail_session(self, session_id: str, session_data: Dict[str, Any]) -> None:
+        """把会话标记为失败（保留原有效期）并通知等待中的浏览器"""
+        try:
+            # xx：会话已过期时不重新创建
+            await redis_manager.redis_client.set(
+                f"wechat_login:{session_id}",
+                json.dumps({**session_data, "status": "failed"}, ensure_ascii=False),
+                keepttl=True,
+                xx=True
+            )
+        except Exception as e:
+            logger.error(f"标记登录会话失败状态失败: {e}")
+        await pubsub_hub.publish(self._done_channel(session_id), "failed")
+
     async def handle_callback(self, request: WechatCallbackRequest) -> Dict[str, Any]:
-        """处理微信回调"""
+        """处理微信回调（失败时会话进入 failed 终态，等待中的浏览器随即结束等待）"""
+        session_data = None
         try:
             # 验证state参数
-            session_data = await redis_manager.get(f"wechat_login:{request.state}")
+            session_data = await redis_manager.get_json(f"wechat_login:{request.state}")
             if not session_data:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="无效的会话ID"
                 )
 
-            # 使用code获取access_token
-            client = self._get_client()
-
             try:
-                # 获取access_token
-                token_data = client.oauth.fetch_access_token(
-                    self.settings.WECHAT_REDIRECT_URI,
-                    code=request.code
-                )
+                # 使用code获取access_token
+                token_data = await self.oauth.fetch_access_token(request.code)
 
                 # 获取用户信息
-                user_info = client.oauth.get_user_info(
+                user_info = await self.oauth.get_user_info(
                     access_token=token_data['access_token'],
                     openid=token_data['openid']
                 )
 
-            except WeChatClientException as e:
+            except WechatAPIError as e:
                 logger.error(f"微信API调用失败: {e}")
+                await self._fail_session(request.state, session_data)
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="微信授权失败"
@@ -166,8 +261,9 @@ class WechatAuthService:
             access_token = create_access_token(subject=user.id)
             refresh_token = create_refresh_token(subject=user.id)
 
-            # 更新Redis中的会话信息
-            session_data.update({
+            # 更新Redis中的会话信息（另建字典：之后失败时按原会话标记，不写入令牌）
+            completed = dict(session_data)
+            completed.update({
                 "status": "success",
                 "user_info": {
                     "id": user.id,
@@ -181,24 +277,29 @@ class WechatAuthService:
                 "expires_at": (datetime.utcnow() + timedelta(minutes=30)).isoformat()
             })
 
-            await redis_manager.setex(
+            await redis_manager.set_json(
                 f"wechat_login:{request.state}",
-                1800,  # 30分钟
-                session_data
+                completed,
+                1800  # 30分钟
             )
 
+            # 通知等待中的浏览器（只发送信号，令牌不经过发布/订阅）
+            await pubsub_hub.publish(self._done_channel(request.state), "success")
+
             return {
                 "session_id": request.state,
                 "status": "success",
                 "access_token": access_token,
                 "refresh_token": refresh_token,
-                "user_info": session_data["user_info"]
+                "user_info": completed["user_info"]
             }
 
         except HTTPException:
             raise
         except Exception as e:
             logger.error(f"处理微信回调失败: {e}")
+            if session_data:
+                await self._fail_session(request.state, session_data)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="处理微信回调失败"
@@ -0,0 +1,140 @@
+"""
+微信开放平台 OAuth 客户端
+
+所有请求共用一个带连接池与超时的 httpx.AsyncClient，不阻塞事件循环。
+应用级 access_token（cgi-bin/token）缓存在 Redis 中直到过期前，
+多个进程共享同一个令牌，避免频繁刷新触发微信的调用次数限制。
+接口地址由 WECHAT_API_BASE 配置，测试时可指向本地桩服务。
+"""
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+from agentpedia.core.config import get_settings
+from agentpedia.core.exceptions import ExternalServiceError
+from agentpedia.core.logging import get_logger
+from agentpedia.core.redis import redis_manager
+
+settings = get_settings()
+logger = get_logger(__name__)
+
+APP_TOKEN_KEY = "wechat:app_token:{app_id}"
+
+
+class WechatAPIError(ExternalServiceError):
+    """微信接口返回错误（errcode 非 0）或请求失败"""
+
+    def __init__(self, message: str = "微信接口调用失败", errcode: Optional[int] = None):
+        super().__init__(message, "WECHAT_API_ERROR")
+        self.errcode = errcode
+
+
+class WechatOAuthClient:
+    """微信开放平台 OAuth 客户端"""
+
+    def __init__(self, api_base: Optional[str] = None, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.api_base = (api_base or settings.WECHAT_API_BASE).rstrip("/")
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._app_token_lock = asyncio.Lock()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                timeout=httpx.Timeout(settings.WECHAT_API_TIMEOUT, connect=settings.WECHAT_API_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=settings.WECHAT_API_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.WECHAT_API_MAX_CONNECTIONS
+                ),
+                transport=self._transport
+            )
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @staticmethod
+    def _credentials() -> Dict[str, str]:
+        if not settings.WECHAT_APP_ID or not settings.WECHAT_APP_SECRET:
+            raise WechatAPIError("微信配置缺失")
+        return {"appid": settings.WECHAT_APP_ID, "secret": settings.WECHAT_APP_SECRET}
+
+    async def _get(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """调用微信接口，errcode 非 0 时抛出 WechatAPIError"""
+        try:
+            response = await self.client.get(path, params=params)
+            response.raise_for_status()
+            # 微信接口的 Content-Type 不总是 application/json，按 UTF-8 解析
+            data = response.json()
+        except httpx.HTTPError as e:
+            raise WechatAPIError(f"微信接口请求失败: {e}") from e
+        except ValueError as e:
+            raise WechatAPIError("微信接口返回了无效的JSON") from e
+
+        errcode = data.get("errcode")
+        if errcode:
+            raise WechatAPIError(f"微信接口返回错误 {errcode}: {data.get('errmsg')}", errcode)
+        return data
+
+    async def fetch_access_token(self, code: str) -> Dict[str, Any]:
+        """用授权 code 换取网页授权 access_token（含 openid）"""
+        return await self._get(
+            "/sns/oauth2/access_token",
+            {**self._credentials(), "code": code, "grant_type": "authorization_code"}
+        )
+
+    async def get_user_info(self, access_token: str, openid: str, lang: str = "zh_CN") -> Dict[str, Any]:
+        """获取扫码用户的基本信息"""
+        return await self._get(
+            "/sns/userinfo",
+            {"access_token": access_token, "openid": openid, "lang": lang}
+        )
+
+    async def get_app_access_token(self) -> str:
+        """
+        获取应用级 access_token
+
+        先读 Redis；缓存缺失时由本进程中的一个协程刷新，并按 expires_in 减去提前量写回。
+        """
+        key = APP_TOKEN_KEY.format(app_id=settings.WECHAT_APP_ID)
+        token = await self._cached_app_token(key)
+        if token:
+            return token
+
+        async with self._app_token_lock:
+            # 等锁期间可能已被其他协程刷新
+            token = await self._cached_app_token(key)
+            if token:
+                return token
+
+            data = await self._get("/cgi-bin/token", {**self._credentials(), "grant_type": "client_credential"})
+            token = data["access_token"]
+            ttl = int(data.get("expires_in", 7200)) - settings.WECHAT_APP_TOKEN_REFRESH_MARGIN
+
+            client = redis_manager.redis_client
+            if client and ttl > 0:
+                try:
+                    await client.set(key, token, ex=ttl)
+                except Exception as e:
+                    logger.warning("Write WeChat app token failed", error=str(e))
+            return token
+
+    @staticmethod
+    async def _cached_app_token(key: str) -> Optional[str]:
+        client = redis_manager.redis_client
+        if not client:
+            return None
+        try:
+            return await client.get(key)
+        except Exception as e:
+            logger.warning("Read WeChat app token failed", error=str(e))
+            return None
+
+
+# 创建全局微信 OAuth 客户端实例
+wechat_oauth_client = WechatOAuthClient()
@@ -0,0 +1,75 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from sqlalchemy.dialects import postgresql
+    from agentpedia.core.exceptions import NotFoundError
+    from agentpedia.services.agent_service import AgentService
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过Agent评论测试", allow_module_level=True)
+
+
+class FakeSession:
+    def __init__(self, updated, agent_exists=True):
+        self.updated = updated
+        self.agent_exists = agent_exists
+        self.statements = []
+        self.committed = False
+        self.rolled_back = False
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        return SimpleNamespace(scalar_one_or_none=lambda: self.updated)
+
+    async def scalar(self, statement):
+        self.statements.append(statement)
+        return 1 if self.agent_exists else None
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        self.rolled_back = True
+
+
+def compiled(statement):
+    return " ".join(str(statement.compile(dialect=postgresql.dialect())).split())
+
+
+@pytest.mark.asyncio
+async def test_review_insert_drives_rating_update_in_one_statement():
+    session = FakeSession(updated=7)
+    assert await AgentService(session).add_review(7, 3, 4.0, "title", "content")
+    assert session.committed and not session.rolled_back
+
+    sql = compiled(session.statements[0])
+    assert sql.startswith("WITH new_review AS (INSERT INTO agent_reviews")
+    # 判重依赖只覆盖未删除评论的部分唯一索引
+    assert "ON CONFLICT (agent_id, user_id) WHERE deleted_at IS NULL DO NOTHING" in sql
+    assert "RETURNING agent_reviews.agent_id, agent_reviews.rating" in sql
+    assert "UPDATE agents SET" in sql
+    assert "agents.id = new_review.agent_id AND agents.deleted_at IS NULL" in sql
+
+
+@pytest.mark.asyncio
+async def test_duplicate_review_rolls_back():
+    session = FakeSession(updated=None, agent_exists=True)
+    with pytest.raises(ValueError):
+        await AgentService(session).add_review(7, 3, 4.0)
+    assert session.rolled_back and not session.committed
+
+
+@pytest.mark.asyncio
+async def test_review_for_missing_agent_is_not_found():
+    session = FakeSession(updated=None, agent_exists=False)
+    with pytest.raises(NotFoundError):
+        await AgentService(session).add_review(7, 3, 4.0)
+    assert session.rolled_back and not session.committed
+    assert "agents.deleted_at IS NULL" in compiled(session.statements[1])
@@ -0,0 +1,165 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from sqlalchemy.dialects import postgresql
+    from agentpedia.core.redis import redis_manager
+    from agentpedia.schemas.analytics import AnalyticsEvent
+    from agentpedia.services import analytics_service
+    from agentpedia.services.analytics_service import (
+        EVENT_USAGE,
+        AnalyticsEventBuffer,
+        AnalyticsRollupService,
+    )
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过分析汇总测试", allow_module_level=True)
+
+
+def test_aggregate_daily_sums_and_weights_per_agent_day():
+    service = AnalyticsRollupService()
+    today = datetime.utcnow().replace(hour=10)
+    events = [
+        AnalyticsEvent(agent_id=1, occurred_at=today, page_views=1, bounces=1),
+        AnalyticsEvent(agent_id=1, occurred_at=today, page_views=1),
+        AnalyticsEvent(
+            agent_id=1, occurred_at=today, conversations=1, messages=1,
+            tokens=100, cost=0.2, response_time=3.0
+        ),
+        AnalyticsEvent(agent_id=1, occurred_at=today, messages=1, response_time=1.0, failed_messages=1),
+        AnalyticsEvent(agent_id=2, occurred_at=today - timedelta(days=1), messages=1, tokens=5),
+        # 超出迟到窗口的事件被丢弃
+        AnalyticsEvent(agent_id=1, occurred_at=today - timedelta(days=365), page_views=1),
+    ]
+
+    rows = {
+        (row["agent_id"], row["date"].date()): row
+        for row in service.aggregate_daily(events, {(1, today.date()): 7})
+    }
+
+    assert len(rows) == 2
+    row = rows[(1, today.date())]
+    assert row["period_type"] == "daily"
+    assert row["date"] == datetime.combine(today.date(), datetime.min.time())
+    assert (row["page_views"], row["unique_visitors"], row["bounce_rate"]) == (2, 7, 0.5)
+    assert (row["total_conversations"], row["total_messages"], row["total_tokens_used"]) == (1, 2, 100)
+    assert row["cost"] == pytest.approx(0.2)
+    assert row["average_response_time"] == pytest.approx(2.0)
+    assert row["success_rate"] == pytest.approx(0.5)
+
+    assert rows[(2, (today - timedelta(days=1)).date())]["unique_visitors"] == 0
+
+
+def test_usage_entries_are_parsed_alongside_page_views():
+    buffer = AnalyticsEventBuffer(AnalyticsRollupService())
+    ts = datetime(2024, 5, 1, 12).isoformat()
+
+    events = buffer._parse_entries([
+        ("1-0", {"agent_id": "3", "ts": ts, "bounced": "1"}),
+        ("2-0", {
+            "kind": EVENT_USAGE, "agent_id": "3", "ts": ts, "conversations": "1",
+            "messages": "1", "tokens": "42", "cost": "0.5", "response_time": "1.5"
+        }),
+        ("3-0", {"agent_id": "x", "ts": ts}),
+    ])
+
+    assert len(events) == 2
+    assert (events[0].page_views, events[0].bounces, events[0].messages) == (1, 1, 0)
+    assert (events[1].page_views, events[1].conversations, events[1].tokens) == (0, 1, 42)
+    assert (events[1].cost, events[1].response_time, events[1].failed_messages) == (0.5, 1.5, 0)
+
+
+def test_derive_statement_rebuilds_dirty_periods_from_daily_rows():
+    statement = AnalyticsRollupService()._derive_statement("weekly", "week", datetime(2024, 5, 1))
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+
+    assert "date_trunc('week', agent_analytics.date)" in sql
+    assert "GROUP BY agent_analytics.agent_id, date_trunc('week', agent_analytics.date)" in sql
+    assert "agent_analytics.updated_at >" in sql
+    assert "ON CONFLICT (agent_id, period_type, date) DO UPDATE" in sql
+    # 派生只读 daily 行，且不覆盖创建时间
+    assert sql.count("agent_analytics.period_type =") == 2
+    assert "created_at = excluded.created_at" not in sql
+    assert "total_tokens_used = excluded.total_tokens_used" in sql
+
+
+class StreamRedis:
+    """只实现事件消费用到的命令"""
+
+    def __init__(self, count):
+        ts = datetime.utcnow().isoformat()
+        self.entries = [(f"{i}-0", {"agent_id": "1", "ts": ts}) for i in range(count)]
+        self.reads = 0
+
+    async def xgroup_create(self, *args, **kwargs):
+        return True
+
+    async def xautoclaim(self, *args, **kwargs):
+        return ["0-0", [], []]
+
+    async def xreadgroup(self, group, consumer, streams, count):
+        self.reads += 1
+        batch, self.entries = self.entries[:count], self.entries[count:]
+        return [("stream", batch)] if batch else []
+
+    async def xlen(self, key):
+        return len(self.entries)
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __getattr__(self, name):
+        # 流水线中的其他命令（pfcount / xack / xdel）无需模拟
+        return lambda *args, **kwargs: None
+
+    async def execute(self):
+        return [3]
+
+
+@pytest.fixture
+def stream_buffer(monkeypatch):
+    ingested = []
+
+    class Rollup:
+        async def ingest(self, events, unique_visitors=None):
+            ingested.extend(events)
+
+    async def existing(events):
+        return events
+
+    monkeypatch.setattr(analytics_service.settings, "ANALYTICS_FLUSH_BATCH_SIZE", 2)
+    buffer = AnalyticsEventBuffer(Rollup())
+    monkeypatch.setattr(buffer, "_filter_existing_agents", existing)
+    return buffer, ingested
+
+
+@pytest.mark.asyncio
+async def test_flush_drains_backlog_in_batches(monkeypatch, stream_buffer):
+    buffer, ingested = stream_buffer
+    redis = StreamRedis(5)
+    monkeypatch.setattr(redis_manager, "redis_client", redis)
+
+    assert await buffer.flush() == 5
+    assert len(ingested) == 5
+    assert redis.reads == 3
+
+
+@pytest.mark.asyncio
+async def test_flush_stops_at_time_budget_and_warns_about_trimming(monkeypatch, stream_buffer):
+    buffer, _ = stream_buffer
+    redis = StreamRedis(10)
+    monkeypatch.setattr(redis_manager, "redis_client", redis)
+    monkeypatch.setattr(analytics_service.settings, "ANALYTICS_FLUSH_INTERVAL", 0)
+    monkeypatch.setattr(analytics_service.settings, "ANALYTICS_STREAM_MAXLEN", 8)
+    warnings = []
+    monkeypatch.setattr(analytics_service.logger, "warning", lambda event, **kw: warnings.append((event, kw)))
+
+    assert await buffer.flush() == 2
+    assert len(redis.entries) == 8
+    assert warnings and warnings[0][1]["backlog"] == 8
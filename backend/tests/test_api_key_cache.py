@@ -0,0 +1,77 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import redis_manager
+    from agentpedia.services import api_key_cache as cache_module
+    from agentpedia.services.api_key_cache import INVALIDATION_CHANNEL, APIKeyAuthCache, APIKeyPrincipal
+except Exception:
+    pytest.skip("后端依赖未安装，跳过API密钥缓存测试", allow_module_level=True)
+
+
+def principal(expires_at=None):
+    return APIKeyPrincipal(1, 7, "ci", ["read"], expires_at, 60, None, None)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(redis_manager, "redis_client", None)
+    return APIKeyAuthCache()
+
+
+def test_tombstone_blocks_backfill(cache):
+    async def scenario():
+        await cache.store("h", principal())
+        assert (await cache.get("h")).principal == principal()
+
+        await cache.invalidate("h")
+        # 墓碑期内并发的旧查询结果不得回填
+        await cache.store("h", principal())
+        lookup = await cache.get("h")
+        assert not lookup.found and not lookup.cacheable
+
+    asyncio.run(scenario())
+
+
+def test_negative_entry_expires(cache, monkeypatch):
+    monkeypatch.setattr(cache_module.settings, "API_KEY_NEGATIVE_CACHE_TTL", 0.05)
+
+    async def scenario():
+        await cache.store("missing", None)
+        lookup = await cache.get("missing")
+        assert lookup.found and lookup.principal is None
+
+        await asyncio.sleep(0.1)
+        lookup = await cache.get("missing")
+        assert not lookup.found and lookup.cacheable
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_message_evicts_local_entry(cache):
+    async def scenario():
+        await cache.store("h", principal())
+        cache._on_invalidate(INVALIDATION_CHANNEL, "h")
+        lookup = await cache.get("h")
+        assert not lookup.found and not lookup.cacheable
+
+    asyncio.run(scenario())
+
+
+def test_expired_key_is_not_served(cache):
+    async def scenario():
+        await cache.store("old", principal(datetime.utcnow() - timedelta(seconds=1)))
+        assert not (await cache.get("old")).found
+
+        soon = principal(datetime.utcnow() + timedelta(seconds=60))
+        assert APIKeyPrincipal.from_json(soon.to_json()) == soon
+
+    asyncio.run(scenario())
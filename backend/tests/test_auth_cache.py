@@ -0,0 +1,47 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core import security
+    from agentpedia.core.security import create_access_token, decode_token, verified_token_cache
+    from agentpedia.services.user_cache import UserPrincipal
+except Exception:
+    pytest.skip("后端依赖未安装，跳过认证缓存测试", allow_module_level=True)
+
+
+def test_verified_token_is_decoded_once(monkeypatch):
+    verified_token_cache.clear()
+    token = create_access_token(42)
+    assert decode_token(token)["sub"] == "42"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cached token should not be decoded again")
+
+    monkeypatch.setattr(security.jwt, "decode", fail)
+    assert decode_token(token)["sub"] == "42"
+
+
+def test_expired_entry_is_dropped():
+    verified_token_cache.clear()
+    verified_token_cache.put("token", {"sub": "1", "exp": 0})
+    assert verified_token_cache.get("token") is None
+    assert decode_token("not-a-jwt") is None
+
+
+def test_password_change_revokes_older_tokens():
+    changed = datetime(2026, 1, 1, 12, 0, 0)
+    principal = UserPrincipal(1, "alice", "user", "active", True, True, changed)
+    issued_before = (changed - timedelta(minutes=1) - datetime(1970, 1, 1)).total_seconds()
+    issued_after = (changed + timedelta(minutes=1) - datetime(1970, 1, 1)).total_seconds()
+
+    assert principal.token_revoked(issued_before)
+    assert not principal.token_revoked(issued_after)
+    assert principal.token_revoked(None)
+    assert UserPrincipal.from_json(principal.to_json()) == principal
@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import CacheEntry, cache_result, canonical_cache_key
+except Exception:
+    pytest.skip("后端依赖未安装，跳过结果缓存测试", allow_module_level=True)
+
+
+def test_cache_key_is_canonical_and_skips_session_arguments():
+    @cache_result(key_prefix="agents")
+    async def get_agent(self, db, agent_id: int, include_stats: bool = False):
+        return {"id": agent_id}
+
+    key = get_agent.cache_key(object(), object(), 7)
+    assert key == get_agent.cache_key(None, None, agent_id=7, include_stats=False)
+    assert key == canonical_cache_key("agents", {"include_stats": False, "agent_id": 7})
+    assert key != get_agent.cache_key(None, None, 8)
+
+    with pytest.raises(TypeError):
+        canonical_cache_key("agents", {"owner": object()})
+
+
+def test_early_refresh_probability_grows_near_expiry():
+    entry = CacheEntry({"id": 1}, expires_at=1000.0, delta=0.5)
+    assert not entry.should_refresh_early(900.0, beta=1.0)
+    assert entry.should_refresh_early(999.999999, beta=1e9)
+    assert not entry.should_refresh_early(999.9, beta=0)
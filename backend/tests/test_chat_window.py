@@ -0,0 +1,71 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import redis_manager
+    from agentpedia.services import context_service
+    from agentpedia.services.context_service import ConversationContextBuilder
+    from agentpedia.services.llm_service import LocalProvider
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过对话上下文测试", allow_module_level=True)
+
+
+def message(index):
+    return SimpleNamespace(role="user", content=f"m{index}", tokens_used=1)
+
+
+class ArchivedConversation:
+    """热表为空、消息全部在归档中的对话"""
+
+    def __init__(self, count):
+        self.hot = []
+        self.archived = [message(i) for i in range(count)]
+        self.restores = 0
+
+    async def get_recent_messages(self, conversation_id, limit, before_id=None):
+        return self.hot[-limit:]
+
+    async def restore(self, conversation_id):
+        self.restores += 1
+        restored, self.hot, self.archived = len(self.archived), self.archived + self.hot, []
+        return restored
+
+
+@pytest.fixture
+def conversation(monkeypatch):
+    conversation = ArchivedConversation(5)
+    monkeypatch.setattr(redis_manager, "redis_client", None)
+    monkeypatch.setattr(context_service, "MessageService", lambda session: conversation)
+    monkeypatch.setattr(context_service.message_archive_service, "restore", conversation.restore)
+    return conversation
+
+
+@pytest.mark.asyncio
+async def test_archived_history_is_restored_for_chat(conversation):
+    builder = ConversationContextBuilder()
+
+    window = await builder.get_window(None, 1, 3, LocalProvider(), message_count=5)
+    assert [entry["content"] for entry in window] == ["m2", "m3", "m4"]
+    assert conversation.restores == 1
+
+    # 热表消息充足时不再尝试恢复
+    await builder.get_window(None, 1, 3, LocalProvider(), message_count=5)
+    assert conversation.restores == 1
+
+
+@pytest.mark.asyncio
+async def test_window_without_archive_stays_empty(conversation):
+    conversation.archived = []
+    builder = ConversationContextBuilder()
+
+    assert await builder.get_window(None, 1, 3, LocalProvider(), message_count=5) == []
+    assert conversation.restores == 1
+    assert await builder.get_window(None, 1, 3, LocalProvider(), message_count=0) == []
+    assert conversation.restores == 1
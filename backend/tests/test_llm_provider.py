@@ -0,0 +1,95 @@
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.api.sse import format_sse, ndjson_response, sse_response, wants_event_stream
+    from agentpedia.services.llm_service import LocalProvider, llm_registry
+except Exception:
+    pytest.skip("后端依赖未安装，跳过模型提供商测试", allow_module_level=True)
+
+
+async def collect(provider, messages, **kwargs):
+    deltas = []
+    async for delta in provider.stream(messages, "test-model", **kwargs):
+        deltas.append(delta)
+    return deltas
+
+
+@pytest.mark.asyncio
+async def test_local_provider_is_deterministic():
+    messages = [
+        {"role": "system", "content": "你是助手"},
+        {"role": "user", "content": "hello there"},
+    ]
+    first = await collect(LocalProvider(), messages)
+    second = await collect(LocalProvider(), messages)
+
+    text = "".join(d.content for d in first)
+    assert text == "[test-model] 收到：hello there"
+    assert text == "".join(d.content for d in second)
+
+    # 最后一块只携带用量
+    usage = first[-1]
+    assert usage.content == ""
+    assert usage.completion_tokens == len(first) - 1
+    assert usage.prompt_tokens > 0
+
+
+@pytest.mark.asyncio
+async def test_local_provider_respects_max_tokens():
+    deltas = await collect(LocalProvider(), [{"role": "user", "content": "a b c d e"}], max_tokens=2)
+    assert [d.content for d in deltas if d.content] == ["[test-model]", " 收到：a"]
+
+
+def test_registry_falls_back_to_default_provider():
+    assert llm_registry.get("local").name == "local"
+    assert llm_registry.get("MOCK").name == "local"
+    assert llm_registry.get("unknown-provider").name == "local"
+    assert llm_registry.get(None).name == "local"
+
+
+def test_format_sse():
+    assert format_sse({"content": "你好"}) == 'data: {"content": "你好"}\n\n'
+    assert format_sse({"detail": "x"}, "error") == 'event: error\ndata: {"detail": "x"}\n\n'
+
+
+def test_wants_event_stream():
+    assert wants_event_stream("text/event-stream")
+    assert wants_event_stream("application/json, text/event-stream")
+    assert not wants_event_stream("application/json")
+    assert not wants_event_stream(None)
+
+
+@pytest.mark.asyncio
+async def test_sse_response_reports_errors_as_events():
+    async def events():
+        yield {"content": "a"}
+        raise RuntimeError("boom")
+
+    response = sse_response(events())
+    assert response.media_type == "text/event-stream"
+    assert response.headers["x-accel-buffering"] == "no"
+
+    body = [chunk async for chunk in response.body_iterator]
+    assert body[0] == 'data: {"content": "a"}\n\n'
+    assert body[1].startswith("event: error\n")
+
+
+@pytest.mark.asyncio
+async def test_ndjson_response_writes_one_object_per_line():
+    async def items():
+        yield {"type": "conversation", "id": 1}
+        yield {"type": "message", "content": "你好"}
+
+    response = ndjson_response(items(), filename="conversation-1.ndjson")
+    assert response.media_type == "application/x-ndjson"
+    assert response.headers["content-disposition"] == 'attachment; filename="conversation-1.ndjson"'
+
+    body = [chunk async for chunk in response.body_iterator]
+    assert body == ['{"type": "conversation", "id": 1}\n', '{"type": "message", "content": "你好"}\n']
@@ -0,0 +1,76 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.exceptions import ValidationError
+    from agentpedia.schemas.base import CursorPage
+    from agentpedia.services.conversation_service import (
+        SEARCH_MAX_TERMS,
+        MessageService,
+        _decode_search_cursor,
+        _search_terms,
+        highlight_snippet,
+    )
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过消息搜索测试", allow_module_level=True)
+
+
+class FakeResult(list):
+    pass
+
+
+class FakeSession:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def execute(self, statement):
+        return FakeResult(SimpleNamespace(_mapping=row) for row in self.rows)
+
+
+def test_terms_are_split_deduplicated_and_capped():
+    assert _search_terms("  redis  cache redis ") == ["redis", "cache"]
+    assert len(_search_terms(" ".join(f"t{i}" for i in range(10)))) == SEARCH_MAX_TERMS
+    assert _search_terms("   ") == []
+
+
+def test_snippet_is_escaped_before_highlighting():
+    snippet = highlight_snippet('<script>alert("x")</script> Redis & redis', ["redis", "script"])
+    assert snippet == (
+        '&lt;<mark>script</mark>&gt;alert("x")&lt;/<mark>script</mark>&gt; '
+        "<mark>Redis</mark> &amp; <mark>redis</mark>"
+    )
+    # 关键词本身含有特殊字符时同样转义
+    assert highlight_snippet("a<b", ["<"]) == "a<mark>&lt;</mark>b"
+
+
+def test_search_cursor_round_trip_and_validation():
+    cursor = CursorPage.encode_cursor({"rank": 0.5, "id": 42})
+    assert _decode_search_cursor(cursor) == (0.5, 42)
+    with pytest.raises(ValidationError):
+        _decode_search_cursor("not-a-cursor")
+    with pytest.raises(ValidationError):
+        _decode_search_cursor(CursorPage.encode_cursor({"id": 1}))
+
+
+@pytest.mark.asyncio
+async def test_search_returns_next_cursor_from_last_row():
+    rows = [
+        {"message_id": 3, "snippet": "<b>redis</b>", "rank": 0.9},
+        {"message_id": 2, "snippet": "redis", "rank": 0.7},
+        {"message_id": 1, "snippet": "redis", "rank": 0.1},
+    ]
+    results, next_cursor = await MessageService(FakeSession(rows)).search_messages(1, "redis", limit=2)
+
+    assert [r["message_id"] for r in results] == [3, 2]
+    assert results[0]["snippet"] == "&lt;b&gt;<mark>redis</mark>&lt;/b&gt;"
+    assert _decode_search_cursor(next_cursor) == (0.7, 2)
+
+    with pytest.raises(ValidationError):
+        await MessageService(FakeSession(rows)).search_messages(1, "   ")
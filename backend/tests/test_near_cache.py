@@ -0,0 +1,101 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import INVALIDATION_CHANNEL, RedisManager
+except Exception:
+    pytest.skip("后端依赖未安装，跳过近端缓存测试", allow_module_level=True)
+
+
+class MemoryRedis:
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+        self.on_read = None
+
+    async def get(self, key):
+        self.reads += 1
+        value = self.data.get(key)
+        if self.on_read:
+            self.on_read(key)
+        return value
+
+
+def tracked_manager(data):
+    manager = RedisManager()
+    manager.redis_client = MemoryRedis(data)
+    cache = manager.near_cache
+    cache.prefixes = ("catalog:",)
+    cache._hub = SimpleNamespace(connected=True)
+    cache._tracking = True
+    return manager, cache
+
+
+@pytest.mark.asyncio
+async def test_tracked_keys_are_served_locally_until_invalidated():
+    data = {"catalog:version": "1", "other": "x"}
+    manager, cache = tracked_manager(data)
+
+    assert await manager.get_cached("catalog:version") == "1"
+    assert await manager.get_cached("catalog:version") == "1"
+    assert await manager.get_cached("other") == "x"
+    assert await manager.get_cached("other") == "x"
+    assert manager.redis_client.reads == 3
+
+    data["catalog:version"] = "2"
+    cache._on_invalidate(INVALIDATION_CHANNEL, ["catalog:version"])
+    assert await manager.get_cached("catalog:version") == "2"
+
+    # 订阅连接断开时跟踪失效，直接读取 Redis
+    cache._hub.connected = False
+    data["catalog:version"] = "3"
+    assert await manager.get_cached("catalog:version") == "3"
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_read_is_not_cached():
+    manager, cache = tracked_manager({"catalog:version": "1"})
+    manager.redis_client.on_read = lambda key: cache._on_invalidate(INVALIDATION_CHANNEL, [key])
+
+    assert await manager.get_cached("catalog:version") == "1"
+    assert cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_reconnect_drops_entries_that_may_have_missed_invalidations():
+    manager, cache = tracked_manager({"catalog:version": "1"})
+    assert await manager.get_cached("catalog:version") == "1"
+
+    class Connection:
+        async def send_command(self, *args):
+            pass
+
+        async def read_response(self):
+            return 7
+
+    await cache._enable_tracking(Connection())
+    assert cache.enabled and cache.stats()["size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rbac_version_reads_go_through_near_cache(monkeypatch):
+    from agentpedia.core import redis as redis_module
+    from agentpedia.services.permission_cache import VERSION_KEY, PermissionCache
+
+    manager, cache = tracked_manager({VERSION_KEY: "4"})
+    cache.prefixes = (VERSION_KEY,)
+    monkeypatch.setattr(redis_module.redis_manager, "redis_client", manager.redis_client)
+    monkeypatch.setattr(redis_module.redis_manager, "near_cache", cache)
+
+    permissions = PermissionCache()
+    await permissions.refresh_version()
+    await permissions.refresh_version()
+    assert permissions._version == 4
+    assert manager.redis_client.reads == 1
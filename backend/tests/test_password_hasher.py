@@ -0,0 +1,62 @@
+import asyncio
+import sys
+import threading
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core import security
+    from agentpedia.core.security import PasswordHasher, PasswordHasherBusyError
+except Exception:
+    pytest.skip("后端依赖未安装，跳过密码哈希测试", allow_module_level=True)
+
+
+def test_saturated_pool_rejects_with_retry_after(monkeypatch):
+    monkeypatch.setattr(security.settings, "PASSWORD_HASH_WORKERS", 1)
+    monkeypatch.setattr(security.settings, "PASSWORD_HASH_QUEUE_SIZE", 1)
+    hasher = PasswordHasher()
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.create_task(hasher._run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        assert hasher.stats()["in_flight"] == 1
+        assert hasher.stats()["queue_depth"] == 1
+
+        with pytest.raises(PasswordHasherBusyError) as exc_info:
+            await hasher._run(release.wait, 5)
+        assert exc_info.value.retry_after >= 1
+
+        release.set()
+        await asyncio.gather(*running)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+
+    stats = hasher.stats()
+    assert (stats["completed"], stats["rejected"], stats["queue_depth"]) == (2, 1, 0)
+
+
+def test_event_loop_keeps_running_while_hashing():
+    hasher = PasswordHasher()
+    release = threading.Event()
+
+    async def scenario():
+        task = asyncio.create_task(hasher._run(release.wait, 5))
+        # 哈希任务在线程池中阻塞时，事件循环仍能调度其他协程
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        release.set()
+        assert await task is True
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
@@ -0,0 +1,46 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import redis_manager
+    from agentpedia.services.permission_cache import PermissionCache, PermissionSet
+except Exception:
+    pytest.skip("后端依赖未安装，跳过权限缓存测试", allow_module_level=True)
+
+
+def test_permission_set_bits_and_roundtrip():
+    permission_set = PermissionSet.compile([1, 5, 70], wildcard=False, version=3)
+    assert permission_set.has_bit(5) and permission_set.has_bit(70)
+    assert not permission_set.has_bit(2)
+    assert not permission_set.has_bit(None)
+    assert PermissionSet.from_json(permission_set.to_json()) == permission_set
+    assert PermissionSet.compile([], wildcard=True, version=3).has_bit(None)
+
+
+def test_expired_assignment_is_not_served():
+    assert PermissionSet.compile([1], False, 0, time.time() - 1).expired
+    assert not PermissionSet.compile([1], False, 0, None).expired
+
+
+def test_version_bump_invalidates_local_entries(monkeypatch):
+    monkeypatch.setattr(redis_manager, "redis_client", None)
+    cache = PermissionCache()
+
+    async def scenario():
+        version = await cache.current_version()
+        await cache.store(1, PermissionSet.compile([2], False, version))
+        assert (await cache.get(1, version)).has_bit(2)
+
+        new_version = await cache.bump_version()
+        assert new_version == version + 1
+        assert await cache.get(1, new_version) is None
+
+    asyncio.run(scenario())
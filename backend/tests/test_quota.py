@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.services.quota_service import QuotaDecision, QuotaState, build_limits
+except Exception:
+    pytest.skip("后端依赖未安装，跳过配额测试", allow_module_level=True)
+
+
+def test_build_limits_skips_unset_windows():
+    limits = build_limits("agent", 7, 60, None, 10000)
+    assert [(l.window, l.key, l.limit) for l in limits] == [
+        ("minute", "quota:agent:7:minute", 60),
+        ("day", "quota:agent:7:day", 10000),
+    ]
+
+
+def test_headers_report_tightest_limit():
+    minute, day = build_limits("key", 1, 10, None, 1000)
+    decision = QuotaDecision(
+        allowed=True,
+        states=[QuotaState(minute, 2, 48000, 0), QuotaState(day, 900, 8640000, 0)]
+    )
+    assert decision.headers() == {
+        "X-RateLimit-Limit": "10",
+        "X-RateLimit-Remaining": "2",
+        "X-RateLimit-Reset": "48",
+        "X-RateLimit-Scope": "key-minute",
+    }
+
+
+def test_headers_on_denial_include_retry_after():
+    minute, hour = build_limits("agent", 1, 10, 100, None)
+    decision = QuotaDecision(
+        allowed=False,
+        states=[QuotaState(minute, 0, 60000, 5500), QuotaState(hour, 0, 3600000, 36000)]
+    )
+    headers = decision.headers()
+    assert headers["X-RateLimit-Scope"] == "agent-hour"
+    assert headers["Retry-After"] == "36"
@@ -0,0 +1,42 @@
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.rate_limit import RateLimitMiddleware
+except Exception:
+    pytest.skip("后端依赖未安装，跳过限流中间件测试", allow_module_level=True)
+
+
+@pytest.fixture
+def middleware():
+    async def app(scope, receive, send):
+        pass
+    return RateLimitMiddleware(app)
+
+
+def test_route_groups(middleware):
+    assert middleware._route_group("/api/v1/users/login")[0] == "auth"
+    assert middleware._route_group("/api/v1/agents/3/chat")[0] == "chat"
+    assert middleware._route_group("/api/v1/agents-prd/")[0] == "browse"
+    assert middleware._route_group("/api/v1/wechat/status/abc")[0] == "default"
+
+
+def test_walk_page_only_for_browse_listing(middleware):
+    scope = {"method": "GET", "query_string": b"page=7&size=20"}
+    assert middleware._walk_page(scope, "browse") == 7
+    assert middleware._walk_page(scope, "default") == -1
+    assert middleware._walk_page({"method": "GET", "query_string": b"size=20"}, "browse") == -1
+
+
+def test_local_block_short_circuits(middleware):
+    import time
+
+    middleware._blocked[("*", "10.0.0.1")] = time.monotonic() + 30
+    assert middleware._check_local("browse", "10.0.0.1", -1) > 0
+    assert middleware._check_local("browse", "10.0.0.2", -1) is None
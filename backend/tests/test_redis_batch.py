@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import RedisManager
+except Exception:
+    pytest.skip("后端依赖未安装，跳过Redis批量接口测试", allow_module_level=True)
+
+
+def test_scripts_are_registered_once_by_sha():
+    manager = RedisManager()
+    source = "return redis.call('GET', KEYS[1])"
+    script = manager.register_script(source)
+    assert manager.register_script(source) is script
+    assert len(script.sha) == 40
+
+
+@pytest.mark.asyncio
+async def test_pipeline_without_redis_resolves_defaults():
+    manager = RedisManager()
+    async with manager.pipeline() as pipe:
+        value = pipe.get_json("agent:1")
+        count = pipe.incr("views:1")
+        member = pipe.sismember("favorites:1", "2")
+        with pytest.raises(RuntimeError):
+            value.value
+
+    assert (value.value, count.value, member.value) == (None, 0, False)
+    assert await manager.mget_json(["a", "b"]) == [None, None]
+    assert await manager.mset_json({"a": {"x": 1}}) is False
@@ -0,0 +1,96 @@
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from fastapi import Depends, FastAPI
+    from fastapi.testclient import TestClient
+    from agentpedia.api import deps
+    from agentpedia.api.deps import get_authorization, get_current_active_user, require
+    from agentpedia.models.permission import Permission, PermissionAction, PermissionResource
+    from agentpedia.services.permission_cache import PermissionSet, permission_cache
+    from agentpedia.services.rbac_service import rbac_service
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过权限依赖测试", allow_module_level=True)
+
+
+DELETE_CODE = Permission.generate_code(PermissionResource.AGENT, PermissionAction.DELETE)
+MANAGE_CODE = Permission.generate_code(PermissionResource.AGENT, PermissionAction.MANAGE)
+BITS = {DELETE_CODE: 1, MANAGE_CODE: 2}
+
+OWNER, OTHER, MANAGER, NOBODY = 10, 11, 12, 13
+GRANTS = {OWNER: [1], OTHER: [1], MANAGER: [2], NOBODY: []}
+
+
+@pytest.fixture
+def compiled(monkeypatch):
+    calls = []
+
+    async def get_permission_set(user_id):
+        calls.append(user_id)
+        return PermissionSet.compile(GRANTS[user_id], False, 0)
+
+    async def get_permission_bit(code):
+        return permission_cache.bit(code)
+
+    monkeypatch.setattr(rbac_service, "get_permission_set", get_permission_set)
+    monkeypatch.setattr(rbac_service, "get_permission_bit", get_permission_bit)
+    monkeypatch.setattr(permission_cache, "_bits", BITS)
+    return calls
+
+
+def client_for(user_id):
+    app = FastAPI()
+
+    async def load_item(item_id: int):
+        return SimpleNamespace(id=item_id, owner_id=OWNER)
+
+    guard = require(
+        PermissionResource.AGENT,
+        PermissionAction.DELETE,
+        load=load_item,
+        owned=lambda item, user: item.owner_id == user.id
+    )
+
+    @app.delete("/items/{item_id}", status_code=204)
+    async def delete_item(item=Depends(guard)):
+        return None
+
+    @app.post("/items", status_code=204)
+    async def create_item(user=Depends(require(PermissionResource.AGENT, PermissionAction.DELETE))):
+        return None
+
+    app.dependency_overrides[get_current_active_user] = lambda: SimpleNamespace(id=user_id)
+    return TestClient(app)
+
+
+def test_owner_needs_action_others_need_manage(compiled):
+    assert client_for(OWNER).delete("/items/1").status_code == 204
+    assert client_for(OTHER).delete("/items/1").status_code == 403
+    assert client_for(MANAGER).delete("/items/1").status_code == 204
+    assert client_for(NOBODY).delete("/items/1").status_code == 403
+
+    # 不加载对象时：拥有该权限或 manage 权限即可
+    assert client_for(OTHER).post("/items").status_code == 204
+    assert client_for(MANAGER).post("/items").status_code == 204
+    assert client_for(NOBODY).post("/items").status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_authorization_is_resolved_once_per_request(compiled):
+    user = SimpleNamespace(id=OWNER)
+    request = SimpleNamespace(state=SimpleNamespace())
+
+    first = await get_authorization(request, user)
+    second = await get_authorization(request, user)
+
+    assert first is second
+    assert compiled == [OWNER]
+    assert first.can(DELETE_CODE) and not first.can(MANAGE_CODE)
+    assert deps.Authorization(user, PermissionSet.compile([], True, 0)).can(MANAGE_CODE)
@@ -0,0 +1,213 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from agentpedia.core.redis import redis_manager
+    from agentpedia.services import usage_service
+    from agentpedia.services.usage_service import HOUR_FORMAT, SNAPSHOT_ID_FIELD, APIKeyUsageBuffer, _flush_snapshot
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过使用统计缓冲测试", allow_module_level=True)
+
+
+class MemoryPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class MemoryRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.strings = {}
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    async def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = str(int(fields.get(field, 0)) + amount)
+
+    async def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    async def hmget(self, key, *fields):
+        if len(fields) == 1 and isinstance(fields[0], list):
+            fields = fields[0]
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    async def expire(self, key, seconds):
+        return True
+
+    async def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        return True
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def run_script(self, script, keys=(), args=()):
+        """按 usage_service 中脚本的语义在内存中执行"""
+        if script is usage_service._take_snapshot_script:
+            pending, flushing = keys
+            if flushing not in self.hashes:
+                if pending not in self.hashes:
+                    return 0
+                self.hashes[flushing] = self.hashes.pop(pending)
+            self.hashes[flushing].setdefault(args[0], args[1])
+            return 1
+        if script is usage_service._delete_snapshot_script:
+            if self.hashes.get(keys[0], {}).get(args[0]) == args[1]:
+                del self.hashes[keys[0]]
+                return 1
+            return 0
+        if script is usage_service._release_lock_script:
+            if self.strings.get(keys[0]) == args[0]:
+                del self.strings[keys[0]]
+                return 1
+            return 0
+        raise AssertionError("unexpected script")
+
+
+def test_parse_snapshot_groups_fields_per_key():
+    at = datetime(2024, 5, 1, 12, 30)
+    rows = APIKeyUsageBuffer()._parse_snapshot({
+        "1:calls": "3",
+        "1:last_used_at": at.isoformat(),
+        "1:last_used_ip": "10.0.0.1",
+        "2:calls": "2",
+        "2:last_used_ip": "",
+        # 只有最后使用信息、没有调用次数的条目不写回
+        "3:last_used_at": at.isoformat(),
+    })
+
+    assert sorted(rows, key=lambda row: row["key_id"]) == [
+        {"key_id": 1, "calls": 3, "last_used_at": at, "last_used_ip": "10.0.0.1"},
+        {"key_id": 2, "calls": 2, "last_used_at": None, "last_used_ip": None},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_calls_are_bucketed_per_hour(monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(redis_manager, "redis_client", redis)
+    buffer = APIKeyUsageBuffer()
+
+    await buffer.record(5, "10.0.0.1")
+    await buffer.record(5, "10.0.0.2")
+
+    now = datetime.utcnow()
+    assert redis.hashes[buffer.hourly_key(5, now)][now.strftime(HOUR_FORMAT)] == "2"
+    assert (await buffer.pending(5))[0] == 2
+
+    # 前一小时（可能跨天，落在另一个哈希里）
+    previous = now - timedelta(hours=1)
+    await redis.hincrby(buffer.hourly_key(5, previous), previous.strftime(HOUR_FORMAT), 4)
+
+    usage = await buffer.hourly_usage(5, hours=3)
+    current = now.replace(minute=0, second=0, microsecond=0)
+    assert [hour for hour, _ in usage] == [current - timedelta(hours=2), current - timedelta(hours=1), current]
+    assert [count for _, count in usage] == [0, 4, 2]
+
+
+@pytest.mark.asyncio
+async def test_failed_local_flush_keeps_latest_usage(monkeypatch):
+    monkeypatch.setattr(redis_manager, "redis_client", None)
+    older = datetime(2024, 5, 1, 12)
+    newer = older + timedelta(hours=1)
+    buffer = APIKeyUsageBuffer()
+    buffer._local = {
+        1: {"calls": 1, "last_used_at": older, "last_used_ip": "10.0.0.1"},
+        2: {"calls": 2, "last_used_at": newer, "last_used_ip": "10.0.0.2"},
+    }
+
+    async def failing_apply(rows):
+        # 写库期间又累积了新的调用
+        buffer._local[1] = {"calls": 1, "last_used_at": newer, "last_used_ip": "10.0.0.3"}
+        buffer._local[2] = {"calls": 1, "last_used_at": older, "last_used_ip": "10.0.0.4"}
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(buffer, "_apply", failing_apply)
+    with pytest.raises(RuntimeError):
+        await buffer.flush()
+
+    # 次数累加，最后使用时间与 IP 取较新的一方
+    assert buffer._local == {
+        1: {"calls": 2, "last_used_at": newer, "last_used_ip": "10.0.0.3"},
+        2: {"calls": 3, "last_used_at": newer, "last_used_ip": "10.0.0.2"},
+    }
+
+
+def snapshot_redis(monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(redis_manager, "redis_client", redis)
+    monkeypatch.setattr(redis_manager, "run_script", redis.run_script)
+    return redis
+
+
+async def flush(redis, handle):
+    return await _flush_snapshot(redis, "pending", "flushing", "lock", 60, handle)
+
+
+@pytest.mark.asyncio
+async def test_snapshot_keeps_its_id_until_written(monkeypatch):
+    redis = snapshot_redis(monkeypatch)
+    redis.hashes["pending"] = {"1:calls": "2"}
+    seen = []
+
+    async def failing(raw, snapshot_id):
+        seen.append((raw, snapshot_id))
+        raise RuntimeError("database unavailable")
+
+    with pytest.raises(RuntimeError):
+        await flush(redis, failing)
+    assert "lock" not in redis.strings
+
+    # 失败期间新到的增量进入新的 pending，不混入待重试的快照
+    redis.hashes["pending"] = {"1:calls": "5"}
+
+    async def succeeding(raw, snapshot_id):
+        seen.append((raw, snapshot_id))
+        return 1
+
+    assert await flush(redis, succeeding) == 1
+    assert seen[0] == seen[1]
+    assert seen[0][0] == {"1:calls": "2"}
+    assert "flushing" not in redis.hashes
+    assert redis.hashes["pending"] == {"1:calls": "5"}
+
+
+@pytest.mark.asyncio
+async def test_stale_worker_leaves_newer_snapshot_and_lock_alone(monkeypatch):
+    redis = snapshot_redis(monkeypatch)
+    redis.hashes["pending"] = {"1:calls": "2"}
+
+    async def slow(raw, snapshot_id):
+        # 写库超过锁的有效期：锁已被另一个 worker 取得，快照也已被替换
+        redis.strings["lock"] = "other-worker"
+        redis.hashes["flushing"] = {"1:calls": "7", SNAPSHOT_ID_FIELD: "newer"}
+        return 1
+
+    assert await flush(redis, slow) == 1
+    assert redis.strings["lock"] == "other-worker"
+    assert redis.hashes["flushing"][SNAPSHOT_ID_FIELD] == "newer"
+
+    # 锁被占用时不处理
+    assert await flush(redis, slow) == 0
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    from fastapi import HTTPException
+    from agentpedia.schemas.wechat import WechatCallbackRequest
+    from agentpedia.services import wechat_auth_service as auth_module
+    from agentpedia.services.wechat_auth_service import WechatAuthService
+    from agentpedia.services.wechat_oauth import WechatAPIError
+except Exception:
+    pytest.skip("后端依赖未安装或模型不可用，跳过微信登录等待测试", allow_module_level=True)
+
+
+class FakeHub:
+    def __init__(self, connected=True):
+        self.connected = connected
+        self.handlers = {}
+
+    async def subscribe(self, channel, handler):
+        self.handlers.setdefault(channel, []).append(handler)
+
+    async def unsubscribe(self, channel, handler):
+        self.handlers[channel].remove(handler)
+        if not self.handlers[channel]:
+            del self.handlers[channel]
+
+    async def publish(self, channel, data="1"):
+        self.notify(channel, data)
+
+    def notify(self, channel, data="1"):
+        for handler in list(self.handlers.get(channel, [])):
+            handler(channel, data)
+
+
+class FakeSessions:
+    def __init__(self):
+        self.data = {}
+        self.redis_client = self
+
+    async def get_json(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, keepttl=False, xx=False):
+        assert keepttl
+        if xx and key not in self.data:
+            return None
+        self.data[key] = json.loads(value)
+        return True
+
+
+@pytest.fixture
+def env(monkeypatch):
+    hub, sessions = FakeHub(), FakeSessions()
+    monkeypatch.setattr(auth_module, "pubsub_hub", hub)
+    monkeypatch.setattr(auth_module, "redis_manager", sessions)
+    service = WechatAuthService()
+    monkeypatch.setattr(service.settings, "WECHAT_LOGIN_WAIT_TIMEOUT", 5)
+    monkeypatch.setattr(service.settings, "WECHAT_LOGIN_POLL_INTERVAL", 0.01)
+    return service, hub, sessions
+
+
+def finish(hub, sessions, session_id):
+    sessions.data[f"wechat_login:{session_id}"] = {"status": "success"}
+    hub.notify(WechatAuthService._done_channel(session_id))
+
+
+@pytest.mark.asyncio
+async def test_finished_session_returns_immediately(env):
+    service, hub, sessions = env
+    sessions.data["wechat_login:s1"] = {"status": "success"}
+
+    result = await asyncio.wait_for(service.wait_for_login("s1", 30), 1)
+
+    assert result["status"] == "success"
+    assert hub.handlers == {}
+
+
+@pytest.mark.asyncio
+async def test_timeout_returns_pending_and_notification_wakes_waiter(env):
+    service, hub, sessions = env
+    sessions.data["wechat_login:s1"] = {"status": "pending"}
+
+    assert (await service.wait_for_login("s1", 0.05))["status"] == "pending"
+    assert hub.handlers == {}
+
+    waiter = asyncio.create_task(service.wait_for_login("s1", 30))
+    await asyncio.sleep(0.01)
+    finish(hub, sessions, "s1")
+    assert (await asyncio.wait_for(waiter, 1))["status"] == "success"
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_polling_without_subscription(env):
+    service, hub, sessions = env
+    hub.connected = False
+    sessions.data["wechat_login:s1"] = {"status": "pending"}
+
+    waiter = asyncio.create_task(service.wait_for_login("s1", 30))
+    await asyncio.sleep(0.02)
+    # 订阅不可用时没有通知，只靠轮询发现状态变化
+    sessions.data["wechat_login:s1"] = {"status": "failed"}
+    assert (await asyncio.wait_for(waiter, 1))["status"] == "failed"
+
+
+@pytest.mark.asyncio
+async def test_stream_ends_on_success(env):
+    service, hub, sessions = env
+    sessions.data["wechat_login:s1"] = {"status": "pending"}
+
+    async def complete_later():
+        await asyncio.sleep(0.02)
+        finish(hub, sessions, "s1")
+
+    completer = asyncio.create_task(complete_later())
+    events = [
+        event["status"]
+        async for event in service.stream_login_status("s1")
+    ]
+    await completer
+
+    assert events == ["pending", "success"]
+    assert hub.handlers == {}
+
+
+@pytest.mark.asyncio
+async def test_stream_reports_expired_session(env):
+    service, _, _ = env
+    events = [event async for event in service.stream_login_status("missing")]
+    assert events == [{"session_id": "missing", "status": "expired"}]
+
+
+class FailingOAuth:
+    def __init__(self, error):
+        self.error = error
+
+    async def fetch_access_token(self, code):
+        raise self.error
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error, status_code", [(WechatAPIError(), 400), (RuntimeError("boom"), 500)])
+async def test_failed_callback_ends_waiting_sessions(env, error, status_code):
+    service, hub, sessions = env
+    service.oauth = FailingOAuth(error)
+    sessions.data["wechat_login:s1"] = {"status": "pending", "login_url": "u"}
+
+    waiter = asyncio.create_task(service.wait_for_login("s1", 30))
+    await asyncio.sleep(0.01)
+    with pytest.raises(HTTPException) as exc_info:
+        await service.handle_callback(WechatCallbackRequest(code="c", state="s1"))
+
+    assert exc_info.value.status_code == status_code
+    assert (await asyncio.wait_for(waiter, 1))["status"] == "failed"
+    assert sessions.data["wechat_login:s1"] == {"status": "failed", "login_url": "u"}
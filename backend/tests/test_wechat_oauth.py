@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+import pytest
+
+# 允许直接从src导入而不安装包
+ROOT = Path(__file__).resolve().parents[1]
+SRC = ROOT / "src"
+sys.path.insert(0, str(SRC))
+
+try:
+    import httpx
+    from agentpedia.services import wechat_oauth
+    from agentpedia.services.wechat_oauth import WechatAPIError, WechatOAuthClient
+except Exception:
+    pytest.skip("后端依赖未安装，跳过微信OAuth测试", allow_module_level=True)
+
+
+class MemoryRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key, (None,))[0]
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = (value, ex)
+
+
+def stub_wechat(calls):
+    """本地桩服务：模拟微信开放平台接口"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        params = request.url.params
+        if request.url.path == "/sns/oauth2/access_token":
+            if params["code"] == "bad":
+                return httpx.Response(200, json={"errcode": 40029, "errmsg": "invalid code"})
+            return httpx.Response(200, json={"access_token": "user-token", "openid": "o-1"})
+        if request.url.path == "/sns/userinfo":
+            return httpx.Response(200, json={"openid": params["openid"], "nickname": "微信用户"})
+        if request.url.path == "/cgi-bin/token":
+            return httpx.Response(200, json={"access_token": "app-token", "expires_in": 7200})
+        return httpx.Response(404)
+
+    return httpx.MockTransport(handler)
+
+
+@pytest.fixture
+def configured(monkeypatch):
+    monkeypatch.setattr(wechat_oauth.settings, "WECHAT_APP_ID", "wx-app")
+    monkeypatch.setattr(wechat_oauth.settings, "WECHAT_APP_SECRET", "secret")
+
+
+@pytest.mark.asyncio
+async def test_oauth_flow_against_stub_server(configured):
+    calls = []
+    client = WechatOAuthClient("http://wechat.test", transport=stub_wechat(calls))
+    try:
+        token = await client.fetch_access_token("good")
+        info = await client.get_user_info(token["access_token"], token["openid"])
+        assert info == {"openid": "o-1", "nickname": "微信用户"}
+
+        with pytest.raises(WechatAPIError) as exc:
+            await client.fetch_access_token("bad")
+        assert exc.value.errcode == 40029
+    finally:
+        await client.close()
+    assert calls == ["/sns/oauth2/access_token", "/sns/userinfo", "/sns/oauth2/access_token"]
+
+
+@pytest.mark.asyncio
+async def test_app_access_token_is_cached_until_expiry(configured, monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(wechat_oauth.redis_manager, "redis_client", redis)
+    calls = []
+    client = WechatOAuthClient("http://wechat.test", transport=stub_wechat(calls))
+    try:
+        assert await client.get_app_access_token() == "app-token"
+        assert await client.get_app_access_token() == "app-token"
+    finally:
+        await client.close()
+
+    assert calls == ["/cgi-bin/token"]
+    margin = wechat_oauth.settings.WECHAT_APP_TOKEN_REFRESH_MARGIN
+    assert redis.data["wechat:app_token:wx-app"] == ("app-token", 7200 - margin)